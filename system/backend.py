@@ -4,15 +4,15 @@ import random
 import httpx
 
 
-import sys
 import ctypes
 import json
 import shutil
 import sqlite3
 import logging
 import time
-import subprocess
+import threading
 import uuid
+import itertools
 from pathlib import Path
 from typing import List, Optional, Dict, Any, Generator
 from datetime import datetime, timedelta
@@ -24,10 +24,11 @@ try:
 except ImportError:
     psutil = None
 
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, status, Body, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, status, Body, UploadFile, File, Form, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.responses import StreamingResponse, FileResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from passlib.context import CryptContext
 from jose import JWTError, jwt
@@ -43,13 +44,6 @@ try:
 except ImportError:
     Llama = None
 
-# ChromaDB
-try:
-    import chromadb
-    from chromadb.config import Settings
-except ImportError:
-    chromadb = None
-
 # Document Loaders
 try:
     import docx
@@ -67,6 +61,23 @@ except ImportError:
 
 import hashlib
 
+from index_supervisor import IndexingSupervisor
+from progress_events import ProgressHub
+from scanner import FILE_STATE_SCHEMA, DIR_STATE_SCHEMA, CHECKPOINT_SCHEMA, scan_directories
+from summaries import create_summary_tables
+from shards import list_shards, query_shards, format_timings, bump_generation, read_generation
+from priorities import RAG_HITS_SCHEMA, record_rag_hits, get_pinned_dirs, set_pinned_dirs
+from duplicates import duplicate_paths
+from keyword_index import RAG_RETRIEVAL, get_keyword_index, is_keyword_query, match_expression, keyword_search, fuse_results
+from retrieval_cache import embedding_digest, get_retrieval_cache
+from model_budget import (MODEL_CACHE_MAX_MODELS, ModelCache, model_footprint, gpu_offload_supported,
+                          thread_split)
+from vector_store import VECTOR_STORE, open_vector_store
+from extractors import detect_encoding, extract_chunks
+from splitter import ChunkSpec, iter_chunks, set_tokenizer_model
+from embeddings import (EMBED_MODEL_NAME, EMBED_DIM, embed_model_kwargs, embed_batch, embed_documents, get_embedding_cache,
+                        embed_query, get_query_embedding_cache)
+
 # Setup Logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("oonanji-backend")
@@ -86,6 +97,8 @@ if DB_PATH.exists() and DB_PATH.is_dir():
 
 # Ensure directories exist
 MODELS_DIR.mkdir(exist_ok=True)
+# Upload chunks are sized in tokens of the embedding model (loaded vocab-only on first use)
+set_tokenizer_model(MODELS_DIR / EMBED_MODEL_NAME)
 # MNT_DIR is for external NAS mounts, do not auto-create to respect user's filesystem
 INTERNAL_NAS_DIR.mkdir(exist_ok=True)
 
@@ -117,6 +130,27 @@ class GlobalState:
 
 state = GlobalState()
 
+# Owns the indexer.py worker processes (one per storage root)
+index_supervisor = IndexingSupervisor(BASE_DIR / "indexer.py", DB_PATH)
+
+# Storage roots kept indexed by a long-running watcher (inotify, polling for network mounts),
+# e.g. INDEX_WATCH=internal,nas. Opt-in: a watcher is a permanent indexer process holding
+# its extraction pool and the embedding model.
+INDEX_WATCH_MODES = [m.strip() for m in os.environ.get("INDEX_WATCH", "").split(",") if m.strip() in ("nas", "internal")]
+
+def start_watchers(modes: List[str]):
+    if not modes:
+        return
+    if not (MODELS_DIR / EMBED_MODEL_NAME).exists():
+        logger.warning("Embedding model missing, index watchers not started.")
+        return
+    for mode in modes:
+        logger.info(f"Starting index watcher for '{mode}' storage")
+        index_supervisor.start(mode, watch=True)
+
+# Pushes indexing / upload / download progress to /api/events subscribers
+progress_hub = ProgressHub()
+
 def get_db_status():
     try:
         conn = sqlite3.connect(DB_PATH)
@@ -236,8 +270,9 @@ class RemoteLlama:
 
 class ModelManager:
     def __init__(self):
-        self.llms = {}
-        self.embed_models = {}
+        # Loaded models, least recently used first, evicted to fit the budgets (model_budget.py)
+        self.llms = ModelCache("chat")
+        self.embed_models = ModelCache("embedding")
         self.lock = asyncio.Lock()
         import threading
         self.thread_lock = threading.RLock()
@@ -258,115 +293,109 @@ class ModelManager:
             return RemoteLlama(worker_url, model_path)
 
         # 2. Local Logic
-        # Thread-safe access for checking cache
+        # Thread-safe access for checking cache (and to prevent double loading)
         with self.thread_lock:
-             # Exclusive Policy: Unload Embed Models if exists to free VRAM
-             if self.embed_models:
-                 logger.info("Unloading embedding models to free VRAM for LLM...")
-                 keys = list(self.embed_models.keys())
-                 for k in keys:
-                     try:
-                         if hasattr(self.embed_models[k], 'close'):
-                             self.embed_models[k].close()
-                     except: pass
-                     del self.embed_models[k]
-                 self.embed_models.clear()
-                 gc.collect()
-
-             if model_path in self.llms:
-                 return self.llms[model_path]
-        
-             # If not found, load it (using lock to prevent double loading)
-             # Double check pattern
-             if model_path in self.llms:
-                  return self.llms[model_path]
-              
-             # Unload other models ONLY if it's NOT the discord model or we are loading main model over discord model
-             is_discord_model = "discord_" in str(model_path)
-             
-             if not is_discord_model and self.llms:
-                # If loading main model, we might need to unload previous main models.
-                # But try to keep discord model if it exists
-                logger.info("Cleaning up previous LLMs...")
-                keys = list(self.llms.keys())
-                for k in keys:
-                    if "discord_" in str(k): continue # Keep discord model
-                    try:
-                        if hasattr(self.llms[k], 'close'):
-                            self.llms[k].close()
-                        del self.llms[k]
-                    except Exception as ex:
-                        logger.warning(f"Error closing model {k}: {ex}")
+            llm = self.llms.get(model_path)
+            if llm is not None:
+                return llm
+
+            # Determine GPU layers based on model size hints
+            layers = -1
+            if n_gpu_layers is not None:
+                layers = n_gpu_layers
+            elif "7b" in model_path.lower() or "8b" in model_path.lower():
+                # For larger models, force CPU to avoid VRAM OOM on limited hardware
+                logger.info("Forcing CPU for large model to ensure stability.")
+                layers = 0
+
+            # Make room: least recently used chat models first, the embedding model only
+            # if it still doesn't fit beside the ones that are left
+            footprint = model_footprint(model_path, "gpu" if layers != 0 and gpu_offload_supported() else "cpu")
+            evict, fits = self.llms.plan(footprint, self.embed_models, MODEL_CACHE_MAX_MODELS)
+            if not fits and len(self.embed_models):
+                evict, fits = self.llms.plan(footprint, None, MODEL_CACHE_MAX_MODELS)
+                for path in self.embed_models.paths():
+                    self.embed_models.evict(path, "memory")
+            for path in evict:
+                self.llms.evict(path, "memory")
+            if evict:
                 gc.collect()
-            
-             logger.info(f"Loading LLM: {model_path}")
-             
-             # Determine GPU layers based on model size hints
-             layers = -1
-             if n_gpu_layers is not None:
-                 layers = n_gpu_layers
-             elif "7b" in model_path.lower() or "8b" in model_path.lower():
-                  # For larger models, force CPU to avoid VRAM OOM on limited hardware
-                  logger.info("Forcing CPU for large model to ensure stability.")
-                  layers = 0 
-             
-             try:
-                 llm = Llama(
-                     model_path=model_path, 
-                     n_ctx=2048, # Reduced to 2048 to prevent OOM
-                     n_batch=64, 
-                     n_gpu_layers=layers,
-                     verbose=True
-                 )
-                 self.llms[model_path] = llm
-                 return llm
-             except Exception as e:
-                 logger.error(f"Failed to load LLM {model_path} with GPU: {e}")
-                 logger.info("Retrying with CPU fallback...")
-                 try:
-                     llm = Llama(
-                         model_path=model_path, 
-                         n_ctx=2048,
-                         n_batch=64, 
-                         n_gpu_layers=0, # Force CPU
-                         verbose=True
-                     )
-                     self.llms[model_path] = llm
-                     return llm
-                 except Exception as e2:
-                     logger.error(f"Failed to load LLM {model_path} with CPU: {e2}")
-                     raise e2
+            if not fits:
+                logger.warning(f"{os.path.basename(model_path)} exceeds the model memory budget beside pinned models, loading anyway")
+
+            logger.info(f"Loading LLM: {model_path}")
+            start = time.perf_counter()
+            try:
+                llm = Llama(
+                    model_path=model_path, 
+                    n_ctx=2048, # Reduced to 2048 to prevent OOM
+                    n_batch=64, 
+                    n_gpu_layers=layers,
+                    verbose=True,
+                    **self.thread_kwargs(0)
+                )
+            except Exception as e:
+                logger.error(f"Failed to load LLM {model_path} with GPU: {e}")
+                logger.info("Retrying with CPU fallback...")
+                try:
+                    llm = Llama(
+                        model_path=model_path, 
+                        n_ctx=2048,
+                        n_batch=64, 
+                        n_gpu_layers=0, # Force CPU
+                        verbose=True,
+                        **self.thread_kwargs(0)
+                    )
+                    footprint = model_footprint(model_path, "cpu")
+                except Exception as e2:
+                    logger.error(f"Failed to load LLM {model_path} with CPU: {e2}")
+                    raise e2
+            self.llms.add(model_path, llm, footprint, time.perf_counter() - start)
+            return llm
+
+    def thread_kwargs(self, which: int) -> dict:
+        """Llama() n_threads for the chat (0) or embedding (1) model: co-resident models split the cores"""
+        n_threads = thread_split()[which]
+        return {"n_threads": n_threads, "n_threads_batch": n_threads} if n_threads else {}
+
+    def pin(self, name: str, pinned: bool = True):
+        """Pinned chat models (by file name) are never evicted"""
+        self.llms.pin(name, pinned)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"chat": self.llms.stats(), "embedding": self.embed_models.stats()}
 
     def get_embed_model(self, model_path: str):
         with self.thread_lock:
-            # Exclusive Policy: Unload LLMs if exists to free VRAM for Embedding
-            if self.llms:
-                logger.info("Unloading LLMs to free VRAM for Embedding...")
-                keys = list(self.llms.keys())
-                for k in keys:
-                    try:
-                        if hasattr(self.llms[k], 'close'):
-                            self.llms[k].close()
-                    except: pass
-                    del self.llms[k]
-                self.llms.clear()
-                gc.collect()
+            # A resident embedding model is used as is, whatever chat models are loaded
+            embed_model = self.embed_models.get(model_path)
+            if embed_model is not None:
+                return embed_model
 
-            if model_path in self.embed_models:
-                return self.embed_models[model_path]
+            # Memory-budget policy: evict chat models (least recently used first) only as
+            # far as needed for the embedding model to fit beside the rest
+            footprint = model_footprint(model_path, "cpu")
+            evict, _ = self.llms.plan(footprint, self.embed_models)
+            for path in evict:
+                self.llms.evict(path, "memory")
+            if evict:
+                gc.collect()
 
             logger.info(f"Loading Embedding Model: {model_path}")
+            start = time.perf_counter()
             try:
                 # For embeddings, we prefer local processing for speed if possible,
                 # unless offloading is strictly required. For now, keep local CPU/GPU mixed.
+                # n_ctx stays at 2048 (8192 is too large for embeddings alongside chat model and causes OOM crashes),
+                # n_batch/n_ubatch match it so many chunks fit into one multi-sequence decode.
                 embed_model = Llama(
                     model_path=model_path,
-                    embedding=True,
                     n_gpu_layers=0, # Use CPU for embeddings to save VRAM for chat
-                    n_ctx=2048, # 8192 is too large for embeddings alongside chat model and causes OOM crashes
-                    verbose=False
+                    verbose=False,
+                    **embed_model_kwargs(),
+                    **self.thread_kwargs(1)
                 )
-                self.embed_models[model_path] = embed_model
+                self.embed_models.add(model_path, embed_model, footprint, time.perf_counter() - start)
                 return embed_model
             except Exception as e:
                 logger.error(f"Failed to load embedding model: {e}")
@@ -431,13 +460,27 @@ def init_db():
     ''')
 
     # File Index State Table
+    cursor.execute(FILE_STATE_SCHEMA)
+
+    # Per-chunk text hashes written by the indexer (chunk-level re-embedding)
     cursor.execute('''
-    CREATE TABLE IF NOT EXISTS file_index_state (
-        path TEXT PRIMARY KEY,
-        modified_time REAL NOT NULL,
-        last_seen REAL NOT NULL
+    CREATE TABLE IF NOT EXISTS chunk_index_state (
+        chunk_id TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        chunk_index INTEGER NOT NULL,
+        chunk_hash TEXT NOT NULL
     )
     ''')
+
+    # Directory tree of the last completed scan (indexer skips unchanged subtrees)
+    cursor.execute(DIR_STATE_SCHEMA)
+    # Progress of an interrupted indexing pass (the next run resumes from it)
+    cursor.execute(CHECKPOINT_SCHEMA)
+    # Directories recent chats retrieved from (indexed first, see priorities.py)
+    cursor.execute(RAG_HITS_SCHEMA)
+
+    # Deferred document summaries and their content-hash cache (written by the indexer)
+    create_summary_tables(cursor)
     
     # User Memory Table
     cursor.execute('''
@@ -600,6 +643,8 @@ class ChunkSearchRequest(BaseModel):
     query: str = ""
     limit: int = 10
     file_path: Optional[str] = None
+    # vector | keyword | hybrid (default: RAG_RETRIEVAL)
+    mode: Optional[str] = None
 
 class ChunkResult(BaseModel):
     id: str
@@ -627,8 +672,41 @@ class CanvasUpdate(BaseModel):
     language: Optional[str] = None
 
 # --- RAG & Indexing ---
-def get_chroma_client():
-    return chromadb.PersistentClient(path=str(CHROMA_DB_DIR))
+def get_vector_client():
+    # Chroma, or the native store (VECTOR_STORE=native); both keep their files under chroma_db/
+    return open_vector_store(CHROMA_DB_DIR)
+
+def record_search_hits(metas: List[Dict[str, Any]]):
+    """Remember which folders chats retrieve from; the indexer works on those first"""
+    paths = [m["path"] for m in metas if m and m.get("path")]
+    if not paths:
+        return
+    try:
+        conn = sqlite3.connect(DB_PATH, timeout=5)
+        try:
+            record_rag_hits(conn, paths)
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.warning(f"Could not record RAG hits: {e}")
+
+def attach_duplicate_paths(metas: List[Dict[str, Any]]):
+    """Identical files are indexed once: list the other copies' paths on each hit (duplicate_paths)"""
+    paths = [m["path"] for m in metas if m and m.get("path")]
+    if not paths:
+        return
+    try:
+        conn = sqlite3.connect(DB_PATH, timeout=5)
+        try:
+            copies = duplicate_paths(conn, paths)
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.warning(f"Could not look up duplicate files: {e}")
+        return
+    for m in metas:
+        if m and m.get("path") in copies:
+            m["duplicate_paths"] = copies[m["path"]]
 
 class GGUFEmbeddingFunction:
     def __init__(self, model_path):
@@ -642,21 +720,80 @@ class GGUFEmbeddingFunction:
                 if not llm:
                     logger.error("Embedding model not loaded")
                     return [[] for _ in input] # Return empty if failed
-                    
-                embeddings = []
-                for i, text in enumerate(input):
-                    try:
-                        # Llama.cpp embedding
-                        embed = llm.create_embedding(text)
-                        embeddings.append(embed['data'][0]['embedding'])
-                    except Exception as e:
-                        logger.error(f"Failed to create embedding for text {i}: {e}")
-                        # Return zero vector as fallback
-                        embeddings.append([0.0] * 768)  # nomic-embed has 768 dimensions
-                return embeddings
+
+                return embed_batch(llm, input)
             except Exception as e:
                 logger.error(f"Critical error in embedding function: {e}")
-                return [[0.0] * 768 for _ in input]
+                return [[0.0] * EMBED_DIM for _ in input]
+
+RETRIEVAL_MODES = ("vector", "keyword", "hybrid")
+
+def read_index_generation(base: str) -> Optional[int]:
+    try:
+        conn = sqlite3.connect(DB_PATH, timeout=5)
+        try:
+            return read_generation(conn, base)
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.warning(f"Could not read index generation of {base}: {e}")
+        return None
+
+async def retrieve_chunks(collections: List[Any], base: str, message: str, query_text: str, embed_model_path: Path,
+                          n_results: int, mode: Optional[str] = None):
+    """
+    Ranked chunks for a query, shaped like query_shards' results: vector search, BM25 keyword
+    search, or (hybrid) both at once fused by reciprocal rank. Lookups of codes, file names
+    or quoted phrases and keyword mode don't touch the embedding model; when they find
+    nothing, vector search is tried. Both searches go through the retrieval cache of the
+    current index generation. Returns (results, shard timings, mode used).
+    """
+    mode = mode if mode in RETRIEVAL_MODES else RAG_RETRIEVAL
+    has_model = embed_model_path.exists()
+    cache = get_retrieval_cache()
+    generation = await run_in_threadpool(read_index_generation, base)
+    names = tuple(c.name for c in collections)
+    misses = []
+
+    def cached(kind: str, query: str, search):
+        key = (kind, base, generation, names, query, n_results)
+        if generation is not None:
+            results = cache.get(key)
+            if results is not None:
+                return results, []
+        misses.append(kind)
+        results, shard_timings = search()
+        # A failed shard means partial results: not cached
+        if generation is not None and not any("error" in t for t in shard_timings):
+            cache.put(key, results)
+        return results, shard_timings
+
+    def vector_search():
+        # Repeated questions are answered from the query embedding cache
+        query_embed = embed_query(GGUFEmbeddingFunction(str(embed_model_path)), query_text)
+        return cached("vector", embedding_digest(query_embed),
+                      lambda: query_shards(collections, query_embed, n_results))
+
+    def keyword_lookup():
+        results, _ = cached("keyword", match_expression(message),
+                            lambda: (keyword_search(collections, message, n_results), []))
+        return results
+
+    def used(mode: str) -> str:
+        return mode if misses else f"{mode} (cached)"
+
+    if mode == "keyword" or not has_model or (mode == "hybrid" and is_keyword_query(message)):
+        results = await run_in_threadpool(keyword_lookup)
+        if results["ids"][0] or not has_model:
+            return results, [], used("keyword")
+        mode = "vector"
+        misses.clear()
+    if mode == "vector":
+        results, shard_timings = await run_in_threadpool(vector_search)
+        return results, shard_timings, used("vector")
+    (results, shard_timings), keyword_results = await asyncio.gather(
+        run_in_threadpool(vector_search), run_in_threadpool(keyword_lookup))
+    return fuse_results([results, keyword_results], n_results), shard_timings, used("hybrid")
 
 def read_docx_file(path: Path) -> str:
     if not docx: return ""
@@ -694,55 +831,6 @@ def read_pdf_file(path: Path) -> str:
         logger.warning(f"Error reading pdf {path}: {e}")
         return ""
 
-def recursive_character_text_splitter(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> List[str]:
-    """
-    Splits text recursively by separators to keep related content together.
-    Separators: \n\n, \n, . , space, empty
-    """
-    separators = ["\n\n", "\n", ". ", " ", ""]
-    
-    def _split_text(text: str, separators: List[str]) -> List[str]:
-        final_chunks = []
-        separator = separators[-1]
-        new_separators = []
-        
-        for i, sep in enumerate(separators):
-            if sep == "":
-                separator = ""
-                break
-            if sep in text:
-                separator = sep
-                new_separators = separators[i+1:]
-                break
-        
-        splits = text.split(separator) if separator else list(text)
-        
-        good_splits = []
-        for s in splits:
-            if s.strip():
-                good_splits.append(s if separator == "" else s + separator)
-        
-        current_chunk = ""
-        for s in good_splits:
-            if len(current_chunk) + len(s) < chunk_size:
-                current_chunk += s
-            else:
-                if current_chunk:
-                    final_chunks.append(current_chunk)
-                current_chunk = s
-                if len(current_chunk) > chunk_size and new_separators:
-                    # Recursively split if still too big
-                    sub_chunks = _split_text(current_chunk, new_separators)
-                    final_chunks.extend(sub_chunks)
-                    current_chunk = ""
-        
-        if current_chunk:
-            final_chunks.append(current_chunk)
-            
-        return final_chunks
-
-    return _split_text(text, separators)
-
 import psutil
 try:
     import psutil
@@ -785,7 +873,7 @@ def index_documents_task():
         db_cursor = db_conn.cursor()
         log("Database connection established.")
 
-        embed_model_name = "nomic-embed-text-v1.5.f16.gguf"
+        embed_model_name = EMBED_MODEL_NAME
         embed_model_path = MODELS_DIR / embed_model_name
         if not embed_model_path.exists():
             log(f"CRITICAL: Embedding model {embed_model_name} missing.")
@@ -797,7 +885,7 @@ def index_documents_task():
         log("Embedding function initialized.")
         
         log("Initializing ChromaDB...")
-        client = get_chroma_client()
+        client = get_vector_client()
         collection = client.get_or_create_collection(name="nas_documents", embedding_function=embedding_fn)
         log("ChromaDB collection loaded.")
 
@@ -805,10 +893,11 @@ def index_documents_task():
         log("Starting scan and index process...")
         
         batch_size = 10
-        current_batch_ids, current_batch_docs, current_batch_metadatas = [], [], []
+        current_batch_ids, current_batch_docs, current_batch_metadatas, current_batch_embeddings = [], [], [], []
         scanned_count, processed_count = 0, 0
         
-        for root, _, files in os.walk(source_dir):
+        for scan in scan_directories(str(source_dir), {}, verify=True):
+            root, files = scan.path, [entry.name for entry in scan.files]
             if state.stop_indexing_flag:
                 log("Stop flag received, breaking scan loop.")
                 break
@@ -847,32 +936,17 @@ def index_documents_task():
                     log(f"  -> Processing required for: {file_key}")
                     state.indexing_status = f"Indexing: {file}..."
                     
-                    content = ""
-                    log(f"    - Reading content...")
-                    if file_path.suffix == '.docx':
-                        content = read_docx_file(file_path)
-                    elif file_path.suffix == '.xlsx':
-                        content = read_excel_file(file_path)
-                    else:
-                        if stat.st_size > 10 * 1024 * 1024:
-                            log(f"    - Skipping text read >10MB for: {file}")
-                            continue
-                        try:
-                            content = file_path.read_text(encoding='utf-8', errors='ignore')
-                        except Exception as read_err:
-                            log(f"    - Read error: {read_err}")
-                            continue
-                    log(f"    - Content read. Length: {len(content)}")
+                    log(f"    - Reading and chunking content...")
+                    chunks = extract_chunks(file_key)
+                    if chunks is None:
+                        continue
+                    log(f"    - Content chunked into {len(chunks)} parts.")
 
-                    if not content or not content.strip():
+                    if not chunks:
                         db_cursor.execute("INSERT OR REPLACE INTO file_index_state (path, modified_time, last_seen) VALUES (?, ?, ?)",
                                           (file_key, mod_time, scan_start_time))
                         log(f"    - Empty content. Skipping.")
                         continue
-
-                    log(f"    - Chunking content...")
-                    chunks = recursive_character_text_splitter(content, chunk_size=1000, chunk_overlap=200)
-                    log(f"    - Content chunked into {len(chunks)} parts.")
                     
                     file_hash = hashlib.md5(file_key.encode()).hexdigest()
                     mod_time_iso = datetime.fromtimestamp(mod_time).isoformat()
@@ -881,22 +955,26 @@ def index_documents_task():
                     collection.delete(where={"path": file_key})
                     log(f"    - Old chunks deleted.")
 
+                    log(f"    - Embedding {len(chunks)} chunks in one batch...")
+                    chunk_embeddings = embed_documents(embedding_fn, chunks, prefix="search_document: ")
+
                     for j, chunk in enumerate(chunks):
                         chunk_id = f"{file_hash}_{j}"
                         current_batch_ids.append(chunk_id)
                         current_batch_docs.append(chunk)
                         current_batch_metadatas.append({"filename": file_path.name, "path": file_key, "modified_at": mod_time_iso, "chunk_index": j, "total_chunks": len(chunks)})
+                        current_batch_embeddings.append(chunk_embeddings[j])
                         
                         # Process batch if it reaches batch_size, even within a single file
                         if len(current_batch_ids) >= batch_size:
                             log(f"    - Adding batch of {len(current_batch_ids)} chunks to ChromaDB...")
                             try:
-                                collection.add(ids=current_batch_ids, documents=current_batch_docs, metadatas=current_batch_metadatas)
+                                collection.add(ids=current_batch_ids, documents=current_batch_docs, metadatas=current_batch_metadatas, embeddings=current_batch_embeddings)
                                 log(f"    - Batch added successfully.")
                             except Exception as add_err:
                                 log(f"    - ERROR adding batch to ChromaDB: {add_err}")
                                 # Continue processing despite error
-                            current_batch_ids, current_batch_docs, current_batch_metadatas = [], [], []
+                            current_batch_ids, current_batch_docs, current_batch_metadatas, current_batch_embeddings = [], [], [], []
 
                     db_cursor.execute("INSERT OR REPLACE INTO file_index_state (path, modified_time, last_seen) VALUES (?, ?, ?)",
                                       (file_key, mod_time, scan_start_time))
@@ -913,7 +991,7 @@ def index_documents_task():
         if current_batch_ids and not state.stop_indexing_flag:
             log(f"Adding final batch of {len(current_batch_ids)} chunks...")
             try:
-                collection.add(ids=current_batch_ids, documents=current_batch_docs, metadatas=current_batch_metadatas)
+                collection.add(ids=current_batch_ids, documents=current_batch_docs, metadatas=current_batch_metadatas, embeddings=current_batch_embeddings)
                 db_conn.commit()
                 log("Final batch added and DB committed.")
             except Exception as e:
@@ -968,6 +1046,7 @@ def index_documents_task():
 async def lifespan(app: FastAPI):
     # Startup
     init_db()
+    progress_hub.bind_loop(asyncio.get_running_loop())
 
     # Reset stuck indexing state if present
     try:
@@ -980,7 +1059,7 @@ async def lifespan(app: FastAPI):
             if status.get("is_indexing"):
                 logger.warning("Found stuck indexing state on startup. Resetting to Idle.")
                 status["is_indexing"] = False
-                status["status"] = "Interrupted"
+                status["status"] = "Interrupted (the next run resumes where it stopped)"
                 cursor.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", 
                               ("indexing_status", json.dumps(status)))
                 conn.commit()
@@ -1025,11 +1104,14 @@ async def lifespan(app: FastAPI):
             logger.error(f"Failed to preload Fast model: {e}")
     else:
         logger.warning(f"Fast model not found at {fast_model_path}, skipping preload.")
-    
+
+    # Start the storage watchers (they need the embedding model to do anything)
+    start_watchers(INDEX_WATCH_MODES)
     
     yield
     
     # Shutdown
+    index_supervisor.shutdown()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -1318,35 +1400,17 @@ async def delete_user(user_id: int, admin: dict = Depends(get_current_admin)):
     conn.close()
     return {"status": "success"}
 
-@app.get("/api/admin/nas/status")
-async def get_nas_status(admin: dict = Depends(get_current_admin)):
-    # Check if MNT_DIR is mounted or has content
-    is_mounted = os.path.ismount(MNT_DIR)
-    # Also check if it has files (sometimes manual mount might not show as ismount in container/some envs)
-    has_files = False
-    try:
-        if any(os.scandir(MNT_DIR)):
-            has_files = True
-    except:
-        pass
-        
-    status = get_db_status()
-    
-    # Log from DB status (real-time from indexer)
-    log_content = status.get("indexing_log", [])
-    
-    # Fallback/Merge with file log if needed, or just use DB log
-    if not log_content:
-        log_path = Path("logs/indexing.log")
-        if log_path.exists():
-            try:
-                with open(log_path, "r") as f:
-                    lines = f.readlines()
-                    log_content = [l.strip() for l in lines[-50:]]
-            except Exception:
-                pass
+# Expensive parts of the NAS status (file_index_state count, chroma_db walk, cache stats).
+# They only change when an indexing run ends, the index is cleared or an upload is indexed,
+# so they are recomputed after invalidate_index_stats() instead of on every request.
+index_stats_lock = threading.Lock()
+index_stats_cache: Dict[str, Any] = {"generation": 0, "computed": -1, "value": {}}
 
+def invalidate_index_stats():
+    with index_stats_lock:
+        index_stats_cache["generation"] += 1
 
+def compute_index_stats() -> Dict[str, Any]:
     # Get total indexed documents count from DB
     total_indexed_documents = 0
     try:
@@ -1372,21 +1436,108 @@ async def get_nas_status(admin: dict = Depends(get_current_admin)):
     except Exception as e:
         logger.error(f"Error calculating chroma usage: {e}")
 
+    embedding_cache = {}
+    try:
+        cache = get_embedding_cache()
+        if cache:
+            embedding_cache = cache.stats()
+    except Exception as e:
+        logger.error(f"Error reading embedding cache stats: {e}")
+
+    return {
+        "last_indexed_at": last_indexed_at,
+        "total_indexed_documents": total_indexed_documents,
+        "chroma_usage": chroma_usage,
+        "vector_store": VECTOR_STORE,
+        "embedding_cache": embedding_cache
+    }
+
+def get_index_stats() -> Dict[str, Any]:
+    with index_stats_lock:
+        if index_stats_cache["computed"] == index_stats_cache["generation"]:
+            return index_stats_cache["value"]
+        generation = index_stats_cache["generation"]
+    value = compute_index_stats()
+    with index_stats_lock:
+        index_stats_cache["value"] = value
+        index_stats_cache["computed"] = generation
+    return value
+
+def indexing_status_fields(status: Dict[str, Any]) -> Dict[str, Any]:
+    """Map a worker/DB indexing status to the keys the admin UI uses (only keys present)"""
+    mapping = {
+        "is_indexing": "is_indexing",
+        "progress": "indexing_progress",
+        "status": "indexing_status",
+        "total_files": "total_files",
+        "processed_files": "processed_files",
+        "pipeline": "pipeline",
+    }
+    return {ui_key: status[key] for key, ui_key in mapping.items() if key in status}
+
+def build_nas_status() -> Dict[str, Any]:
+    # Check if MNT_DIR is mounted or has content
+    is_mounted = os.path.ismount(MNT_DIR)
+    # Also check if it has files (sometimes manual mount might not show as ismount in container/some envs)
+    has_files = False
+    try:
+        if any(os.scandir(MNT_DIR)):
+            has_files = True
+    except:
+        pass
+        
+    # Live status streamed by the supervised worker; the DB blob only holds the last finished run
+    status = index_supervisor.status() or get_db_status()
+    
+    # Log from indexer status
+    log_content = status.get("indexing_log", [])
+    
+    # Fallback/Merge with file log if needed, or just use DB log
+    if not log_content:
+        log_path = Path("logs/indexing.log")
+        if log_path.exists():
+            try:
+                with open(log_path, "r") as f:
+                    lines = f.readlines()
+                    log_content = [l.strip() for l in lines[-50:]]
+            except Exception:
+                pass
+
     return {
         "is_mounted": is_mounted or has_files,
         "mount_path": str(MNT_DIR),
         "storage_mode": get_storage_mode(),
-        "is_indexing": status.get("is_indexing", False),
-        "indexing_progress": status.get("progress", 0),
-        "indexing_status": status.get("status", "Idle"),
+        "is_indexing": False,
+        "indexing_progress": 0,
+        "indexing_status": "Idle",
+        "total_files": 0,
+        "processed_files": 0,
+        "pipeline": {},
+        **indexing_status_fields(status),
         "indexing_log": [l.strip() for l in log_content],
-        "total_files": status.get("total_files", 0),
-        "processed_files": status.get("processed_files", 0),
-        "last_indexed_at": last_indexed_at,
-        "total_indexed_documents": total_indexed_documents,
-        "chroma_usage": chroma_usage
+        **get_index_stats(),
+        "query_embedding_cache": get_query_embedding_cache().stats(),
+        "retrieval_cache": get_retrieval_cache().stats()
     }
 
+def on_indexing_event(storage_mode: str, kind: str, payload: Dict[str, Any]):
+    """Supervisor listener: forward worker status/log lines to the admin progress streams"""
+    if kind == "log":
+        progress_hub.publish("indexing_log", {"storage_mode": storage_mode, "lines": [payload.get("line", "").strip()]}, audience="admin")
+    elif kind == "status":
+        fields = indexing_status_fields(payload)
+        if not payload.get("is_indexing", True):
+            # Run finished: this is when the document count / chroma size actually changed
+            invalidate_index_stats()
+            fields.update(get_index_stats())
+        progress_hub.publish("indexing", {"storage_mode": storage_mode, "status": fields}, audience="admin")
+
+index_supervisor.add_listener(on_indexing_event)
+
+@app.get("/api/admin/nas/status")
+async def get_nas_status(admin: dict = Depends(get_current_admin)):
+    return await run_in_threadpool(build_nas_status)
+
 @app.post("/api/admin/nas/mode")
 async def set_storage_mode(mode: str = Body(..., embed=True), admin: dict = Depends(get_current_admin)):
     if mode not in ["nas", "internal"]:
@@ -1403,23 +1554,31 @@ async def set_storage_mode(mode: str = Body(..., embed=True), admin: dict = Depe
     return {"status": "success", "mode": mode}
 
 @app.post("/api/admin/index")
-async def trigger_indexing(background_tasks: BackgroundTasks, storage_mode: str = Body('nas', embed=True), admin: dict = Depends(get_current_admin)):
-    status = get_db_status()
-    if status.get("is_indexing"):
-        raise HTTPException(status_code=400, detail="Indexing already in progress")
-    
+async def trigger_indexing(background_tasks: BackgroundTasks, storage_mode: str = Body('nas', embed=True), full_verify: bool = Body(False, embed=True), admin: dict = Depends(get_current_admin)):
+    if storage_mode not in ["nas", "internal"]:
+        raise HTTPException(status_code=400, detail="Invalid mode")
+
+    # A watcher already owns this root: have it do a full pass instead
+    if index_supervisor.is_watching(storage_mode):
+        index_supervisor.send("rescan", storage_mode=storage_mode, full_verify=full_verify)
+        return {"status": "rescan", "storage_mode": storage_mode}
+
     logger.info("Triggering indexing process...")
-    # Run indexer.py in a separate process
-    subprocess.Popen([sys.executable, "indexer.py", storage_mode])
+    # Run indexer.py as a supervised worker process (one per storage root)
+    if not index_supervisor.start(storage_mode, full_verify=full_verify):
+        raise HTTPException(status_code=400, detail="Indexing already in progress")
     
     return {"status": "started", "storage_mode": storage_mode}
 
 @app.post("/api/admin/index/stop")
 async def stop_indexing(admin: dict = Depends(get_current_admin)):
     try:
-        # Immediately signal the running task to stop in memory
+        # Immediately signal the running task/workers to stop. Only one-off passes: a
+        # watcher would exit for good and leave its root unwatched until a restart
         state.stop_indexing_flag = True
+        index_supervisor.send("stop", watch=False)
         
+        # DB flag for indexers started by hand (python indexer.py), which have no control channel
         conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
         cursor.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", ("stop_indexing_flag", "true"))
@@ -1429,8 +1588,59 @@ async def stop_indexing(admin: dict = Depends(get_current_admin)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+class IndexControlRequest(BaseModel):
+    command: str  # pause | resume | priority
+    storage_mode: Optional[str] = None  # None = all running workers
+    level: Optional[str] = None  # priority: low | normal | high
+
+@app.post("/api/admin/index/control")
+async def control_indexing(request: IndexControlRequest, admin: dict = Depends(get_current_admin)):
+    if request.command not in ["pause", "resume", "priority"]:
+        raise HTTPException(status_code=400, detail="Invalid command")
+    payload = {}
+    if request.command == "priority":
+        if request.level not in ["low", "normal", "high"]:
+            raise HTTPException(status_code=400, detail="Invalid priority level")
+        payload["level"] = request.level
+    sent = index_supervisor.send(request.command, storage_mode=request.storage_mode, **payload)
+    if not sent:
+        raise HTTPException(status_code=409, detail="No indexing worker running")
+    return {"status": "sent", "command": request.command, "workers": sent}
+
+class PinnedDirsRequest(BaseModel):
+    paths: List[str]  # Relative to the storage root, indexed before everything else
+
+@app.get("/api/admin/index/pinned")
+async def get_pinned_directories(admin: dict = Depends(get_current_admin)):
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        return {"paths": get_pinned_dirs(conn)}
+    finally:
+        conn.close()
+
+@app.put("/api/admin/index/pinned")
+async def set_pinned_directories(request: PinnedDirsRequest, admin: dict = Depends(get_current_admin)):
+    paths = []
+    for path in request.paths:
+        rel = path.strip().strip("/")
+        if not rel:
+            continue
+        if ".." in Path(rel).parts:
+            raise HTTPException(status_code=400, detail=f"Invalid path: {path}")
+        if rel not in paths:
+            paths.append(rel)
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        set_pinned_dirs(conn, paths)
+    finally:
+        conn.close()
+    # Takes effect with the next indexing pass
+    return {"status": "success", "paths": paths}
+
 @app.post("/api/admin/index/clear")
 async def clear_indexing_status(admin: dict = Depends(get_current_admin)):
+    # Watchers cache collections and file state: stop them first, restart them on the empty index
+    watched = await run_in_threadpool(index_supervisor.stop_watchers)
     try:
         conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
@@ -1453,16 +1663,26 @@ async def clear_indexing_status(admin: dict = Depends(get_current_admin)):
         cursor.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", 
                       ("indexing_status", json.dumps(empty_status)))
                       
+        # Shard layouts go with the collections (the next run records its own)
+        cursor.execute("DELETE FROM settings WHERE key LIKE 'index_sharding:%'")
+        cursor.execute("DELETE FROM settings WHERE key LIKE 'vector_store:%'")
         # 2. Clear File Index State (to force re-scan)
         cursor.execute("DELETE FROM file_index_state")
+        cursor.execute("DELETE FROM chunk_index_state")
+        cursor.execute("DELETE FROM dir_index_state")
+        cursor.execute("DELETE FROM scan_checkpoint")
+        # The summary cache is keyed by content and stays valid, re-indexed files reuse it
+        cursor.execute("DELETE FROM summary_queue")
+        cursor.execute("DELETE FROM settings WHERE key LIKE 'full_verify_at:%'")
         cursor.execute("DELETE FROM settings WHERE key = 'last_indexed_at'")
         conn.commit()
         conn.close()
 
         # 3. Clear ChromaDB Collections
         try:
-            client = get_chroma_client()
-            for col_name in ["documents_nas", "documents_internal"]:
+            client = get_vector_client()
+            col_names = [c.name for base in ("documents_nas", "documents_internal") for c in list_shards(client, base)]
+            for col_name in col_names:
                 try:
                     client.delete_collection(col_name)
                     logger.info(f"Deleted collection: {col_name}")
@@ -1470,10 +1690,27 @@ async def clear_indexing_status(admin: dict = Depends(get_current_admin)):
                     logger.warning(f"Failed to delete collection {col_name} (may not exist): {e}")
         except Exception as chroma_err:
              logger.error(f"Failed to clear ChromaDB: {chroma_err}")
+        keywords = get_keyword_index()
+        if keywords is not None:
+            keywords.clear()
+        # After the collections are gone: searches cached before the clear must not be served
+        conn = sqlite3.connect(DB_PATH)
+        for base in ("documents_nas", "documents_internal"):
+            bump_generation(conn, base)
+        conn.commit()
+        conn.close()
+
+        index_supervisor.forget_finished()
+        invalidate_index_stats()
+        stats = await run_in_threadpool(get_index_stats)
+        progress_hub.publish("indexing", {"storage_mode": None, "status": {
+            **indexing_status_fields(empty_status), "indexing_log": [], **stats}}, audience="admin")
 
         return {"status": "cleared"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        start_watchers(watched)
 
 
 
@@ -1561,18 +1798,23 @@ async def agent_chat(request: ChatRequest, current_user: dict = Depends(get_curr
 
 # --- Model Management APIs ---
 MODEL_DOWNLOAD_TASKS = {} # task_id -> {status, progress, total, filename, error}
+MODEL_DOWNLOAD_OWNERS: Dict[str, str] = {} # task_id -> username that started it
+
+def set_download_state(task_id: str, **fields):
+    """Update a download task and push it to the owner's progress stream"""
+    MODEL_DOWNLOAD_TASKS.setdefault(task_id, {}).update(fields)
+    progress_hub.publish("download", {"id": task_id, **MODEL_DOWNLOAD_TASKS[task_id]}, audience=MODEL_DOWNLOAD_OWNERS.get(task_id))
 
 class ModelDownloadRequest(BaseModel):
     url: str
     filename: str
 
+class ModelPinRequest(BaseModel):
+    name: str  # Model file name
+    pinned: bool = True
+
 async def download_model_background(task_id: str, url: str, filename: str):
-    MODEL_DOWNLOAD_TASKS[task_id] = {
-        "status": "downloading",
-        "progress": 0,
-        "total": 0,
-        "filename": filename
-    }
+    set_download_state(task_id, status="downloading", progress=0, total=0, filename=filename)
     
     target_path = MODELS_DIR / filename
     temp_path = target_path.with_suffix(".tmp")
@@ -1584,7 +1826,7 @@ async def download_model_background(task_id: str, url: str, filename: str):
                     raise Exception(f"HTTP {resp.status_code}")
                 
                 total = int(resp.headers.get("content-length", 0))
-                MODEL_DOWNLOAD_TASKS[task_id]["total"] = total
+                set_download_state(task_id, total=total)
                 
                 downloaded = 0
                 with open(temp_path, "wb") as f:
@@ -1594,7 +1836,9 @@ async def download_model_background(task_id: str, url: str, filename: str):
                         
                         if total > 0:
                             progress = int((downloaded / total) * 100)
-                            MODEL_DOWNLOAD_TASKS[task_id]["progress"] = progress
+                            # Only whole-percent changes are worth an event
+                            if progress != MODEL_DOWNLOAD_TASKS[task_id]["progress"]:
+                                set_download_state(task_id, progress=progress)
                             
         # Rename on success
         if target_path.exists():
@@ -1616,13 +1860,11 @@ async def download_model_background(task_id: str, url: str, filename: str):
                 except Exception as sync_err:
                     logger.error(f"Failed to sync to {user_dir.name}: {sync_err}")
 
-        MODEL_DOWNLOAD_TASKS[task_id]["status"] = "completed"
-        MODEL_DOWNLOAD_TASKS[task_id]["progress"] = 100
+        set_download_state(task_id, status="completed", progress=100)
         
     except Exception as e:
         logger.error(f"Download failed: {e}")
-        MODEL_DOWNLOAD_TASKS[task_id]["status"] = "error"
-        MODEL_DOWNLOAD_TASKS[task_id]["error"] = str(e)
+        set_download_state(task_id, status="error", error=str(e))
         if temp_path.exists():
             temp_path.unlink()
 
@@ -1641,6 +1883,16 @@ async def list_models_api(current_user: dict = Depends(get_current_user)):
         })
     return models
 
+@app.get("/api/admin/models/cache")
+async def get_model_cache_stats(admin: dict = Depends(get_current_admin)):
+    """Loaded models, pins, hit rate, evictions and load time histogram of the model cache"""
+    return model_manager.stats()
+
+@app.put("/api/admin/models/pinned")
+async def pin_model(request: ModelPinRequest, admin: dict = Depends(get_current_admin)):
+    model_manager.pin(request.name, request.pinned)
+    return {"status": "success", "pinned": model_manager.llms.stats()["pinned"]}
+
 @app.post("/api/models/download")
 async def start_model_download(req: ModelDownloadRequest, background_tasks: BackgroundTasks, current_user: dict = Depends(get_current_user)):
     # Check if already exists
@@ -1648,6 +1900,7 @@ async def start_model_download(req: ModelDownloadRequest, background_tasks: Back
         raise HTTPException(status_code=409, detail="Model already exists")
 
     task_id = str(uuid.uuid4())
+    MODEL_DOWNLOAD_OWNERS[task_id] = current_user["username"]
     background_tasks.add_task(download_model_background, task_id, req.url, req.filename)
     return {"task_id": task_id, "status": "started"}
 
@@ -1658,7 +1911,7 @@ async def get_download_status(task_id: str, current_user: dict = Depends(get_cur
 @app.get("/api/admin/index/documents", response_model=List[IndexedDocument])
 async def get_indexed_documents(admin: dict = Depends(get_current_admin)):
     try:
-        client = get_chroma_client()
+        client = get_vector_client()
         collection = client.get_collection("nas_documents")
         
         # Get all metadata
@@ -1686,53 +1939,61 @@ async def get_indexed_documents(admin: dict = Depends(get_current_admin)):
         return []
 
 @app.post("/api/admin/index/search", response_model=List[ChunkResult])
-async def search_indexed_chunks(request: ChunkSearchRequest, admin: dict = Depends(get_current_admin)):
+async def search_indexed_chunks(request: ChunkSearchRequest, response: Response, admin: dict = Depends(get_current_admin)):
     try:
-        client = get_chroma_client()
-        collection = client.get_collection("nas_documents")
+        client = get_vector_client()
+        # All shards of the current storage mode (the legacy in-process indexer wrote nas_documents)
+        base = f"documents_{get_storage_mode()}"
+        collections = list_shards(client, base)
+        if not collections:
+            base = "nas_documents"
+            collections = list_shards(client, base)
+        if not collections:
+            return []
         
         if request.file_path:
-            # Filter by specific file
-            result = collection.get(
-                where={"path": request.file_path},
-                limit=request.limit,
-                include=['documents', 'metadatas']
-            )
-            
+            # Filter by specific file (it lives in one shard, the others return nothing)
             chunks = []
-            if result['ids']:
-                for i, id in enumerate(result['ids']):
-                    chunks.append({
-                        "id": id,
-                        "content": result['documents'][i],
-                        "metadata": result['metadatas'][i]
-                    })
-            return chunks
+            for collection in collections:
+                result = collection.get(
+                    where={"path": request.file_path},
+                    limit=request.limit,
+                    include=['documents', 'metadatas']
+                )
+                if result['ids']:
+                    attach_duplicate_paths(result['metadatas'])
+                    for i, id in enumerate(result['ids']):
+                        chunks.append({
+                            "id": id,
+                            "content": result['documents'][i],
+                            "metadata": result['metadatas'][i]
+                        })
+            return chunks[:request.limit]
             
         elif request.query:
-            # Semantic search
-            embed_model_name = "nomic-embed-text-v1.5.f16.gguf"
+            # Semantic and/or keyword search
+            embed_model_name = EMBED_MODEL_NAME
             embed_model_path = MODELS_DIR / embed_model_name
             
-            if not embed_model_path.exists():
+            if not embed_model_path.exists() and (request.mode or RAG_RETRIEVAL) == "vector":
                 raise HTTPException(status_code=500, detail="Embedding model missing")
                 
-            embedding_fn = GGUFEmbeddingFunction(str(embed_model_path))
-            query_embed = embedding_fn([request.query])[0]
-            
-            results = collection.query(
-                query_embeddings=[query_embed],
-                n_results=request.limit
-            )
+            results, shard_timings, mode = await retrieve_chunks(collections, base, request.query, request.query,
+                                                                 embed_model_path, request.limit, request.mode)
+            response.headers["X-Shard-Timings"] = json.dumps(shard_timings)
+            response.headers["X-Retrieval-Mode"] = mode
+            logger.info(f"Index search ({mode}): {format_timings(shard_timings)}")
             
             chunks = []
             if results['ids']:
+                attach_duplicate_paths(results['metadatas'][0])
                 for i, id in enumerate(results['ids'][0]):
                     chunks.append({
                         "id": id,
                         "content": results['documents'][0][i],
                         "metadata": results['metadatas'][0][i],
-                        "score": results['distances'][0][i] if 'distances' in results else None
+                        # Vector distance (lower is better), or BM25/fusion score (higher is better)
+                        "score": (results.get('distances') or results['scores'])[0][i]
                     })
             return chunks
         else:
@@ -1834,18 +2095,27 @@ def get_conversation_history(session_id: str, limit: int = 5) -> List[dict]:
 
 # Global Upload State Tracking
 upload_states: Dict[str, Dict[str, Any]] = {}
+upload_owners: Dict[str, str] = {}  # file_id -> uploader, who alone gets its progress events
+
+def set_upload_state(file_id: str, **fields):
+    """Update an upload's state and push it to the uploader's progress stream"""
+    upload_states.setdefault(file_id, {}).update(fields)
+    progress_hub.publish("upload", {"id": file_id, **upload_states[file_id]}, audience=upload_owners.get(file_id))
+
+# Uploaded chat context: smaller chunks, and only the start of large files
+UPLOAD_CHUNKS = ChunkSpec(300, 50, tokens=128, overlap_tokens=16)
+UPLOAD_MAX_CHUNKS = 100
 
-def index_upload_background(file_id: str, filename: str, content: str):
-    global upload_states
+def index_upload_background(file_id: str, filename: str, chunks: List[str]):
     try:
-        upload_states[file_id] = {"status": "indexing", "progress": 0, "filename": filename}
+        set_upload_state(file_id, status="indexing", progress=0, filename=filename)
         
-        embed_model_name = "nomic-embed-text-v1.5.f16.gguf"
+        embed_model_name = EMBED_MODEL_NAME
         embed_model_path = MODELS_DIR / embed_model_name
         
         if not embed_model_path.exists():
             logger.error("Embedding model not found for upload indexing")
-            upload_states[file_id] = {"status": "error", "error": "Model missing"}
+            set_upload_state(file_id, status="error", error="Model missing")
             return
             
         # Use thread lock for model loading safety
@@ -1855,31 +2125,23 @@ def index_upload_background(file_id: str, filename: str, content: str):
         # Actually initializing embedding_fn might take a moment if not loaded
         
         embedding_fn = GGUFEmbeddingFunction(str(embed_model_path))
-        client = get_chroma_client()
+        client = get_vector_client()
         collection = client.get_or_create_collection(name="temp_uploads", embedding_function=embedding_fn)
         
-        # Chunking
-        upload_states[file_id]["status"] = "chunking"
-        # Reduce chunk size for safer processing during upload
-        chunks = recursive_character_text_splitter(content, chunk_size=300, chunk_overlap=50)
-        
-        # Limit chunks to avoid overly long processing for large files on uploading
-        if len(chunks) > 100:
-             chunks = chunks[:100]
-
         total_chunks = len(chunks)
         if total_chunks == 0:
-            upload_states[file_id] = {"status": "ready", "progress": 100}
+            set_upload_state(file_id, status="ready", progress=100)
             return
 
         ids = []
         metadatas = []
         docs = []
         
-        upload_states[file_id]["status"] = "embedding"
+        set_upload_state(file_id, status="embedding")
         
-        # Process in smaller batches to update progress
-        batch_size = 10
+        # Process in batches to update progress. Each batch is embedded with one
+        # batched call, then written with precomputed embeddings.
+        batch_size = 32
         for i in range(0, total_chunks, batch_size):
             batch_end = min(i + batch_size, total_chunks)
             batch_chunks = chunks[i:batch_end]
@@ -1891,24 +2153,24 @@ def index_upload_background(file_id: str, filename: str, content: str):
                 metadatas.append({"file_id": file_id, "filename": filename, "chunk_index": abs_index})
                 docs.append(chunk)
             
-            # Add to chroma (this triggers embedding which is slow)
             try:
-                # We need to make sure we don't hold the lock for too long if we used one, 
-                # but Chromadb/GGUFEmbeddingFn handles the model access via our manager which has a lock.
-                collection.add(ids=ids[i:batch_end], documents=batch_chunks, metadatas=metadatas[i:batch_end])
+                # Embedding is the slow part; GGUFEmbeddingFn handles model access via our manager which has a lock.
+                batch_embeddings = embed_documents(embedding_fn, batch_chunks)
+                collection.add(ids=ids[i:batch_end], documents=batch_chunks, metadatas=metadatas[i:batch_end], embeddings=batch_embeddings)
             except Exception as e:
                 logger.error(f"Error adding batch {i}: {e}")
             
             # Update progress
             progress = int((batch_end / total_chunks) * 100)
-            upload_states[file_id]["progress"] = progress
+            set_upload_state(file_id, progress=progress)
             
         logger.info(f"Successfully indexed {len(chunks)} chunks for {filename}")
-        upload_states[file_id] = {"status": "ready", "progress": 100}
+        invalidate_index_stats()
+        set_upload_state(file_id, status="ready", progress=100)
             
     except Exception as e:
         logger.error(f"Background indexing upload error: {e}")
-        upload_states[file_id] = {"status": "error", "error": str(e)}
+        set_upload_state(file_id, status="error", error=str(e))
 
 @app.get("/api/chat/file/{file_id}/status")
 async def get_upload_status(file_id: str, current_user: dict = Depends(get_current_user)):
@@ -1917,6 +2179,36 @@ async def get_upload_status(file_id: str, current_user: dict = Depends(get_curre
         return {"status": "unknown"}
     return status
 
+# --- Progress Events ---
+# One server-sent-events stream per client replaces polling of the NAS status, upload
+# status and download status endpoints (those stay for one-off reads).
+
+JOB_DONE_STATES = ("ready", "error", "completed")
+
+def progress_snapshot(sub) -> Dict[str, Any]:
+    snapshot = {
+        "uploads": {fid: {"id": fid, **st} for fid, st in list(upload_states.items())
+                    if upload_owners.get(fid) == sub.username and st.get("status") not in JOB_DONE_STATES},
+        "downloads": {tid: {"id": tid, **t} for tid, t in list(MODEL_DOWNLOAD_TASKS.items())
+                      if MODEL_DOWNLOAD_OWNERS.get(tid) == sub.username and t.get("status") not in JOB_DONE_STATES},
+    }
+    if sub.is_admin:
+        snapshot["indexing"] = build_nas_status()
+    return snapshot
+
+async def progress_snapshot_async(sub) -> Dict[str, Any]:
+    return await run_in_threadpool(progress_snapshot, sub)
+
+@app.get("/api/events")
+async def progress_events(current_user: dict = Depends(get_current_user)):
+    # Subscribe before the snapshot is taken so nothing published in between is lost
+    sub = progress_hub.subscribe(current_user)
+    return StreamingResponse(
+        progress_hub.stream(sub, progress_snapshot_async),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/api/chat/upload")
 async def upload_file_context(
     background_tasks: BackgroundTasks,
@@ -1924,7 +2216,6 @@ async def upload_file_context(
     user: dict = Depends(get_current_user)
 ):
     try:
-        content = ""
         filename = file.filename
         import uuid
         file_id = str(uuid.uuid4())
@@ -1936,38 +2227,29 @@ async def upload_file_context(
             
         file_path = temp_path
         
-        # Extract text based on extension
-        if filename.endswith('.docx'):
-            content = read_docx_file(file_path)
-        elif filename.endswith('.xlsx'):
-            content = read_excel_file(file_path)
-        elif filename.endswith('.pdf'):
-            content = read_pdf_file(file_path)
+        # Extract and chunk; text is decoded as it is read and reading stops at the chunk limit
+        if filename.endswith('.pdf'):
+            chunks = list(itertools.islice(iter_chunks([read_pdf_file(file_path)], UPLOAD_CHUNKS), UPLOAD_MAX_CHUNKS))
         else:
-            # Try reading as text with fallback encodings
-            encodings = ['utf-8', 'shift_jis', 'latin-1']
-            for enc in encodings:
-                try:
-                    content = file_path.read_text(encoding=enc)
-                    if content:
-                        break
-                except:
-                    continue
+            # Encoding guessed once from the start of the file instead of re-reading it per candidate
+            encoding = detect_encoding(file_path)
+            chunks = extract_chunks(str(file_path), UPLOAD_MAX_CHUNKS, UPLOAD_CHUNKS, encoding) or []
         
         if file_path.exists():
             file_path.unlink()
             
-        logger.info(f"Uploaded file {filename}, extracted content length: {len(content)}")
+        logger.info(f"Uploaded file {filename}, extracted {len(chunks)} chunks")
             
-        if not content:
+        if not chunks:
             logger.warning(f"Empty content for file: {filename}")
             return JSONResponse(status_code=400, content={"error": "Could not extract text or file is empty"})
             
         # Initialize state
-        upload_states[file_id] = {"status": "queued", "progress": 0}
+        upload_owners[file_id] = user["username"]
+        set_upload_state(file_id, status="queued", progress=0)
 
         # Index Logic for Uploaded File (Background)
-        background_tasks.add_task(index_upload_background, file_id, filename, content)
+        background_tasks.add_task(index_upload_background, file_id, filename, chunks)
 
         return {"file_id": file_id, "filename": filename}
         
@@ -2335,15 +2617,14 @@ async def chat_stream(request: ChatRequest, background_tasks: BackgroundTasks, c
                 yield f"data: {json.dumps({'status': '添付ファイルを分析中...'})}\n\n"
                 await asyncio.sleep(0)
                 try:
-                    client = get_chroma_client()
+                    client = get_vector_client()
                     collection = client.get_collection("temp_uploads") # Assuming it exists if IDs are passed
                     
-                    embed_model_name = "nomic-embed-text-v1.5.f16.gguf"
+                    embed_model_name = EMBED_MODEL_NAME
                     embed_model_path = user_models_dir / embed_model_name
                     
                     if embed_model_path.exists():
                         # Run RAG in thread pool to avoid blocking async loop
-                        from starlette.concurrency import run_in_threadpool
                         
                         def perform_rag():
                             # Retrieve content directly instead of semantic search
@@ -2379,35 +2660,38 @@ async def chat_stream(request: ChatRequest, background_tasks: BackgroundTasks, c
                 try:
                     storage_mode = get_storage_mode()
                     collection_name = f"documents_{storage_mode}"
-                    client = get_chroma_client()
+                    client = get_vector_client()
+                    # The index may be split into shards (INDEX_SHARDING); all of them are searched
                     try:
-                        collection = client.get_collection(collection_name)
-                    except:
-                        collection = None
+                        collections = list_shards(client, collection_name)
+                    except Exception:
+                        collections = []
 
-                    if collection:
-                        embed_model_name = "nomic-embed-text-v1.5.f16.gguf"
+                    if collections:
+                        embed_model_name = EMBED_MODEL_NAME
                         embed_model_path = user_models_dir / embed_model_name
-                        if embed_model_path.exists():
-                            embedding_fn = GGUFEmbeddingFunction(str(embed_model_path))
+                        if embed_model_path.exists() or RAG_RETRIEVAL != "vector":
                             # Add prefix for better retrieval with nomic
                             # Enhanced intent-based query construction
                             # Extract nouns/keywords from message for vector search
                             keywords = " ".join(re.findall(r'[一-龠ぁ-んァ-ヶa-zA-Z0-9]+', request.message))
                             query_text = f"search_query: {keywords}"
-                            query_embed = embedding_fn([query_text])[0]
                             
                             # Yield heartbeat before long search
                             yield f"data: {json.dumps({'status': '最良の資料を抽出中...'})}\n\n"
                             await asyncio.sleep(0.01)
 
                             # Safe number of results for 8k context window
-                            results = collection.query(query_embeddings=[query_embed], n_results=12)
+                            results, shard_timings, mode = await retrieve_chunks(collections, collection_name, request.message, query_text,
+                                                                                 embed_model_path, 12)
+                            logger.info(f"RAG ({mode}): queried {len(collections)} shard(s): {format_timings(shard_timings)}")
                             
-                            if results['documents']:
+                            if results['documents'][0]:
                                 doc_texts = results['documents'][0]
                                 metas = results['metadatas'][0]
                                 logger.info(f"RAG: Found {len(doc_texts)} relevant chunks from {collection_name}")
+                                record_search_hits(metas)
+                                attach_duplicate_paths(metas)
                                 
                                 nas_context += "\n--- 分析対象データ・セット開始 ---\n"
                                 for i, text in enumerate(doc_texts):
@@ -2417,6 +2701,9 @@ async def chat_stream(request: ChatRequest, background_tasks: BackgroundTasks, c
                                     nas_context += f"{text}\n"
                                     nas_context += "[[本文終了]]\n"
                                     nas_context += f"（※このデータの出典ファイル: {m.get('filename', 'Unknown')}）\n"
+                                    if m.get('duplicate_paths'):
+                                        copies = "、".join(os.path.basename(p) for p in m['duplicate_paths'])
+                                        nas_context += f"（※同一内容のファイル: {copies}）\n"
                                     nas_context += "---------------------------------\n"
                                 nas_context += "--- 分析対象データ・セット終了 ---\n\n"
                             else:
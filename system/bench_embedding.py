@@ -0,0 +1,62 @@
+"""
+Embedding throughput benchmark: per-text create_embedding loop vs batched embed.
+
+Usage:
+    python bench_embedding.py [model_path] [num_chunks]
+"""
+import os
+os.environ['LC_ALL'] = 'POSIX'
+os.environ['LANG'] = 'POSIX'
+
+import sys
+import time
+import random
+from pathlib import Path
+
+from llama_cpp import Llama
+
+from embeddings import EMBED_MODEL_NAME, embed_model_kwargs, embed_each, embed_batch
+
+BASE_DIR = Path(__file__).parent.absolute()
+
+SAMPLE_JA = "本資料は社内ネットワークストレージの運用手順をまとめたものです。バックアップは毎晩実行され、保存期間は九十日です。"
+SAMPLE_EN = "This document describes the quarterly maintenance procedure for the shared storage cluster and its backup policy. "
+
+
+def make_chunks(n: int, size: int = 1000):
+    random.seed(0)
+    chunks = []
+    for i in range(n):
+        base = SAMPLE_JA if i % 2 == 0 else SAMPLE_EN
+        text = (base * (size // len(base) + 1))[:size]
+        # Make every chunk distinct so nothing can be short-circuited
+        chunks.append(f"search_document: [{i}] {text[random.randint(0, 50):]}")
+    return chunks
+
+
+def run(label, fn, llm, chunks):
+    start = time.perf_counter()
+    vectors = fn(llm, chunks)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<12} {len(vectors):>6} chunks  {elapsed:8.2f}s  {len(vectors) / elapsed:8.2f} chunks/s")
+    return elapsed
+
+
+def main():
+    model_path = Path(sys.argv[1]) if len(sys.argv) > 1 else BASE_DIR / "models" / EMBED_MODEL_NAME
+    num_chunks = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    print(f"Model: {model_path}")
+    llm = Llama(model_path=str(model_path), n_gpu_layers=0, verbose=False, **embed_model_kwargs())
+    chunks = make_chunks(num_chunks)
+
+    # Warm-up so the first measured call does not pay for lazy init
+    embed_batch(llm, chunks[:4])
+
+    loop_time = run("per-text", embed_each, llm, chunks)
+    batch_time = run("batched", embed_batch, llm, chunks)
+    print(f"Speedup: {loop_time / batch_time:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Text splitter benchmark: the shared splitter (splitter.py, whole-text and streamed)
+against the two splitters it replaced, on synthetic multi-megabyte Japanese and
+English corpora.
+
+Usage:
+    python bench_splitter.py [--mb 4] [--chunk-size 1000] [--overlap 200] [--repeat 3]
+"""
+import sys
+import time
+import random
+import argparse
+from typing import List
+
+from splitter import split_text, iter_text_chunks
+
+KANA = "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん"
+KANJI = "日本語文書会議資料報告検索索引処理結果確認作業予定管理情報共有設定変更"
+WORDS = ("the index document search meeting report result update storage network "
+         "model query vector chunk summary schedule project review budget team").split()
+
+
+def japanese_corpus(size: int, seed: int = 1) -> str:
+    rnd = random.Random(seed)
+    parts, n = [], 0
+    while n < size:
+        sentence = "".join(rnd.choice(KANJI) if rnd.random() < 0.3 else rnd.choice(KANA)
+                           for _ in range(rnd.randint(15, 60)))
+        sentence += rnd.choice("。。。。！？")
+        if rnd.random() < 0.1:
+            sentence += "\n"
+        if rnd.random() < 0.02:
+            sentence += "\n"
+        parts.append(sentence)
+        n += len(sentence)
+    return "".join(parts)
+
+
+def english_corpus(size: int, seed: int = 2) -> str:
+    rnd = random.Random(seed)
+    parts, n = [], 0
+    while n < size:
+        sentence = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(6, 25))).capitalize()
+        sentence += rnd.choice((". ", ". ", "! ", "? "))
+        if rnd.random() < 0.1:
+            sentence += "\n"
+        if rnd.random() < 0.02:
+            sentence += "\n"
+        parts.append(sentence)
+        n += len(sentence)
+    return "".join(parts)
+
+
+def legacy_indexer_splitter(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> List[str]:
+    """indexer.recursive_character_text_splitter before splitter.py (char-by-char backward scan)"""
+    chunks = []
+    start = 0
+    text_len = len(text)
+    while start < text_len:
+        end = start + chunk_size
+        if end >= text_len:
+            chunks.append(text[start:])
+            break
+        split_point = -1
+        search_start = max(start, end - chunk_overlap)
+        for i in range(end, search_start, -1):
+            if text[i] == '\n':
+                split_point = i
+                break
+        if split_point == -1:
+            for i in range(end, search_start, -1):
+                if text[i] == ' ':
+                    split_point = i
+                    break
+        if split_point != -1:
+            chunks.append(text[start:split_point])
+            start = split_point + 1
+        else:
+            chunks.append(text[start:end])
+            start = end - chunk_overlap
+    return chunks
+
+
+def legacy_backend_splitter(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> List[str]:
+    """backend.recursive_character_text_splitter before splitter.py (recursive, ignores overlap)"""
+    separators = ["\n\n", "\n", ". ", " ", ""]
+
+    def _split_text(text: str, separators: List[str]) -> List[str]:
+        final_chunks = []
+        separator = separators[-1]
+        new_separators = []
+        for i, sep in enumerate(separators):
+            if sep == "":
+                separator = ""
+                break
+            if sep in text:
+                separator = sep
+                new_separators = separators[i+1:]
+                break
+        splits = text.split(separator) if separator else list(text)
+        good_splits = [s if separator == "" else s + separator for s in splits if s.strip()]
+        current_chunk = ""
+        for s in good_splits:
+            if len(current_chunk) + len(s) < chunk_size:
+                current_chunk += s
+            else:
+                if current_chunk:
+                    final_chunks.append(current_chunk)
+                current_chunk = s
+                if len(current_chunk) > chunk_size and new_separators:
+                    final_chunks.extend(_split_text(current_chunk, new_separators))
+                    current_chunk = ""
+        if current_chunk:
+            final_chunks.append(current_chunk)
+        return final_chunks
+
+    return _split_text(text, separators)
+
+
+def streamed(text: str, chunk_size: int, chunk_overlap: int) -> List[str]:
+    pieces = (text[i:i + 64 * 1024] for i in range(0, len(text), 64 * 1024))
+    return list(iter_text_chunks(pieces, chunk_size, chunk_overlap))
+
+
+def boundary_ratio(chunks: List[str], text: str) -> float:
+    """Share of chunks cut at a sentence end or whitespace (the rest were cut mid-word/sentence)"""
+    if len(chunks) < 2:
+        return 1.0
+    good, pos = 0, 0
+    for c in chunks[:-1]:
+        j = text.find(c, pos)
+        if j == -1:
+            continue
+        after = text[j + len(c):j + len(c) + 1]
+        if c.endswith(tuple("。！？.!?")) or c[-1:].isspace() or after.isspace():
+            good += 1
+        pos = j + 1
+    return good / (len(chunks) - 1)
+
+
+def run(label, fn, text, args):
+    best, chunks = float("inf"), []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        chunks = fn(text, args.chunk_size, args.overlap)
+        best = min(best, time.perf_counter() - start)
+    mb = len(text.encode("utf-8")) / 1e6
+    avg = sum(map(len, chunks)) / max(len(chunks), 1)
+    print(f"  {label:<24} {best:8.3f}s  {mb / best:8.1f} MB/s  {len(chunks):>7} chunks  "
+          f"avg {avg:6.0f} chars  at boundary {boundary_ratio(chunks, text):6.1%}")
+    return chunks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=float, default=4.0, help="corpus size in MB (UTF-8)")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--overlap", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    corpora = [
+        # Japanese is ~3 bytes per character in UTF-8
+        ("Japanese", japanese_corpus(int(args.mb * 1e6 / 3))),
+        ("English", english_corpus(int(args.mb * 1e6))),
+    ]
+    for name, text in corpora:
+        print(f"{name}: {len(text):,} chars, {len(text.encode('utf-8')) / 1e6:.1f} MB")
+        run("legacy indexer", legacy_indexer_splitter, text, args)
+        run("legacy backend", legacy_backend_splitter, text, args)
+        whole = run("splitter (whole text)", split_text, text, args)
+        pieces = run("splitter (streamed)", streamed, text, args)
+        assert whole == pieces, "streamed output differs from whole-text output"
+        assert all(len(c) <= args.chunk_size for c in whole), "chunk over chunk_size"
+
+
+if __name__ == "__main__":
+    sys.exit(main())
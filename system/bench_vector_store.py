@@ -0,0 +1,149 @@
+"""
+Vector store benchmark: Chroma vs the native memory-mapped store (exact scan and IVF).
+Measures bulk upsert throughput (in write-batcher sized batches), open + first query
+time of a fresh process and the memory that adds (after imports), query latency
+(top-12, like chat RAG) and recall against an exact float32 search.
+
+Vectors are synthetic (clustered like document embeddings), or the embeddings of the
+live index with --from-index nas|internal (read from the Chroma collections in chroma_db/).
+
+Usage:
+    python bench_vector_store.py [--rows 100000] [--dim 768] [--queries 200] [--stores native,chroma]
+    python bench_vector_store.py --from-index nas
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+import numpy as np
+
+import vector_store
+from embeddings import EMBED_DIM
+from shards import list_shards
+
+BASE_DIR = Path(__file__).parent.absolute()
+BATCH = 2000
+TOP_K = 12
+
+
+def synthetic_vectors(rows: int, dim: int, clusters: int = 256):
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    x = centers[rng.integers(0, clusters, rows)] + rng.normal(scale=0.6, size=(rows, dim)).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def index_vectors(mode: str, limit: int):
+    client = vector_store.open_vector_store(BASE_DIR / "chroma_db", "chroma")
+    parts = []
+    for collection in list_shards(client, f"documents_{mode}"):
+        offset = 0
+        while sum(len(p) for p in parts) < limit:
+            got = collection.get(limit=5000, offset=offset, include=["embeddings"])
+            if not got["ids"]:
+                break
+            parts.append(np.asarray(got["embeddings"], dtype=np.float32))
+            offset += len(got["ids"])
+    if not parts:
+        raise SystemExit(f"No embeddings found in documents_{mode}")
+    return np.concatenate(parts)[:limit]
+
+
+def load(store: str, path: Path, x):
+    client = vector_store.open_vector_store(path, store)
+    collection = client.get_or_create_collection("bench")
+    start = time.perf_counter()
+    for i in range(0, len(x), BATCH):
+        end = min(i + BATCH, len(x))
+        collection.upsert(ids=[f"c{j}" for j in range(i, end)], embeddings=x[i:end].tolist(),
+                          metadatas=[{"path": f"/bench/f{j // 20}.txt", "chunk_index": j % 20} for j in range(i, end)],
+                          documents=[f"chunk {j}" for j in range(i, end)])
+    return collection, time.perf_counter() - start
+
+
+def rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def probe(store: str, path: str, query: str):
+    """Fresh-process cold start: open the store and answer one query"""
+    base_rss = rss_mb()
+    start = time.perf_counter()
+    collection = vector_store.open_vector_store(Path(path), store).get_collection("bench")
+    opened = time.perf_counter()
+    collection.query(query_embeddings=[json.loads(query)], n_results=TOP_K)
+    done = time.perf_counter()
+    print(json.dumps({"open_ms": (opened - start) * 1000, "first_query_ms": (done - opened) * 1000,
+                      "rss_mb": rss_mb() - base_rss}))
+
+
+def measure_queries(collection, x, queries, truth):
+    latencies, hits = [], 0
+    for q, expected in zip(queries, truth):
+        start = time.perf_counter()
+        result = collection.query(query_embeddings=[q.tolist()], n_results=TOP_K)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(expected & {int(i[1:]) for i in result["ids"][0]})
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)], hits / (len(queries) * TOP_K)
+
+
+def disk_mb(path: Path) -> float:
+    return sum(f.stat().st_blocks * 512 for f in path.rglob("*") if f.is_file()) / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=EMBED_DIM)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--stores", default="native,chroma")
+    parser.add_argument("--from-index", choices=["nas", "internal"])
+    parser.add_argument("--probe", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.probe:
+        return probe(*args.probe)
+
+    x = index_vectors(args.from_index, args.rows) if args.from_index else synthetic_vectors(args.rows, args.dim)
+    rng = np.random.default_rng(1)
+    queries = x[rng.integers(0, len(x), args.queries)] + rng.normal(scale=0.02, size=(args.queries, x.shape[1])).astype(np.float32)
+    norms = (x * x).sum(axis=1)
+    truth = [set(np.argsort(norms - 2 * (x @ q))[:TOP_K].tolist()) for q in queries]
+    print(f"{len(x)} vectors x {x.shape[1]} dims, {args.queries} queries, top {TOP_K}")
+
+    stores = [s for s in args.stores.split(",") if s]
+    if "chroma" in stores and vector_store.chromadb is None:
+        print("chroma: chromadb is not installed, skipped")
+        stores.remove("chroma")
+
+    print(f"{'store':<14} {'upsert/s':>9} {'open ms':>8} {'1st q ms':>9} {'+rss MB':>7} {'p50 ms':>7} {'p95 ms':>7} {'recall':>7} {'disk MB':>8}")
+    for store in stores:
+        path = Path(tempfile.mkdtemp(prefix=f"bench_{store}_"))
+        try:
+            collection, elapsed = load(store, path, x)
+            cold = json.loads(subprocess.run(
+                [sys.executable, __file__, "--probe", store, str(path), json.dumps(queries[0].tolist())],
+                capture_output=True, text=True, check=True).stdout.strip().splitlines()[-1])
+            modes = [("exact", "exact"), ("ivf", "auto")] if store == "native" else [(None, None)]
+            for label, search in modes:
+                if search:
+                    vector_store.NATIVE_SEARCH = search
+                p50, p95, recall = measure_queries(collection, x, queries, truth)
+                name = f"{store}/{label}" if label else store
+                print(f"{name:<14} {len(x) / elapsed:>9.0f} {cold['open_ms']:>8.1f} {cold['first_query_ms']:>9.1f} "
+                      f"{cold['rss_mb']:>7.0f} {p50:>7.2f} {p95:>7.2f} {recall:>7.3f} {disk_mb(path):>8.1f}")
+            if store == "native" and collection.centroids is None:
+                print(f"  (below VECTOR_NATIVE_IVF_MIN_ROWS={vector_store.NATIVE_IVF_MIN_ROWS}: ivf row is an exact scan)")
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
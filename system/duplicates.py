@@ -0,0 +1,116 @@
+import os
+import sqlite3
+import logging
+from typing import Dict, Iterable, List, Optional
+
+from scanner import forget_files, invalidate_dirs
+from keyword_index import get_keyword_index
+from shards import bump_generation
+
+logger = logging.getLogger("indexer")
+
+# Identical files under one root (same content hash) are embedded and stored once.
+# The first one indexed keeps the chunks; every other copy gets a file_index_state row
+# with duplicate_of = that path and no chunks of its own. Search hits of the original
+# list the copies' paths.
+DUPLICATE_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_file_index_state_hash ON file_index_state (content_hash)",
+    "CREATE INDEX IF NOT EXISTS idx_file_index_state_duplicate ON file_index_state (duplicate_of)",
+)
+
+_UNDER_ROOT = "(path = ? OR (path >= ? AND path < ?))"
+
+
+def _root_args(root: str) -> tuple:
+    root = root.rstrip(os.sep)
+    prefix = root + os.sep
+    return (root, prefix, prefix + "\U0010ffff")
+
+
+def create_duplicate_indexes(db_cursor):
+    for sql in DUPLICATE_INDEXES:
+        db_cursor.execute(sql)
+
+
+def find_original(db_cursor, root: str, content_hash: str, path: str) -> Optional[str]:
+    """The indexed file under root holding the chunks for this content, if any"""
+    row = db_cursor.execute(f"""
+        SELECT path FROM file_index_state
+        WHERE content_hash = ? AND duplicate_of IS NULL AND path != ? AND {_UNDER_ROOT}
+        ORDER BY path LIMIT 1
+    """, (content_hash, path) + _root_args(root)).fetchone()
+    return row[0] if row else None
+
+
+def reconcile_duplicates(db_conn: sqlite3.Connection, collection, root: str) -> List[str]:
+    """
+    Repair the duplicate links under root after a pass:
+    - several originals with the same content (indexed before duplicates were detected,
+      or copies that changed into each other): keep one, drop the others' chunks and
+      link them to it
+    - copies whose original changed or was deleted: forget their state so they are
+      indexed again; returned for an immediate follow-up pass (embeddings come from the
+      embedding cache, so that only costs the extraction); their directories are listed
+      again next scan in case that pass is interrupted
+    """
+    args = _root_args(root)
+    hashes = [row[0] for row in db_conn.execute(f"""
+        SELECT content_hash FROM file_index_state
+        WHERE content_hash IS NOT NULL AND duplicate_of IS NULL AND {_UNDER_ROOT}
+        GROUP BY content_hash HAVING COUNT(*) > 1
+    """, args)]
+    merged = 0
+    for content_hash in hashes:
+        paths = [row[0] for row in db_conn.execute(f"""
+            SELECT path FROM file_index_state
+            WHERE content_hash = ? AND duplicate_of IS NULL AND {_UNDER_ROOT} ORDER BY path
+        """, (content_hash,) + args)]
+        # Empty files have no chunks to share
+        keep = next((path for path in paths if db_conn.execute(
+            "SELECT 1 FROM chunk_index_state WHERE path = ? LIMIT 1", (path,)).fetchone()), None)
+        if keep is None:
+            continue
+        extras = [path for path in paths if path != keep]
+        # Chroma first: a crash in between leaves rows that the next reconcile merges again
+        collection.delete_paths(extras)
+        keywords = get_keyword_index()
+        if keywords is not None:
+            keywords.delete_paths(extras)
+        db_conn.executemany("DELETE FROM chunk_index_state WHERE path = ?", [(path,) for path in extras])
+        db_conn.executemany("UPDATE file_index_state SET duplicate_of = ? WHERE path = ? OR duplicate_of = ?",
+                            [(keep, path, path) for path in extras])
+        merged += len(extras)
+
+    orphans = [row[0] for row in db_conn.execute("""
+        SELECT copy.path FROM file_index_state AS copy
+        LEFT JOIN file_index_state AS original ON original.path = copy.duplicate_of
+        WHERE copy.duplicate_of IS NOT NULL AND (copy.path = ? OR (copy.path >= ? AND copy.path < ?))
+          AND (original.path IS NULL OR original.duplicate_of IS NOT NULL
+               OR original.content_hash IS NOT copy.content_hash)
+    """, args)]
+    forget_files(db_conn, orphans)
+    invalidate_dirs(db_conn, (os.path.dirname(path) for path in orphans))
+    if merged:
+        bump_generation(db_conn, collection.layout.base)
+    db_conn.commit()
+    if merged:
+        logger.info(f"Duplicates: {merged} identical file(s) now share the chunks of one copy")
+    return orphans
+
+
+def duplicate_paths(db_conn: sqlite3.Connection, paths: Iterable[str]) -> Dict[str, List[str]]:
+    """original path -> paths of its identical copies, for the given search hits"""
+    paths = list(dict.fromkeys(paths))
+    copies: Dict[str, List[str]] = {}
+    for i in range(0, len(paths), 500):
+        batch = paths[i:i + 500]
+        try:
+            rows = db_conn.execute(
+                f"SELECT duplicate_of, path FROM file_index_state WHERE duplicate_of IN ({','.join('?' * len(batch))}) ORDER BY path",
+                batch).fetchall()
+        except sqlite3.OperationalError:
+            # Index state written before duplicate detection existed
+            return {}
+        for original, path in rows:
+            copies.setdefault(original, []).append(path)
+    return copies
@@ -0,0 +1,376 @@
+import os
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+
+logger = logging.getLogger("oonanji-embeddings")
+
+# nomic-embed-text-v1.5
+EMBED_MODEL_NAME = "nomic-embed-text-v1.5.f16.gguf"
+EMBED_DIM = 768
+
+# Embedding contexts are loaded with n_batch == n_ubatch == n_ctx so that llama.cpp
+# can pack as many chunks as fit into one multi-sequence decode (pooled embeddings
+# need the whole sequence inside a single ubatch).
+EMBED_N_CTX = 2048
+EMBED_N_BATCH = 2048
+
+# How many texts we hand to llama.cpp per call. llama.cpp itself splits the list
+# into decodes of up to n_batch tokens; this only bounds the Python side lists.
+EMBED_MAX_TEXTS_PER_CALL = 256
+
+
+def embed_model_kwargs() -> dict:
+    """Llama() kwargs for loading a model in batched embedding mode"""
+    return {
+        "embedding": True,
+        "n_ctx": EMBED_N_CTX,
+        "n_batch": EMBED_N_BATCH,
+        "n_ubatch": EMBED_N_BATCH,
+    }
+
+
+def embed_each(llm, texts: List[str], dim: int = EMBED_DIM) -> List[List[float]]:
+    """Old path: one create_embedding call per text (kept as fallback and for benchmarks)"""
+    embeddings = []
+    for i, text in enumerate(texts):
+        try:
+            embed = llm.create_embedding(text)
+            embeddings.append(embed['data'][0]['embedding'])
+        except Exception as e:
+            logger.error(f"Failed to create embedding for text {i}: {e}")
+            # Return zero vector as fallback
+            embeddings.append([0.0] * dim)
+    return embeddings
+
+
+def embed_batch(llm, texts: List[str], dim: int = EMBED_DIM) -> List[List[float]]:
+    """
+    Embed many texts at once.
+    Llama.embed() tokenizes every input, packs sequences into one batch until
+    n_batch tokens are used, decodes that batch and reads back the pooled vector of
+    every sequence, so N chunks cost roughly N * tokens / n_batch decodes instead of N.
+    Falls back to the per-text loop if the loaded llama.cpp build can't do
+    multi-sequence embedding (e.g. older bindings or n_seq_max=1 contexts).
+    """
+    if not texts:
+        return []
+    if getattr(llm, "_oonanji_batch_unsupported", False) or not hasattr(llm, "embed"):
+        return embed_each(llm, texts, dim)
+
+    embeddings: List[List[float]] = []
+    for start in range(0, len(texts), EMBED_MAX_TEXTS_PER_CALL):
+        group = texts[start:start + EMBED_MAX_TEXTS_PER_CALL]
+        try:
+            vectors = llm.embed(group)
+        except Exception as e:
+            logger.warning(f"Batched embedding unavailable, falling back to per-text loop: {e}")
+            try:
+                llm._oonanji_batch_unsupported = True
+            except Exception:
+                pass
+            embeddings.extend(embed_each(llm, group, dim))
+            continue
+
+        for i, vec in enumerate(vectors):
+            if not vec:
+                logger.error(f"Empty embedding for text {start + i}")
+                vec = [0.0] * dim
+            embeddings.append(vec)
+    return embeddings
+
+
+# --- Persistent embedding cache ---
+# Content-addressed: (embedding model fingerprint, prefix, sha256 of chunk text) -> vector.
+# Shared by indexer.py and the backend, so clearing the index, switching storage mode or
+# re-running after a crash never re-embeds text that was embedded before.
+EMBED_CACHE_PATH = Path(__file__).parent.absolute() / "embedding_cache.db"
+EMBED_CACHE_MAX_MB = int(os.environ.get("EMBED_CACHE_MAX_MB", "2048"))
+
+_ENTRY_OVERHEAD = 160  # Approx. bytes per row besides the vector (key columns + index entries)
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8', errors='ignore')).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, db_path: Path = EMBED_CACHE_PATH, max_bytes: int = EMBED_CACHE_MAX_MB * 1024 * 1024):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(db_path), timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute("PRAGMA synchronous=NORMAL;")
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                model TEXT NOT NULL,
+                prefix TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )
+        ''')
+        self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_embedding_cache_key ON embedding_cache (model, prefix, text_hash)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_lru ON embedding_cache (last_used)")
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS model_fingerprints (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime REAL,
+                fingerprint TEXT
+            )
+        ''')
+        # Counters live in the DB so the backend can report what the indexer subprocess did
+        self.conn.execute("CREATE TABLE IF NOT EXISTS embedding_cache_stats (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self.conn.executemany("INSERT OR IGNORE INTO embedding_cache_stats (key, value) VALUES (?, 0)",
+                              [("hits",), ("misses",), ("evictions",)])
+        self.conn.commit()
+        self.fingerprints: Dict[str, tuple] = {}
+        # Only misses are ever inserted, so counting inserts is close enough between evictions
+        self.approx_count = self.conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+
+    def model_fingerprint(self, model_path) -> str:
+        """sha256 of the model file, recomputed only when its size/mtime change"""
+        path = str(model_path)
+        st = os.stat(path)
+        cached = self.fingerprints.get(path)
+        if cached and cached[0] == (st.st_size, st.st_mtime):
+            return cached[1]
+        with self.lock:
+            row = self.conn.execute("SELECT size, mtime, fingerprint FROM model_fingerprints WHERE path = ?", (path,)).fetchone()
+            if row and row[0] == st.st_size and row[1] == st.st_mtime:
+                fingerprint = row[2]
+            else:
+                logger.info(f"Fingerprinting embedding model {path}...")
+                h = hashlib.sha256()
+                with open(path, 'rb') as f:
+                    for block in iter(lambda: f.read(8 * 1024 * 1024), b''):
+                        h.update(block)
+                fingerprint = h.hexdigest()
+                self.conn.execute("INSERT OR REPLACE INTO model_fingerprints (path, size, mtime, fingerprint) VALUES (?, ?, ?, ?)",
+                                  (path, st.st_size, st.st_mtime, fingerprint))
+                self.conn.commit()
+        self.fingerprints[path] = ((st.st_size, st.st_mtime), fingerprint)
+        return fingerprint
+
+    def get_many(self, model: str, prefix: str, hashes: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        unique = list(dict.fromkeys(hashes))
+        with self.lock:
+            for start in range(0, len(unique), 500):
+                group = unique[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT text_hash, vector FROM embedding_cache WHERE model = ? AND prefix = ? AND text_hash IN ({','.join('?' * len(group))})",
+                    [model, prefix] + group).fetchall()
+                for text_hash, blob in rows:
+                    vec = array('f')
+                    vec.frombytes(blob)
+                    found[text_hash] = vec.tolist()
+            now = time.time()
+            if found:
+                self.conn.executemany("UPDATE embedding_cache SET last_used = ? WHERE model = ? AND prefix = ? AND text_hash = ?",
+                                      [(now, model, prefix, h) for h in found])
+            hits = sum(1 for h in hashes if h in found)
+            self._bump(hits=hits, misses=len(hashes) - hits)
+            self.conn.commit()
+        return found
+
+    def put_many(self, model: str, prefix: str, items: Dict[str, List[float]]):
+        if not items:
+            return
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache (model, prefix, text_hash, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                [(model, prefix, h, array('f', vec).tobytes(), now) for h, vec in items.items()])
+            self.approx_count += len(items)
+            self._evict(entry_bytes=len(next(iter(items.values()))) * 4 + _ENTRY_OVERHEAD)
+            self.conn.commit()
+
+    def _bump(self, **counts):
+        for key, n in counts.items():
+            if n:
+                self.conn.execute("UPDATE embedding_cache_stats SET value = value + ? WHERE key = ?", (n, key))
+
+    def _evict(self, entry_bytes: int):
+        """Drop least recently used entries once the cache is over its size cap"""
+        max_entries = max(1, self.max_bytes // entry_bytes)
+        if self.approx_count <= max_entries:
+            return
+        count = self.conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+        self.approx_count = count
+        if count <= max_entries:
+            return
+        # Evict down to 90% of the cap so we don't evict on every single insert
+        n = count - int(max_entries * 0.9)
+        self.conn.execute("DELETE FROM embedding_cache WHERE rowid IN (SELECT rowid FROM embedding_cache ORDER BY last_used ASC LIMIT ?)", (n,))
+        self.approx_count = count - n
+        self._bump(evictions=n)
+        logger.info(f"Embedding cache: evicted {n} least recently used entries")
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            counters = dict(self.conn.execute("SELECT key, value FROM embedding_cache_stats").fetchall())
+            entries = self.conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+        lookups = counters.get("hits", 0) + counters.get("misses", 0)
+        return {
+            "entries": entries,
+            "size_bytes": os.path.getsize(self.db_path) if os.path.exists(self.db_path) else 0,
+            "max_bytes": self.max_bytes,
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+            "hit_rate": round(counters.get("hits", 0) / lookups, 4) if lookups else 0.0,
+            "evictions": counters.get("evictions", 0),
+        }
+
+
+_embedding_cache: Optional[EmbeddingCache] = None
+_embedding_cache_lock = threading.Lock()
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    global _embedding_cache
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            try:
+                _embedding_cache = EmbeddingCache()
+            except Exception as e:
+                logger.error(f"Embedding cache unavailable: {e}")
+                return None
+        return _embedding_cache
+
+
+def embed_documents(embedding_function, texts: List[str], prefix: str = "") -> List[List[float]]:
+    """
+    Embed texts (prefix + text) through the persistent cache; only cache misses reach
+    the model. embedding_function must expose .model_path (GGUFEmbeddingFunction does).
+    """
+    if not texts:
+        return []
+    cache = get_embedding_cache()
+    if cache is None:
+        return embedding_function([prefix + t for t in texts])
+
+    try:
+        model = cache.model_fingerprint(embedding_function.model_path)
+        hashes = [_text_hash(t) for t in texts]
+        found = cache.get_many(model, prefix, hashes)
+    except Exception as e:
+        logger.error(f"Embedding cache lookup failed: {e}")
+        return embedding_function([prefix + t for t in texts])
+
+    # First occurrence of every uncached text (duplicates within one call are embedded once)
+    missing = list({h: i for i, h in reversed(list(enumerate(hashes))) if h not in found}.values())
+    if missing:
+        vectors = embedding_function([prefix + texts[i] for i in missing])
+        fresh = {}
+        for i, vec in zip(missing, vectors):
+            found[hashes[i]] = vec
+            # Don't cache the zero-vector fallback of a failed embedding
+            if vec and any(vec):
+                fresh[hashes[i]] = vec
+        try:
+            cache.put_many(model, prefix, fresh)
+        except Exception as e:
+            logger.error(f"Embedding cache write failed: {e}")
+    return [found[h] for h in hashes]
+
+
+# --- Query embedding cache ---
+# In-memory LRU of recent search queries -> vector (backend only). A retried or frequently
+# asked question is answered without taking the model lock or swapping models in.
+QUERY_EMBED_CACHE_SIZE = int(os.environ.get("QUERY_EMBED_CACHE_SIZE", "1024"))
+QUERY_EMBED_CACHE_TTL = float(os.environ.get("QUERY_EMBED_CACHE_TTL", "3600"))  # Seconds, 0 = never expire
+
+
+def normalize_query(text: str) -> str:
+    """Full-width/half-width and whitespace variants of a query share one cache entry"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class QueryEmbeddingCache:
+    def __init__(self, max_entries: int = QUERY_EMBED_CACHE_SIZE, ttl: float = QUERY_EMBED_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # (model key, normalized query) -> (stored at, vector), least recently used first
+        self.entries: "OrderedDict[Tuple[str, str], Tuple[float, List[float]]]" = OrderedDict()
+        self.hits = self.misses = self.evictions = self.expired = 0
+
+    def get(self, model: str, query: str) -> Optional[List[float]]:
+        key = (model, query)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl and time.monotonic() - entry[0] > self.ttl:
+                del self.entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, model: str, query: str, vector: List[float]):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[(model, query)] = (time.monotonic(), vector)
+            self.entries.move_to_end((model, query))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expired": self.expired,
+            }
+
+
+_query_embedding_cache = QueryEmbeddingCache()
+
+def get_query_embedding_cache() -> QueryEmbeddingCache:
+    return _query_embedding_cache
+
+
+def embed_query(embedding_function, text: str, prefix: str = "") -> List[float]:
+    """
+    Embed one search query (prefix + normalized text) through the query cache, keyed by
+    the model file (path, size, mtime: a replaced model never serves old vectors).
+    embedding_function must expose .model_path (GGUFEmbeddingFunction does).
+    """
+    query = prefix + normalize_query(text)
+    try:
+        st = os.stat(embedding_function.model_path)
+        model = f"{embedding_function.model_path}:{st.st_size}:{st.st_mtime}"
+    except (AttributeError, OSError):
+        return embedding_function([query])[0]
+    cache = _query_embedding_cache
+    vector = cache.get(model, query)
+    if vector is None:
+        vector = embedding_function([query])[0]
+        # Don't cache the empty/zero-vector fallback of a failed embedding
+        if vector and any(vector):
+            cache.put(model, query, vector)
+    return vector
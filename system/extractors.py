@@ -0,0 +1,198 @@
+import io
+import os
+import csv
+import codecs
+import hashlib
+import logging
+from pathlib import Path
+from typing import Optional, Dict, Any, Iterable, Iterator, List
+
+from splitter import DEFAULT_CHUNKS, ChunkSpec, iter_chunks
+
+# Document Loaders
+try:
+    import docx
+except ImportError:
+    docx = None
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+logger = logging.getLogger("indexer")
+
+# File types picked up by the NAS indexer
+TEXT_EXTENSIONS = ('.txt', '.md', '.json', '.py', '.js', '.ts', '.html', '.css', '.csv')
+INDEXED_EXTENSIONS = TEXT_EXTENSIONS + ('.docx', '.xlsx')
+
+# Chunks indexed per file. Text is decoded and chunked as it is read, so this (not the
+# file size) bounds memory; whatever lies beyond the budget is not indexed.
+MAX_CHUNKS_PER_FILE = int(os.environ.get("INDEX_MAX_CHUNKS_PER_FILE", "4000"))
+READ_BLOCK_CHARS = 64 * 1024
+
+# Tried in order when a file's encoding is unknown (uploads)
+TEXT_ENCODINGS = ('utf-8', 'shift_jis', 'latin-1')
+
+
+def read_docx_file(path: Path) -> str:
+    if not docx: return ""
+    try:
+        doc = docx.Document(path)
+        return "\n".join([para.text for para in doc.paragraphs])
+    except Exception as e:
+        logger.warning(f"Error reading docx {path}: {e}")
+        return ""
+
+def iter_excel_text(path: Path) -> Iterator[str]:
+    """Text of a workbook, row by row (read-only mode streams the sheets)"""
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        first = True
+        for sheet in wb.worksheets:
+            lines = [f"--- Sheet: {sheet.title} ---"]
+            for row in sheet.iter_rows(values_only=True):
+                row_text = [str(cell) for cell in row if cell is not None]
+                if row_text:
+                    lines.append(" ".join(row_text))
+                if len(lines) >= 256:
+                    yield ("" if first else "\n") + "\n".join(lines)
+                    first, lines = False, []
+            if lines:
+                yield ("" if first else "\n") + "\n".join(lines)
+                first = False
+    finally:
+        wb.close()
+
+def read_excel_file(path: Path) -> str:
+    if not openpyxl: return ""
+    try:
+        return "".join(iter_excel_text(path))
+    except Exception as e:
+        logger.warning(f"Error reading xlsx {path}: {e}")
+        return ""
+
+def iter_file_text(path, encoding: str = 'utf-8', errors: str = 'ignore', block_chars: int = READ_BLOCK_CHARS) -> Iterator[str]:
+    """Decode a file incrementally, block_chars characters at a time"""
+    with open(path, encoding=encoding, errors=errors) as f:
+        for block in iter(lambda: f.read(block_chars), ''):
+            yield block
+
+def detect_encoding(path, candidates=TEXT_ENCODINGS, sample_bytes: int = 256 * 1024) -> str:
+    """First candidate that decodes the start of the file (read once, not once per candidate)"""
+    with open(path, 'rb') as f:
+        sample = f.read(sample_bytes)
+    for encoding in candidates:
+        try:
+            # final=False: a multi-byte character cut off by the sample is not an error
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except (UnicodeDecodeError, LookupError):
+            continue
+    return candidates[-1]
+
+def iter_csv_chunks(path, spec: ChunkSpec = DEFAULT_CHUNKS, encoding: str = 'utf-8', errors: str = 'ignore') -> Iterator[str]:
+    """Whole rows per chunk, each chunk starting with the header row so it stays readable alone"""
+    measure, budget = spec.measure()
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator='\n')
+
+    def format_row(row):
+        out.seek(0)
+        out.truncate()
+        writer.writerow(row)
+        return out.getvalue()
+
+    with open(path, encoding=encoding, errors=errors, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        header_line = format_row(header)
+        header_size = measure(header_line)
+        rows, size, any_rows = [], header_size, False
+        for row in reader:
+            any_rows = True
+            line = format_row(row)
+            line_size = measure(line)
+            if rows and size + line_size > budget:
+                yield header_line + "".join(rows).rstrip("\n")
+                rows, size = [], header_size
+            if header_size + line_size > budget:
+                # A single oversized row is split like plain text
+                for part in iter_chunks([line.rstrip("\n")], spec.reduced(header_size)):
+                    yield header_line + part
+                continue
+            rows.append(line)
+            size += line_size
+        if rows or not any_rows:
+            yield header_line + "".join(rows).rstrip("\n")
+
+def iter_document_chunks(path: str, spec: ChunkSpec = DEFAULT_CHUNKS, encoding: str = 'utf-8') -> Iterator[str]:
+    """Chunks of one document, produced while it is read"""
+    file_path = Path(path)
+    suffix = file_path.suffix.lower()
+    if suffix == '.docx':
+        return iter_chunks([read_docx_file(file_path)], spec)
+    if suffix == '.xlsx':
+        if not openpyxl:
+            return iter(())
+        return iter_chunks(iter_excel_text(file_path), spec)
+    if suffix == '.csv':
+        return iter_csv_chunks(path, spec, encoding)
+    return iter_chunks(iter_file_text(path, encoding), spec)
+
+def collect_chunks(chunks: Iterable[str], max_chunks: int, name: str) -> List[str]:
+    """Take at most max_chunks; whitespace-only text yields no chunks"""
+    result, has_text = [], False
+    for chunk in chunks:
+        if len(result) >= max_chunks:
+            logger.info(f"    - {name}: chunk budget of {max_chunks} reached, the rest is not indexed")
+            break
+        result.append(chunk)
+        has_text = has_text or bool(chunk.strip())
+    return result if has_text else []
+
+def extract_chunks(path: str, max_chunks: int = MAX_CHUNKS_PER_FILE, spec: ChunkSpec = DEFAULT_CHUNKS,
+                   encoding: str = 'utf-8') -> Optional[List[str]]:
+    """
+    Extract and chunk one file. Runs inside the indexer's process pool, so it must
+    stay a picklable top-level function.
+    Returns [] when the file has no text and None when it should be skipped
+    (read error) so the next scan retries it.
+    """
+    name = Path(path).name
+    try:
+        try:
+            return collect_chunks(iter_document_chunks(path, spec, encoding), max_chunks, name)
+        except csv.Error as e:
+            logger.info(f"    - {name}: not parseable as CSV ({e}), chunking as plain text")
+            return collect_chunks(iter_chunks(iter_file_text(path, encoding), spec), max_chunks, name)
+    except Exception as read_err:
+        logger.warning(f"    - Read error: {read_err}")
+        return None
+
+def hash_file(path: str, block_size: int = 1024 * 1024) -> str:
+    """Content hash of a file's bytes (streamed, constant memory)"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8', errors='ignore')).hexdigest()
+
+def extract_document(path: str, size: int, known_hash: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Hash the file and, unless the hash matches what is already indexed, extract its chunks.
+    An mtime-only change (copy, touch, NAS resync) therefore costs one hash pass.
+    """
+    try:
+        content_hash = hash_file(path)
+    except Exception as e:
+        logger.warning(f"    - Hash error: {e}")
+        return {"content_hash": None, "chunks": None, "unchanged": False}
+
+    if known_hash and known_hash == content_hash:
+        return {"content_hash": content_hash, "chunks": None, "unchanged": True}
+    return {"content_hash": content_hash, "chunks": extract_chunks(path), "unchanged": False}
@@ -0,0 +1,272 @@
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Set, Tuple
+
+logger = logging.getLogger("indexer")
+
+# Quiet period before a batch of changes is handed to the indexer, and the longest a
+# change may wait while events keep coming in (e.g. a large folder being copied).
+WATCH_DEBOUNCE = float(os.environ.get("INDEX_WATCH_DEBOUNCE", "2.0"))
+WATCH_MAX_DELAY = float(os.environ.get("INDEX_WATCH_MAX_DELAY", "10.0"))
+WATCH_POLL_INTERVAL = float(os.environ.get("INDEX_WATCH_POLL_INTERVAL", "10.0"))
+
+# Filesystems where inotify does not see changes made by other hosts
+REMOTE_FS_TYPES = ("nfs", "nfs4", "cifs", "smb3", "smbfs", "9p", "fuse.sshfs", "fuse.rclone")
+
+# <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+class ChangeBatcher:
+    """
+    Collects changed paths and releases them as one batch once no new change arrived
+    for `debounce` seconds (or `max_delay` after the first one). Paths below a directory
+    that is also in the batch are dropped, since the directory is rescanned anyway.
+    """
+    def __init__(self, debounce: float = WATCH_DEBOUNCE, max_delay: float = WATCH_MAX_DELAY):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.cond = threading.Condition()
+        self.pending: Set[str] = set()
+        self.first_at = 0.0
+        self.last_at = 0.0
+
+    def add(self, path: str):
+        with self.cond:
+            now = time.monotonic()
+            if not self.pending:
+                self.first_at = now
+            self.pending.add(path)
+            self.last_at = now
+            self.cond.notify()
+
+    def next_batch(self, stop_event: threading.Event, timeout: float = 1.0) -> List[str]:
+        """Blocks up to `timeout` seconds; returns [] if nothing is due yet"""
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while not stop_event.is_set():
+                now = time.monotonic()
+                if self.pending:
+                    due = min(self.last_at + self.debounce, self.first_at + self.max_delay)
+                    if now >= due:
+                        batch = collapse_paths(self.pending)
+                        self.pending = set()
+                        return batch
+                    wait = min(due, deadline) - now
+                else:
+                    wait = deadline - now
+                if wait <= 0:
+                    break
+                self.cond.wait(wait)
+        return []
+
+
+def collapse_paths(paths) -> List[str]:
+    result: List[str] = []
+    for path in sorted(paths):
+        if result and (path == result[-1] or path.startswith(result[-1].rstrip(os.sep) + os.sep)):
+            continue
+        result.append(path)
+    return result
+
+
+def filesystem_type(path: Path) -> str:
+    """fstype of the mount containing path, from /proc/mounts ("" if unknown)"""
+    best, fstype = "", ""
+    try:
+        target = os.path.realpath(path)
+        with open("/proc/mounts") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 3:
+                    continue
+                mount_point = parts[1].replace("\\040", " ")
+                if (target == mount_point or target.startswith(mount_point.rstrip("/") + "/")) and len(mount_point) > len(best):
+                    best, fstype = mount_point, parts[2]
+    except OSError:
+        pass
+    return fstype
+
+
+class InotifyWatcher:
+    """Recursive inotify watch on a directory tree (Linux, via libc through ctypes)"""
+    def __init__(self, root: Path, on_change: Callable[[str], None], extensions: Tuple[str, ...]):
+        self.root = Path(root)
+        self.on_change = on_change
+        self.extensions = extensions
+        self.wds: Dict[int, str] = {}
+        self.stop_event = threading.Event()
+        self.fd = -1
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.libc.inotify_init1.argtypes = [ctypes.c_int]
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+
+    def start(self):
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1 failed: {os.strerror(err)}")
+        try:
+            count = self._watch_tree(str(self.root))
+        except OSError:
+            os.close(self.fd)
+            raise
+        logger.info(f"inotify: watching {count} directories under {self.root}")
+        threading.Thread(target=self._run, name="index-watch", daemon=True).start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _watch_tree(self, top: str) -> int:
+        count = 0
+        for dirpath, _, _ in os.walk(top):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dirpath), WATCH_MASK | IN_ONLYDIR)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOSPC:
+                    raise OSError(err, "inotify watch limit reached (fs.inotify.max_user_watches)")
+                continue  # Vanished or unreadable directory
+            self.wds[wd] = dirpath
+            count += 1
+        return count
+
+    def _run(self):
+        poller = select.poll()
+        poller.register(self.fd, select.POLLIN)
+        try:
+            while not self.stop_event.is_set():
+                if not poller.poll(500):
+                    continue
+                try:
+                    data = os.read(self.fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+                self._dispatch(data)
+        except Exception as e:
+            logger.error(f"inotify watcher failed: {e}")
+            # Let the indexer rescan everything rather than silently missing changes
+            self.on_change(str(self.root))
+        finally:
+            os.close(self.fd)
+
+    def _dispatch(self, data: bytes):
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _, name_len = _EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + _EVENT_HEADER.size:offset + _EVENT_HEADER.size + name_len].rstrip(b"\0")
+            offset += _EVENT_HEADER.size + name_len
+
+            if mask & IN_Q_OVERFLOW:
+                logger.warning("inotify queue overflow, scheduling a full rescan")
+                self.on_change(str(self.root))
+                continue
+            if mask & IN_IGNORED:
+                self.wds.pop(wd, None)
+                continue
+            parent = self.wds.get(wd)
+            if parent is None or not name:
+                continue  # *_SELF events: the parent directory reports the same change
+            path = os.path.join(parent, os.fsdecode(name))
+
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # New subtree: watch it, and rescan it since files may predate the watch
+                    try:
+                        self._watch_tree(path)
+                    except OSError as e:
+                        logger.error(f"inotify: {e}")
+                self.on_change(path)
+            elif path.endswith(self.extensions):
+                self.on_change(path)
+
+
+class PollingWatcher:
+    """Fallback: periodic walk comparing (mtime, size) of indexable files"""
+    def __init__(self, root: Path, on_change: Callable[[str], None], extensions: Tuple[str, ...],
+                 interval: float = WATCH_POLL_INTERVAL):
+        self.root = Path(root)
+        self.on_change = on_change
+        self.extensions = extensions
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.files: Dict[str, tuple] = {}
+
+    def start(self):
+        self.files = self._snapshot()
+        logger.info(f"Polling {self.root} every {self.interval:.0f}s ({len(self.files)} files)")
+        threading.Thread(target=self._run, name="index-watch", daemon=True).start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _snapshot(self) -> Dict[str, tuple]:
+        files = {}
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                if not name.endswith(self.extensions):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files[path] = (st.st_mtime, st.st_size)
+        return files
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                current = self._snapshot()
+            except Exception as e:
+                logger.error(f"Polling watcher failed: {e}")
+                continue
+            for path in current.keys() - self.files.keys():
+                self.on_change(path)
+            for path in self.files.keys() - current.keys():
+                self.on_change(path)
+            for path, sig in current.items():
+                if path in self.files and self.files[path] != sig:
+                    self.on_change(path)
+            self.files = current
+
+
+def create_watcher(root: Path, on_change: Callable[[str], None], extensions: Tuple[str, ...]):
+    """inotify for local filesystems, polling for network mounts or when inotify is unavailable"""
+    fstype = filesystem_type(root)
+    if fstype.startswith(REMOTE_FS_TYPES):
+        logger.info(f"{root} is on {fstype}, inotify can't see remote changes; polling instead")
+    else:
+        try:
+            watcher = InotifyWatcher(root, on_change, extensions)
+            watcher.start()
+            return watcher
+        except (OSError, AttributeError) as e:
+            logger.warning(f"inotify unavailable ({e}), falling back to polling")
+    watcher = PollingWatcher(root, on_change, extensions)
+    watcher.start()
+    return watcher
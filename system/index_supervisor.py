@@ -0,0 +1,244 @@
+import sys
+import json
+import time
+import socket
+import sqlite3
+import logging
+import threading
+import subprocess
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+
+logger = logging.getLogger("oonanji-backend")
+
+# indexer.py exit codes the supervisor must not treat as crashes
+EXIT_OK = 0
+EXIT_ALREADY_RUNNING = 3
+
+CONTROL_COMMANDS = ("stop", "pause", "resume", "priority", "rescan")
+
+
+class IndexingWorker:
+    """One indexer.py process for one storage root, plus its control socket"""
+    def __init__(self, supervisor: "IndexingSupervisor", storage_mode: str, watch: bool = False, full_verify: bool = False):
+        self.supervisor = supervisor
+        self.storage_mode = storage_mode
+        self.watch = watch  # Long-running watcher (indexer.py --watch) instead of a one-off scan
+        self.full_verify = full_verify  # Ignore the stored directory tree on the first pass
+        self.proc: Optional[subprocess.Popen] = None
+        self.sock: Optional[socket.socket] = None
+        self.send_lock = threading.Lock()
+        self.status: Dict[str, Any] = {"status": "Starting...", "progress": 0, "is_indexing": True, "processed_files": 0, "total_files": 0}
+        self.log = deque(maxlen=supervisor.log_lines)
+        self.restarts = 0
+        self.stop_requested = False
+        self.finished = threading.Event()
+        self.started_at = time.time()
+
+    def spawn(self):
+        parent_sock, child_sock = socket.socketpair()
+        cmd = [sys.executable, str(self.supervisor.script), self.storage_mode, "--control-fd", str(child_sock.fileno())]
+        if self.watch:
+            cmd.append("--watch")
+        if self.full_verify:
+            cmd.append("--full-verify")
+        self.proc = subprocess.Popen(cmd, cwd=str(self.supervisor.script.parent), pass_fds=(child_sock.fileno(),))
+        child_sock.close()
+        self.sock = parent_sock
+        logger.info(f"Indexing worker started for '{self.storage_mode}' (pid {self.proc.pid})")
+        threading.Thread(target=self._read_events, name=f"index-supervisor-{self.storage_mode}", daemon=True).start()
+
+    def send(self, cmd: str, **payload) -> bool:
+        if not self.sock:
+            return False
+        line = json.dumps({"cmd": cmd, **payload}) + "\n"
+        try:
+            with self.send_lock:
+                self.sock.sendall(line.encode("utf-8"))
+            return True
+        except OSError as e:
+            logger.warning(f"Indexing worker '{self.storage_mode}' control channel closed: {e}")
+            return False
+
+    def _read_events(self):
+        try:
+            with self.sock.makefile("r", encoding="utf-8") as events:
+                for line in events:
+                    try:
+                        event = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self._on_event(event)
+        except OSError:
+            pass
+        # EOF: the worker exited (or closed the channel, which it only does on exit)
+        exit_code = self.proc.wait()
+        self.sock.close()
+        self.sock = None
+        self.supervisor._on_worker_exit(self, exit_code)
+
+    def _on_event(self, event: Dict[str, Any]):
+        kind = event.pop("event", None)
+        if kind == "status":
+            self.status.update(event)
+        elif kind == "log":
+            self.log.append(event.get("line", ""))
+        self.supervisor._notify(self, kind, event)
+
+    def snapshot(self) -> Dict[str, Any]:
+        status = dict(self.status)
+        status["storage_mode"] = self.storage_mode
+        status["indexing_log"] = list(self.log)
+        status["restarts"] = self.restarts
+        status["worker_pid"] = self.proc.pid if self.proc else None
+        status["watching"] = self.watch
+        return status
+
+
+class IndexingSupervisor:
+    """
+    Owns the indexer processes: at most one per storage root, restarted on crash,
+    controlled over a socketpair (JSON lines: commands down, status/log events up).
+    """
+    def __init__(self, script: Path, db_path: Path, max_restarts: int = 3, log_lines: int = 2000):
+        self.script = script
+        self.db_path = db_path
+        self.max_restarts = max_restarts
+        self.log_lines = log_lines
+        self.lock = threading.Lock()
+        self.workers: Dict[str, IndexingWorker] = {}
+        self.last_worker: Optional[IndexingWorker] = None
+        self.listeners = []  # callables(storage_mode, kind, payload), see add_listener
+
+    def add_listener(self, fn):
+        self.listeners.append(fn)
+
+    def _notify(self, worker: IndexingWorker, kind: str, payload: Dict[str, Any]):
+        for fn in self.listeners:
+            try:
+                fn(worker.storage_mode, kind, payload)
+            except Exception as e:
+                logger.error(f"Indexing listener error: {e}")
+
+    def is_running(self, storage_mode: Optional[str] = None) -> bool:
+        with self.lock:
+            if storage_mode is None:
+                return bool(self.workers)
+            return storage_mode in self.workers
+
+    def is_watching(self, storage_mode: str) -> bool:
+        with self.lock:
+            worker = self.workers.get(storage_mode)
+            return bool(worker and worker.watch)
+
+    def start(self, storage_mode: str, watch: bool = False, full_verify: bool = False) -> bool:
+        """Start indexing (or watching) a storage root. Returns False if one is already running for it."""
+        with self.lock:
+            if storage_mode in self.workers:
+                return False
+            worker = IndexingWorker(self, storage_mode, watch=watch, full_verify=full_verify)
+            self.workers[storage_mode] = worker
+            self.last_worker = worker
+            worker.spawn()
+        return True
+
+    def send(self, cmd: str, storage_mode: Optional[str] = None, watch: Optional[bool] = None, **payload) -> int:
+        """Send a control command to one or all workers (optionally only watchers / one-off passes), returns how many received it"""
+        if cmd not in CONTROL_COMMANDS:
+            raise ValueError(f"Unknown indexing command: {cmd}")
+        with self.lock:
+            targets = [w for m, w in self.workers.items()
+                       if (storage_mode is None or m == storage_mode) and (watch is None or w.watch == watch)]
+        sent = 0
+        for worker in targets:
+            if cmd == "stop":
+                worker.stop_requested = True
+            if worker.send(cmd, **payload):
+                sent += 1
+        return sent
+
+    def stop_watchers(self, timeout: float = 30.0) -> List[str]:
+        """Stop the watch-mode workers and wait for them to exit; returns the storage modes they watched"""
+        with self.lock:
+            workers = [w for w in self.workers.values() if w.watch]
+        for worker in workers:
+            worker.stop_requested = True
+            worker.send("stop")
+        for worker in workers:
+            if not worker.finished.wait(timeout) and worker.proc and worker.proc.poll() is None:
+                logger.warning(f"Index watcher '{worker.storage_mode}' did not stop in time, terminating")
+                worker.proc.terminate()
+                worker.finished.wait(timeout)
+        return [worker.storage_mode for worker in workers]
+
+    def status(self, storage_mode: Optional[str] = None) -> Dict[str, Any]:
+        with self.lock:
+            worker = self.workers.get(storage_mode) if storage_mode else self.last_worker
+        return worker.snapshot() if worker else {}
+
+    def forget_finished(self):
+        """Drop the last finished run's status (e.g. after the index was cleared)"""
+        with self.lock:
+            if self.last_worker and self.last_worker.storage_mode not in self.workers:
+                self.last_worker = None
+
+    def _on_worker_exit(self, worker: IndexingWorker, exit_code: int):
+        crashed = exit_code not in (EXIT_OK, EXIT_ALREADY_RUNNING) and not worker.stop_requested
+        if crashed and worker.restarts < self.max_restarts:
+            worker.restarts += 1
+            delay = 2 ** worker.restarts
+            msg = f"Indexer crashed (exit code {exit_code}), restarting in {delay}s ({worker.restarts}/{self.max_restarts})"
+            logger.error(msg)
+            worker.log.append(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}")
+            worker.status.update({"status": "Restarting after crash...", "is_indexing": True})
+            self._notify(worker, "status", dict(worker.status))
+            time.sleep(delay)
+            if not worker.stop_requested:
+                worker.spawn()
+                return
+            exit_code = EXIT_OK
+
+        if crashed:
+            msg = f"Indexer crashed (exit code {exit_code}), giving up after {worker.restarts} restarts"
+            logger.error(msg)
+            worker.log.append(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}")
+            worker.status.update({"status": f"Failed: indexer crashed (exit code {exit_code})", "is_indexing": False})
+            self._persist(worker)
+        elif worker.status.get("is_indexing"):
+            # Exited without a final status event (e.g. killed while stopping)
+            worker.status.update({"status": "Stopped" if worker.stop_requested else "Interrupted", "is_indexing": False})
+            self._persist(worker)
+
+        logger.info(f"Indexing worker for '{worker.storage_mode}' exited with code {exit_code}")
+        with self.lock:
+            if self.workers.get(worker.storage_mode) is worker:
+                del self.workers[worker.storage_mode]
+        worker.finished.set()
+        self._notify(worker, "status", dict(worker.status))
+
+    def _persist(self, worker: IndexingWorker):
+        """Terminal states the worker could not report itself go to the settings table"""
+        status = worker.snapshot()
+        status["indexing_log"] = status["indexing_log"][-50:]
+        status["last_updated"] = datetime.now().isoformat()
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=60)
+            conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", ("indexing_status", json.dumps(status)))
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Failed to persist indexing status: {e}")
+
+    def shutdown(self, timeout: float = 10.0):
+        """Ask every worker to stop (they flush and exit) and wait a bit for them"""
+        with self.lock:
+            workers = list(self.workers.values())
+        for worker in workers:
+            worker.stop_requested = True
+            worker.send("stop")
+        for worker in workers:
+            if not worker.finished.wait(timeout) and worker.proc and worker.proc.poll() is None:
+                logger.warning(f"Indexing worker '{worker.storage_mode}' did not stop in time, terminating")
+                worker.proc.terminate()
@@ -5,14 +5,20 @@ os.environ['LANG'] = 'POSIX'
 
 import sys
 import json
+import argparse
 import sqlite3
 import logging
 import time
 from pathlib import Path
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from datetime import datetime
 import gc
 import hashlib
+import queue
+import threading
+import socket
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 # Llama.cpp
 try:
@@ -20,22 +26,20 @@ try:
 except ImportError:
     Llama = None
 
-# ChromaDB
-try:
-    import chromadb
-    from chromadb.config import Settings
-except ImportError:
-    chromadb = None
-
-# Document Loaders
-try:
-    import docx
-except ImportError:
-    docx = None
-try:
-    import openpyxl
-except ImportError:
-    openpyxl = None
+from embeddings import EMBED_MODEL_NAME, EMBED_DIM, embed_model_kwargs, embed_batch, embed_documents, get_embedding_cache
+from extractors import INDEXED_EXTENSIONS, extract_document, text_hash
+from fs_watcher import ChangeBatcher, create_watcher
+from splitter import set_tokenizer_model
+from shards import LAYOUT_KEY, ShardLayout, ShardedCollection, list_shards, bump_generation
+from write_batcher import ChromaWriteBatcher
+from vector_store import STORE_KEY, VECTOR_STORE, open_vector_store
+from duplicates import create_duplicate_indexes, find_original, reconcile_duplicates
+from keyword_index import get_keyword_index
+from priorities import RAG_HITS_SCHEMA, PRIORITY_BACKLOG, PriorityTaskQueue, TaskPriority
+from summaries import SUMMARY_PREVIEW_CHARS, QUEUE_SUMMARY_SQL, create_summary_tables, pending_summaries, summarize_pending
+from scanner import (DIR_STATE_SCHEMA, CHECKPOINT_SCHEMA, CHECKPOINT_INTERVAL, ScanCheckpoint, scan_directories, scan_paths,
+                     load_dir_tree, save_dir_tree, load_checkpoint, clear_checkpoint, full_verify_due, mark_full_verify,
+                     forget_files)
 
 # Setup Logging
 logging.basicConfig(
@@ -81,10 +85,9 @@ class ModelManager:
         try:
             self.current_embed_model = Llama(
                 model_path=str(model_path),
-                embedding=True,      # Set to embedding mode
                 n_gpu_layers=0,      # Force CPU for stability
-                n_ctx=2048,
-                verbose=False
+                verbose=False,
+                **embed_model_kwargs()  # Embedding mode, n_batch sized for multi-sequence batches
             )
         except Exception as e:
             logger.error(f"Failed to load embedding model: {e}")
@@ -130,26 +133,24 @@ class ModelManager:
             logger.error(f"Failed to load chat model: {e}")
             return None
 
-model_manager = ModelManager()
+    def unload(self):
+        if self.current_embed_model:
+            logger.info(f"Unloading model: {self.current_embed_path}")
+            del self.current_embed_model
+            self.current_embed_model = None
+            self.current_embed_path = None
+            gc.collect()
 
-def generate_summary(text: str) -> str:
-    if not text: return ""
-    llm = model_manager.get_chat_model()
-    if not llm: return "Summary generation unavailable."
+model_manager = ModelManager()
 
-    try:
-        # Use first 800 chars for summary to keep it safe within context
-        preview = text[:800]
-        messages = [
-            {"role": "system", "content": "You are a helpful assistant. Summarize the provided document text in 3 concise Japanese sentences."},
-            {"role": "user", "content": f"Document Snippet:\n{preview}\n\nSummary:"}
-        ]
-        
-        response = llm.create_chat_completion(messages=messages, max_tokens=200, temperature=0.3)
-        return response['choices'][0]['message']['content'].strip()
-    except Exception as e:
-        logger.error(f"Summarization error: {e}")
-        return "Summary generation failed."
+def summarize_text(llm, preview: str) -> str:
+    # The preview (first SUMMARY_PREVIEW_CHARS chars) keeps the prompt safe within context
+    messages = [
+        {"role": "system", "content": "You are a helpful assistant. Summarize the provided document text in 3 concise Japanese sentences."},
+        {"role": "user", "content": f"Document Snippet:\n{preview}\n\nSummary:"}
+    ]
+    response = llm.create_chat_completion(messages=messages, max_tokens=200, temperature=0.3)
+    return response['choices'][0]['message']['content'].strip()
 
 class GGUFEmbeddingFunction:
     def __init__(self, model_path: Path):
@@ -161,89 +162,120 @@ class GGUFEmbeddingFunction:
             if not llm:
                 logger.error("Embedding model not loaded")
                 return [[] for _ in input] # Return empty if failed
-                
-            embeddings = []
-            for i, text in enumerate(input):
-                try:
-                    # Llama.cpp embedding
-                    embed = llm.create_embedding(text)
-                    embeddings.append(embed['data'][0]['embedding'])
-                except Exception as e:
-                    logger.error(f"Failed to create embedding for text {i}: {e}")
-                    # Return zero vector as fallback
-                    embeddings.append([0.0] * 768)  # nomic-embed has 768 dimensions
-            return embeddings
+
+            return embed_batch(llm, input)
         except Exception as e:
             logger.error(f"Critical error in embedding function: {e}")
-            return [[0.0] * 768 for _ in input]
+            return [[0.0] * EMBED_DIM for _ in input]
 
-def read_docx_file(path: Path) -> str:
-    if not docx: return ""
-    try:
-        doc = docx.Document(path)
-        return "\n".join([para.text for para in doc.paragraphs])
-    except Exception as e:
-        logger.warning(f"Error reading docx {path}: {e}")
-        return ""
+# --- Control Channel ---
+# When started by the backend's IndexingSupervisor, the worker gets one end of a socketpair
+# (--control-fd). Commands (stop/pause/resume/priority) come in as JSON lines, status and
+# log events go out the same way. Without it (manual CLI run) we fall back to the DB flag.
+PRIORITY_NICE = {"low": 15, "normal": 0, "high": -5}
 
-def read_excel_file(path: Path) -> str:
-    if not openpyxl: return ""
-    try:
-        wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
-        text = []
-        for sheet in wb.worksheets:
-            text.append(f"--- Sheet: {sheet.title} ---")
-            for row in sheet.iter_rows(values_only=True):
-                row_text = [str(cell) for cell in row if cell is not None]
-                if row_text:
-                    text.append(" ".join(row_text))
-        return "\n".join(text)
-    except Exception as e:
-        logger.warning(f"Error reading xlsx {path}: {e}")
-        return ""
 
-def recursive_character_text_splitter(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> List[str]:
-    chunks = []
-    if not text:
-        return chunks
-    
-    start = 0
-    text_len = len(text)
-    
-    while start < text_len:
-        end = start + chunk_size
-        if end >= text_len:
-            chunks.append(text[start:])
-            break
-        
-        # Try to find a split point (newline or space)
-        split_point = -1
-        # Look for newline in the overlap area
-        search_start = max(start, end - chunk_overlap)
-        
-        # Prioritize newlines
-        for i in range(end, search_start, -1):
-            if text[i] == '\n':
-                split_point = i
-                break
-        
-        if split_point == -1:
-            # Look for space
-            for i in range(end, search_start, -1):
-                if text[i] == ' ':
-                    split_point = i
-                    break
-        
-        if split_point != -1:
-            chunks.append(text[start:split_point])
-            start = split_point + 1 # Skip the delimiter
+class ControlChannel:
+    def __init__(self, fd: int):
+        self.sock = socket.socket(fileno=fd)
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        # Cleared while paused; every stage waits on it before taking the next item
+        self.resume_event = threading.Event()
+        self.resume_event.set()
+        self.rescan_handler = None  # Set in watch mode
+
+    def send(self, event: str, **payload):
+        line = json.dumps({"event": event, **payload}) + "\n"
+        try:
+            with self.lock:
+                self.sock.sendall(line.encode("utf-8"))
+        except OSError:
+            pass  # Supervisor gone; keep indexing, the DB status is still written at the end
+
+    def listen(self):
+        threading.Thread(target=self._read_commands, name="index-control", daemon=True).start()
+
+    def _read_commands(self):
+        try:
+            with self.sock.makefile("r", encoding="utf-8") as commands:
+                for line in commands:
+                    try:
+                        self.handle(json.loads(line))
+                    except Exception as e:
+                        logger.error(f"Bad control command {line!r}: {e}")
+        except OSError:
+            pass
+        # Supervisor closed its end: the backend is gone, wind down cleanly
+        if not self.stop_event.is_set():
+            logger.info("Control channel closed. Stopping.")
+            self.stop_event.set()
+            self.resume_event.set()
+
+    def handle(self, command: Dict[str, Any]):
+        cmd = command.get("cmd")
+        if cmd == "stop":
+            add_log("Stop requested.")
+            self.stop_event.set()
+            self.resume_event.set()  # Paused stages must wake up to see the stop
+        elif cmd == "pause":
+            add_log("Paused.")
+            self.resume_event.clear()
+        elif cmd == "resume":
+            add_log("Resumed.")
+            self.resume_event.set()
+        elif cmd == "priority":
+            set_process_priority(command.get("level", "normal"))
+        elif cmd == "rescan":
+            if self.rescan_handler:
+                add_log("Full rescan requested.")
+                self.rescan_handler(full_verify=bool(command.get("full_verify")))
+            else:
+                add_log("Rescan is only available in watch mode.")
         else:
-            # Hard split
-            chunks.append(text[start:end])
-            start = end - chunk_overlap
-            
-    return chunks
+            logger.warning(f"Unknown control command: {cmd}")
+
+
+control: Optional[ControlChannel] = None
+
 
+def set_process_priority(level: str):
+    """Renice this process (all threads, nice is per-thread on Linux) and its extraction workers"""
+    nice = PRIORITY_NICE.get(level)
+    if nice is None:
+        add_log(f"Unknown priority level: {level}")
+        return
+    pids = [os.getpid()]
+    try:
+        pids += [int(p) for p in os.listdir(f"/proc/{os.getpid()}/task")]
+        for child in Path(f"/proc/{os.getpid()}/task/{os.getpid()}/children").read_text().split():
+            pids += [int(p) for p in os.listdir(f"/proc/{child}/task")]
+    except Exception:
+        pass
+    failed = 0
+    for pid in set(pids):
+        try:
+            os.setpriority(os.PRIO_PROCESS, pid, nice)
+        except (PermissionError, ProcessLookupError, OSError):
+            failed += 1
+    add_log(f"Priority set to {level} (nice {nice})" + (f", {failed} threads could not be changed" if failed else ""))
+
+
+def acquire_root_lock(source_dir: Path):
+    """Exclusive per-storage-root lock so two indexers never work on the same tree"""
+    lock_path = BASE_DIR / f".indexer-{hashlib.md5(str(source_dir).encode()).hexdigest()[:12]}.lock"
+    lock_file = open(lock_path, "w")
+    try:
+        import fcntl
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except ImportError:
+        pass  # No flock (Windows); the supervisor still keeps one worker per root
+    except OSError:
+        lock_file.close()
+        return None
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    return lock_file
 
 
 # Global log buffer
@@ -257,8 +289,18 @@ def add_log(message: str):
     log_buffer.append(log_entry)
     if len(log_buffer) > 50:
         log_buffer.pop(0)
+    if control:
+        control.send("log", line=log_entry)
 
-def update_status(status: str, progress: float, is_indexing: bool, processed: int, total: int):
+def update_status(status: str, progress: float, is_indexing: bool, processed: int, total: int, pipeline: Optional[Dict[str, Any]] = None):
+    if control:
+        # Supervised: progress is streamed to the backend; the settings blob is only
+        # written for start/end transitions so a restarted backend knows what happened.
+        control.send("status", status=status, progress=progress, is_indexing=is_indexing,
+                     processed_files=processed, total_files=total,
+                     last_updated=datetime.now().isoformat(), pipeline=pipeline or {})
+        if is_indexing and status != "Starting...":
+            return
     try:
         conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
@@ -278,7 +320,8 @@ def update_status(status: str, progress: float, is_indexing: bool, processed: in
             "processed_files": processed,
             "total_files": total,
             "last_updated": datetime.now().isoformat(),
-            "indexing_log": log_buffer
+            "indexing_log": log_buffer,
+            "pipeline": pipeline or {}
         }
         
         cursor.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", 
@@ -301,10 +344,911 @@ def check_stop_flag() -> bool:
     except:
         return False
 
-def main():
+# --- Indexing Pipeline ---
+# scan -> extract (process pool) -> chunk -> embed -> write, each stage in its own
+# thread connected by bounded queues so a slow stage applies backpressure upstream.
+# The scan -> extract queue is a large priority queue, so useful files are indexed first.
+PIPELINE_QUEUE_SIZE = int(os.environ.get("INDEXER_QUEUE_SIZE", "32"))
+EXTRACT_WORKERS = int(os.environ.get("INDEXER_EXTRACT_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+STATUS_INTERVAL = 1.0  # seconds between status/stop-flag checks
+STATE_FLUSH_ROWS = 5000  # last_seen touches per executemany transaction
+STATE_FLUSH_FILES = 200  # processed files per state-DB transaction in the write stage
+
+_DONE = None  # End-of-stream marker passed down the queues
+
+_extract_pool: Optional[ProcessPoolExecutor] = None
+
+def _init_extract_worker(tokenizer_model: Optional[Path], inherited_fds: Tuple[int, ...]):
+    for fd in inherited_fds:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+    if tokenizer_model is not None:
+        set_tokenizer_model(tokenizer_model)
+
+def get_extract_pool(tokenizer_model: Optional[Path] = None, inherited_fds: Tuple[int, ...] = ()) -> ProcessPoolExecutor:
+    """
+    Extraction worker pool, forked on first use and reused by later passes (watch mode).
+    The workers size chunks in tokens of `tokenizer_model` (the embedding model).
+    """
+    global _extract_pool
+    if _extract_pool is None:
+        # fork start method: main() creates the pool before the control channel's reader
+        # thread, the root lock and the vector store exist, so the workers inherit none of
+        # them; fds inherited from the backend (the control socket) are closed in the workers
+        ctx = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+        _extract_pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, mp_context=ctx, initializer=_init_extract_worker,
+                                            initargs=(tokenizer_model, inherited_fds))
+        _extract_pool.submit(os.getpid).result()  # Start the workers now
+    return _extract_pool
+
+def shutdown_extract_pool():
+    global _extract_pool
+    if _extract_pool is not None:
+        _extract_pool.shutdown(wait=False, cancel_futures=True)
+        _extract_pool = None
+
+
+class StageStats:
+    """Throughput counters for one pipeline stage (exposed in the indexing status)"""
+    def __init__(self, in_queue: Optional[queue.Queue] = None):
+        self.in_queue = in_queue
+        self.items = 0
+        self.busy = 0.0
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def record(self, busy: float, n: int = 1):
+        with self.lock:
+            self.items += n
+            self.busy += busy
+
+    def snapshot(self) -> Dict[str, Any]:
+        elapsed = max(time.time() - self.started, 1e-6)
+        return {
+            "processed": self.items,
+            "per_second": round(self.items / elapsed, 2),
+            "busy_ratio": round(min(self.busy / elapsed, 1.0), 2),
+            "queue_depth": self.in_queue.qsize() if self.in_queue is not None else 0,
+            "queue_capacity": self.in_queue.maxsize if self.in_queue is not None else 0,
+        }
+
+
+class IndexingPipeline:
+    def __init__(self, source_dir: Path, collection, embedding_function, scan_start_time: float,
+                 stop_event: Optional[threading.Event] = None, resume_event: Optional[threading.Event] = None,
+                 paths: Optional[List[str]] = None, full_verify: bool = False):
+        self.source_dir = source_dir
+        # None = scan the whole root; otherwise only these files/directories (watch mode)
+        self.paths = paths
+        # Directory tree shortcuts (full-root passes only), see scanner.py
+        self.full_verify = full_verify
+        self.scan_mode = "paths"
+        self.dir_scans = []
+        self.dirty_dirs: set = set()  # Directories with a file to retry: never skipped next scan
+        self.dirs_listed = 0
+        self.dirs_skipped = 0
+        # Resumable full-root passes: directories done so far are checkpointed, and a pass
+        # after an interrupted one skips the directories that one got through
+        self.checkpoint = ScanCheckpoint(scan_start_time) if paths is None else None
+        self.resumed_paths: set = set()
+        self.resumed_dirs = 0
+        self.resumed_files = 0
+        self.collection = collection
+        self.embedding_function = embedding_function
+        self.scan_start_time = scan_start_time
+        self.writer: Optional[ChromaWriteBatcher] = None
+        # content hash -> path whose chunks this pass stores for it (copies link to it, see duplicates.py)
+        self.originals: Dict[str, str] = {}
+        self.duplicates_count = 0
+
+        # External stop requests (control channel) are forwarded into this pass's own
+        # stop_event, which stage failures also set without stopping a long-running watcher
+        self.stop_requested = stop_event
+        self.stop_event = threading.Event()
+        # Shared with the control channel when supervised
+        self.resume_event = resume_event or threading.Event()
+        if resume_event is None:
+            self.resume_event.set()
+        # Changed files wait here, most useful first (see priorities.py); the scan runs ahead to fill it
+        self.priority = self.load_priority()
+        self.extract_q = PriorityTaskQueue(self.priority, PRIORITY_BACKLOG)
+        self.chunk_q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        self.embed_q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        self.write_q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        self.stats = {
+            "scan": StageStats(),
+            "extract": StageStats(self.extract_q),
+            "chunk": StageStats(self.chunk_q),
+            "embed": StageStats(self.embed_q),
+            "write": StageStats(self.write_q),
+        }
+
+        self.extract_ready = threading.Event()
+        self.unseen_paths: set = set()
+        self.failed: Optional[str] = None
+        self.scanned_count = 0
+        self.processed_count = 0
+        self.current_status = "Scanning files..."
+
+    # -- queue helpers (never block forever once a stop was requested) --
+    def _put(self, q: queue.Queue, item) -> bool:
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue):
+        while not self.resume_event.is_set() and not self.stop_event.is_set():
+            self.resume_event.wait(timeout=0.5)
+        while not self.stop_event.is_set():
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def load_priority(self) -> TaskPriority:
+        db_conn = sqlite3.connect(DB_PATH, timeout=60)
+        try:
+            priority = TaskPriority.load(db_conn, str(self.source_dir))
+        except sqlite3.Error as e:
+            logger.warning(f"Indexing order falls back to newest first: {e}")
+            priority = TaskPriority(str(self.source_dir), [], {})
+        finally:
+            db_conn.close()
+        if priority.pinned or priority.hot_dirs:
+            add_log(f"Indexing order: {len(priority.pinned)} pinned directories, "
+                    f"{len(priority.hot_dirs)} recently searched directories, then newest first")
+        return priority
+
+    # -- stages --
+    def load_state_snapshot(self) -> Dict[str, tuple]:
+        """path -> (modified_time, content_hash) for every indexed file under the scanned paths"""
+        targets = self.paths if self.paths is not None else [str(self.source_dir)]
+        rows = []
+        db_conn = sqlite3.connect(DB_PATH, timeout=60)
+        try:
+            for target in targets:
+                prefix = target.rstrip(os.sep) + os.sep
+                rows += db_conn.execute(
+                    "SELECT path, modified_time, content_hash FROM file_index_state WHERE path = ? OR (path >= ? AND path < ?)",
+                    (target, prefix, prefix + "\U0010ffff")).fetchall()
+        finally:
+            db_conn.close()
+        return {path: (mtime, content_hash) for path, mtime, content_hash in rows}
+
+    def walk_targets(self, db_conn):
+        """DirScans for the pass: the tree under the root (skipping unchanged directories) or the given paths"""
+        if self.paths is not None:
+            return scan_paths(self.paths, self.stop_event, extensions=INDEXED_EXTENSIONS)
+        root = str(self.source_dir)
+        self.full_verify = self.full_verify or full_verify_due(db_conn, root)
+        known = {} if self.full_verify else load_dir_tree(db_conn, root)
+        self.scan_mode = "full_verify" if self.full_verify or not known else "incremental"
+        add_log("Full verification scan (every directory listed)" if self.scan_mode == "full_verify"
+                else f"Incremental scan ({len(known)} known directories)")
+        resumed = load_checkpoint(db_conn, root)
+        if resumed:
+            add_log(f"Resuming interrupted pass: {len(resumed)} directories were already indexed")
+            known.update(resumed)
+            self.resumed_paths = set(resumed)
+        return scan_directories(root, known, self.full_verify, self.stop_event, extensions=INDEXED_EXTENSIONS)
+
+    def scan_stage(self):
+        db_conn = sqlite3.connect(DB_PATH, timeout=60)
+        stats = self.stats["scan"]
+        # One query up front instead of a SELECT + UPDATE round trip per file
+        snapshot = self.load_state_snapshot()
+        # Whatever is left in here after the scan has been deleted from disk
+        self.unseen_paths = set(snapshot)
+        # Indexed files per directory, for directories skipped as unchanged
+        indexed_by_dir: Dict[str, List[str]] = {}
+        if self.paths is None:
+            for path in snapshot:
+                indexed_by_dir.setdefault(os.path.dirname(path), []).append(path)
+        touches: List[tuple] = []
+
+        def flush_touches():
+            if touches:
+                db_conn.executemany("UPDATE file_index_state SET last_seen = ? WHERE path = ?", touches)
+                db_conn.commit()
+                touches.clear()
+
+        try:
+            for scan in self.walk_targets(db_conn):
+                if self.stop_event.is_set():
+                    logger.info("Stop flag detected. Halting scan.")
+                    break
+                if self.paths is None:
+                    self.dir_scans.append(scan)
+                if not scan.listed:
+                    # Unchanged directory: no listing, no per-file stat. Its files count as seen.
+                    t0 = time.perf_counter()
+                    indexed = indexed_by_dir.get(scan.path, ())
+                    self.unseen_paths.difference_update(indexed)
+                    self.scanned_count += scan.entry_count - len(scan.subdirs)
+                    self.dirs_skipped += 1
+                    if scan.path in self.resumed_paths:
+                        self.resumed_dirs += 1
+                        self.resumed_files += scan.entry_count - len(scan.subdirs)
+                    stats.record(time.perf_counter() - t0, len(indexed))
+                    continue
+                self.dirs_listed += 1
+                if self.checkpoint:
+                    self.checkpoint.opened(scan)
+                files, scan.files = scan.files, []  # Don't keep DirEntries alive in dir_scans
+                for entry in files:
+                    if self.stop_event.is_set(): break
+                    t0 = time.perf_counter()
+                    self.scanned_count += 1
+                    file = entry.name
+                    try:
+                        if not file.endswith(INDEXED_EXTENSIONS):
+                            continue
+
+                        file_key = entry.path
+                        self.unseen_paths.discard(file_key)
+                        try:
+                            stat = entry.stat()
+                            mod_time = stat.st_mtime
+
+                            if stat.st_size > 1024 * 1024 * 1024: # 1GB limit
+                                continue
+
+                            known = snapshot.get(file_key)
+                            if known and known[0] == mod_time:
+                                touches.append((self.scan_start_time, file_key))
+                                if len(touches) >= STATE_FLUSH_ROWS:
+                                    flush_touches()
+                                continue
+                        except Exception as e:
+                            add_log(f"Error processing {file}: {e}")
+                            self.dirty_dirs.add(scan.path)
+                            continue
+
+                        task = {"path": file_key, "name": file, "dir": scan.path, "mod_time": mod_time,
+                                "size": stat.st_size, "known_hash": known[1] if known else None}
+                        if self.checkpoint:
+                            self.checkpoint.queued(scan.path)
+                        if not self._put(self.extract_q, task):
+                            break
+                    finally:
+                        stats.record(time.perf_counter() - t0)
+                else:
+                    # Listed to the end (not cut short by a stop)
+                    if self.checkpoint:
+                        self.checkpoint.closed(scan.path)
+            flush_touches()
+        finally:
+            db_conn.close()
+            self._put(self.extract_q, _DONE)
+
+    def save_scan_state(self):
+        """After a completed full-root pass: persist the directory tree (and the verify time)"""
+        if self.paths is not None:
+            return
+        root = str(self.source_dir)
+        db_conn = sqlite3.connect(DB_PATH, timeout=60)
+        try:
+            # The pass is complete, so the next one starts fresh (committed with the tree)
+            clear_checkpoint(db_conn, root)
+            save_dir_tree(db_conn, root, self.dir_scans, self.dirty_dirs, self.scan_start_time)
+            if self.scan_mode == "full_verify":
+                mark_full_verify(db_conn, root, self.scan_start_time)
+        finally:
+            db_conn.close()
+
+    def extract_stage(self):
+        stats = self.stats["extract"]
+        in_flight = {}
+
+        def forward(done):
+            for fut in done:
+                task, t0 = in_flight.pop(fut)
+                try:
+                    task.update(fut.result())
+                except Exception as e:
+                    add_log(f"Error processing {task['name']}: {e}")
+                    task.update({"content_hash": None, "chunks": None, "unchanged": False})
+                stats.record(time.perf_counter() - t0)
+                if not self._put(self.chunk_q, task):
+                    return False
+            return True
+
+        try:
+            pool = get_extract_pool()
+        finally:
+            self.extract_ready.set()
+
+        while True:
+            task = self._get(self.extract_q)
+            if task is _DONE:
+                break
+            in_flight[pool.submit(extract_document, task["path"], task["size"], task["known_hash"])] = (task, time.perf_counter())
+            if len(in_flight) >= EXTRACT_WORKERS * 2:
+                done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                if not forward(done):
+                    break
+        if self.stop_event.is_set():
+            for fut in in_flight:
+                fut.cancel()
+        else:
+            forward(list(in_flight))
+        self._put(self.chunk_q, _DONE)
+
+    def chunk_stage(self):
+        db_conn = sqlite3.connect(DB_PATH, timeout=60)
+        db_cursor = db_conn.cursor()
+        stats = self.stats["chunk"]
+        try:
+            while True:
+                task = self._get(self.chunk_q)
+                if task is _DONE:
+                    break
+                t0 = time.perf_counter()
+                if task["unchanged"]:
+                    # Same bytes as last time, only the mtime moved. Nothing to chunk or embed.
+                    stats.record(time.perf_counter() - t0)
+                    if not self._put(self.embed_q, task):
+                        break
+                    continue
+                # Chunked while being read in the extract workers (bounded by the per-file chunk budget)
+                chunks = task["chunks"]
+                if chunks is None:
+                    # Unreadable for now; no state update so the next scan retries it
+                    self.dirty_dirs.add(os.path.dirname(task["path"]))
+                    if self.checkpoint:
+                        self.checkpoint.committed([task["dir"]])
+                    stats.record(time.perf_counter() - t0)
+                    continue
+                original = self.original_of(db_cursor, task) if chunks else None
+                if original:
+                    # Same bytes as a file already indexed: share its chunks instead of storing them again
+                    task["duplicate_of"] = original
+                    task["duplicate_preview"] = chunks[0]
+                    self.plan_chunks(db_cursor, task, [])
+                else:
+                    self.plan_chunks(db_cursor, task, chunks)
+                    if chunks:
+                        self.originals.setdefault(task["content_hash"], task["path"])
+                stats.record(time.perf_counter() - t0)
+                if not self._put(self.embed_q, task):
+                    break
+        finally:
+            db_conn.close()
+            self._put(self.embed_q, _DONE)
+
+    def original_of(self, db_cursor, task: Dict[str, Any]) -> Optional[str]:
+        content_hash = task["content_hash"]
+        if not content_hash:
+            return None
+        # Files planned earlier in this pass aren't committed yet, so look here first
+        original = self.originals.get(content_hash) or find_original(db_cursor, str(self.source_dir), content_hash, task["path"])
+        return original if original != task["path"] else None
+
+    def plan_chunks(self, db_cursor, task: Dict[str, Any], chunks: List[str]):
+        """
+        Diff the new chunks against what is stored for this path.
+        Chunk IDs are content-addressed ({path hash}_{chunk hash}), so a chunk whose text
+        didn't change keeps its ID and embedding even if it moved; only new texts get embedded.
+        """
+        file_hash = hashlib.md5(task["path"].encode()).hexdigest()
+        ids, hashes, seen = [], [], {}
+        for chunk in chunks:
+            h = text_hash(chunk)
+            n = seen.get(h, 0)
+            seen[h] = n + 1
+            ids.append(f"{file_hash}_{h[:16]}" + (f"_{n}" if n else ""))
+            hashes.append(h)
+
+        db_cursor.execute("SELECT chunk_id FROM chunk_index_state WHERE path = ?", (task["path"],))
+        old_ids = {row[0] for row in db_cursor.fetchall()}
+        new_ids = set(ids)
+
+        task["chunks"] = chunks
+        task["chunk_ids"] = ids
+        task["chunk_hashes"] = hashes
+        # No chunk rows yet: either new, or indexed before chunk hashes existed (positional IDs)
+        task["replace_all"] = not old_ids
+        task["stale_ids"] = list(old_ids - new_ids)
+        task["embed_indexes"] = [j for j, cid in enumerate(ids) if cid not in old_ids]
+        task["kept_indexes"] = [j for j, cid in enumerate(ids) if cid in old_ids]
+
+    def embed_stage(self):
+        stats = self.stats["embed"]
+        while True:
+            task = self._get(self.embed_q)
+            if task is _DONE:
+                break
+            t0 = time.perf_counter()
+            # Summaries are generated after the pass (see summaries.py): None keeps the stored
+            # summary until then, empty files get ""
+            # The first chunk is the start of the document
+            first = task["chunks"][0] if task.get("chunks") else task.get("duplicate_preview")
+            task["summary"] = None if first else ""
+            task["summary_preview"] = first[:SUMMARY_PREVIEW_CHARS] if first else None
+            task["embeddings"] = []
+            if task.get("embed_indexes"):
+                file = task["name"]
+                add_log(f"Processing: {file}")
+                self.current_status = f"Processing: {file}"
+
+                # nomic-embed likes search_document: prefix for documents.
+                # Embed all changed chunks of the file in one batched call.
+                logger.info(f"{file}: embedding {len(task['embed_indexes'])} of {len(task['chunks'])} chunks")
+                # Texts embedded before (any path, any run) come from the persistent cache.
+                task["embeddings"] = embed_documents(self.embedding_function, [task["chunks"][j] for j in task["embed_indexes"]], prefix="search_document: ")
+            stats.record(time.perf_counter() - t0)
+            if not self._put(self.write_q, task):
+                break
+        self._put(self.write_q, _DONE)
+
+    def write_stage(self):
+        db_conn = sqlite3.connect(DB_PATH, timeout=60)
+        stats = self.stats["write"]
+        # Chroma writes of all files are coalesced and written in the background (see write_batcher.py)
+        writer = self.writer = ChromaWriteBatcher()
+        # State rows are buffered and written in one transaction every STATE_FLUSH_FILES files
+        mtime_updates, state_upserts, chunk_state_paths, chunk_state_rows = [], [], [], []
+        summary_queue_rows, summary_dequeue_paths = [], []
+        # BM25 rows (chunk_id, path, collection, text) replacing everything indexed for keyword_paths
+        keyword_paths, keyword_rows = [], []
+        keywords = get_keyword_index()
+        pending_dirs: List[str] = []  # Directory of every buffered file, for the checkpoint
+        pending_files = 0
+        last_flush = time.monotonic()
+
+        def flush_state():
+            nonlocal pending_files, last_flush
+            # Chroma first, so the state DB never claims chunks that aren't written yet
+            failed = writer.sync()
+            if keywords is not None:
+                failed_paths = set(failed)
+                keywords.replace(keyword_paths + list(failed_paths),
+                                 [row for row in keyword_rows if row[1] not in failed_paths])
+            db_conn.executemany("UPDATE file_index_state SET modified_time = ?, last_seen = ? WHERE path = ?", mtime_updates)
+            db_conn.executemany("""
+                INSERT INTO file_index_state (path, modified_time, last_seen, summary, content_hash, duplicate_of) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET
+                    modified_time = excluded.modified_time,
+                    last_seen = excluded.last_seen,
+                    summary = COALESCE(excluded.summary, file_index_state.summary),
+                    content_hash = excluded.content_hash,
+                    duplicate_of = excluded.duplicate_of
+            """, state_upserts)
+            db_conn.executemany("DELETE FROM chunk_index_state WHERE path = ?", chunk_state_paths)
+            db_conn.executemany("INSERT OR REPLACE INTO chunk_index_state (chunk_id, path, chunk_index, chunk_hash) VALUES (?, ?, ?, ?)", chunk_state_rows)
+            db_conn.executemany(QUEUE_SUMMARY_SQL, summary_queue_rows)
+            db_conn.executemany("DELETE FROM summary_queue WHERE path = ?", summary_dequeue_paths)
+            if failed:
+                # Chunks may be half written: forget them, so the next scan re-extracts and replaces the file
+                add_log(f"Chroma write failed for {len(failed)} file(s), they are retried next scan")
+                forget_files(db_conn, failed)
+                db_conn.executemany("DELETE FROM chunk_index_state WHERE path = ?", [(path,) for path in failed])
+                self.dirty_dirs.update(os.path.dirname(path) for path in failed)
+            if chunk_state_paths or failed:
+                bump_generation(db_conn, self.collection.layout.base)
+            db_conn.commit()
+            if self.checkpoint:
+                self.checkpoint.committed(pending_dirs)
+            mtime_updates.clear(); state_upserts.clear(); chunk_state_paths.clear(); chunk_state_rows.clear()
+            summary_queue_rows.clear(); summary_dequeue_paths.clear(); pending_dirs.clear()
+            keyword_paths.clear(); keyword_rows.clear()
+            pending_files = 0
+            last_flush = time.monotonic()
+
+        def write_task(task):
+            nonlocal pending_files
+            t0 = time.perf_counter()
+            file_key, file, mod_time = task["path"], task["name"], task["mod_time"]
+            try:
+                pending_files += 1
+                pending_dirs.append(task["dir"])
+                if task["unchanged"]:
+                    mtime_updates.append((mod_time, self.scan_start_time, file_key))
+                    add_log(f"Unchanged content: {file} (mtime only)")
+                    return
+
+                # State & Summary (the upsert keeps the old summary until the summary phase replaces it)
+                state_upserts.append((file_key, mod_time, self.scan_start_time, task["summary"], task["content_hash"],
+                                      task.get("duplicate_of")))
+                if task["summary_preview"]:
+                    summary_queue_rows.append((file_key, task["content_hash"], task["summary_preview"], time.time()))
+                else:
+                    summary_dequeue_paths.append((file_key,))
+
+                chunks, chunk_ids = task["chunks"], task["chunk_ids"]
+                mod_time_iso = datetime.fromtimestamp(mod_time).isoformat()
+
+                def metadata(j):
+                    return {"filename": file, "path": file_key, "modified_at": mod_time_iso, "chunk_index": j, "total_chunks": len(chunks)}
+
+                # All chunks of a file live in the collection of its shard
+                shard = self.collection.shard(file_key)
+                if task["replace_all"]:
+                    writer.delete_path(shard, file_key)
+                elif task["stale_ids"]:
+                    writer.delete_ids(shard, file_key, task["stale_ids"])
+
+                # Reused chunks: same text and embedding, only position/metadata may have moved
+                if task["kept_indexes"]:
+                    writer.update(shard, file_key, [chunk_ids[j] for j in task["kept_indexes"]],
+                                  [metadata(j) for j in task["kept_indexes"]])
+
+                if task["embed_indexes"]:
+                    writer.upsert(shard, file_key, [chunk_ids[j] for j in task["embed_indexes"]],
+                                  [chunks[j] for j in task["embed_indexes"]],
+                                  [metadata(j) for j in task["embed_indexes"]], task["embeddings"])
+
+                chunk_state_paths.append((file_key,))
+                chunk_state_rows.extend((chunk_ids[j], file_key, j, task["chunk_hashes"][j]) for j in range(len(chunks)))
+                keyword_paths.append(file_key)
+                keyword_rows.extend((chunk_ids[j], file_key, shard.name, chunks[j]) for j in range(len(chunks)))
+                if task.get("duplicate_of"):
+                    self.duplicates_count += 1
+                    add_log(f"Duplicate: {file} is identical to {task['duplicate_of']} (chunks shared, nothing embedded)")
+                    self.current_status = f"Duplicate: {file}"
+                    return
+                if not chunks:
+                    return
+
+                self.processed_count += 1
+                add_log(f"Indexed: {file} ({len(chunks)} chunks, {len(task['embed_indexes'])} re-embedded)")
+                self.current_status = f"Indexed: {file}"
+            except Exception as e:
+                add_log(f"Error processing {file}: {e}")
+                self.dirty_dirs.add(os.path.dirname(file_key))
+            finally:
+                # By count, and by time so a crash loses at most CHECKPOINT_INTERVAL of slow files
+                if pending_files >= STATE_FLUSH_FILES or (
+                        pending_files and time.monotonic() - last_flush >= CHECKPOINT_INTERVAL):
+                    flush_state()
+                stats.record(time.perf_counter() - t0)
+
+        try:
+            while True:
+                task = self._get(self.write_q)
+                if task is _DONE:
+                    break
+                write_task(task)
+
+            if self.stop_event.is_set():
+                # Files already embedded are finished and committed rather than redone next run
+                while True:
+                    try:
+                        task = self.write_q.get_nowait()
+                    except queue.Empty:
+                        break
+                    if task is not _DONE:
+                        write_task(task)
+            flush_state()
+            logger.info(f"Chroma writes: {writer.stats()}")
+        finally:
+            writer.close()
+            db_conn.close()
+
+    def pipeline_status(self) -> Dict[str, Any]:
+        status = {name: s.snapshot() for name, s in self.stats.items()}
+        status["scan"].update({"mode": self.scan_mode, "dirs_listed": self.dirs_listed, "dirs_skipped": self.dirs_skipped,
+                               "resumed_dirs": self.resumed_dirs, "resumed_files": self.resumed_files})
+        status["write"]["duplicates"] = self.duplicates_count
+        if self.writer is not None:
+            status["write"]["chroma"] = self.writer.stats()
+        cache = get_embedding_cache()
+        if cache:
+            status["embedding_cache"] = cache.stats()
+        return status
+
+    def _run_stage(self, fn):
+        try:
+            fn()
+        except Exception as e:
+            # A dead stage would leave its neighbours waiting forever; stop everything
+            logger.error(f"Pipeline stage {fn.__name__} failed: {e}")
+            self.failed = f"{fn.__name__}: {e}"
+            self.extract_ready.set()
+            self.stop_event.set()
+
+    def save_checkpoint(self):
+        if not self.checkpoint:
+            return
+        db_conn = sqlite3.connect(DB_PATH, timeout=60)
+        try:
+            self.checkpoint.save(db_conn, self.dirty_dirs)
+        except sqlite3.Error as e:
+            # Only costs rework after an interruption; the next save retries with what's done by then
+            logger.warning(f"Could not save indexing checkpoint: {e}")
+        finally:
+            db_conn.close()
+
+    def run(self) -> bool:
+        """Runs all stages to completion. Returns False if stopped via the stop flag."""
+        extract_thread = threading.Thread(target=self._run_stage, args=(self.extract_stage,), name="index-extract", daemon=True)
+        extract_thread.start()
+        # Let the process pool fork before the other stages (and the embedding model) start
+        self.extract_ready.wait()
+
+        threads = [extract_thread] + [
+            threading.Thread(target=self._run_stage, args=(fn,), name=f"index-{fn.__name__}", daemon=True)
+            for fn in (self.scan_stage, self.chunk_stage, self.embed_stage, self.write_stage)
+        ]
+        for t in threads[1:]:
+            t.start()
+
+        last_checkpoint = time.monotonic()
+        while any(t.is_alive() for t in threads):
+            threads[-1].join(timeout=STATUS_INTERVAL)
+            if time.monotonic() - last_checkpoint >= CHECKPOINT_INTERVAL:
+                self.save_checkpoint()
+                last_checkpoint = time.monotonic()
+            if self.stop_requested is not None and self.stop_requested.is_set():
+                self.stop_event.set()
+            # Unsupervised (CLI) runs are stopped through the DB flag instead of the control channel
+            if not control and not self.stop_event.is_set() and check_stop_flag():
+                logger.info("Stop flag detected. Halting pipeline.")
+                self.stop_event.set()
+            current_status = self.current_status if self.resume_event.is_set() else "Paused"
+            update_status(current_status, 0, True, self.processed_count, self.scanned_count, self.pipeline_status())
+
+        if self.stop_event.is_set():
+            # Everything the write stage committed before stopping is kept for the next pass
+            self.save_checkpoint()
+        if self.resumed_dirs:
+            add_log(f"Resumed: skipped {self.resumed_dirs} directories ({self.resumed_files} files) "
+                    f"indexed before the interruption")
+        if self.failed:
+            raise RuntimeError(f"Indexing pipeline failed in {self.failed}")
+        return not self.stop_event.is_set()
+
+
+def remove_deleted_paths(collection, deleted_paths: List[str]):
+    """Drop files that no longer exist from the collection and the state tables"""
+    logger.info("Cleaning up deleted files from index...")
+    db_conn = sqlite3.connect(DB_PATH, timeout=60)
+    try:
+        for i in range(0, len(deleted_paths), 100):
+            batch_paths = deleted_paths[i:i+100]
+            logger.info(f"Removing {len(batch_paths)} deleted files from index")
+            collection.delete_paths(batch_paths)
+        keywords = get_keyword_index()
+        if keywords is not None:
+            keywords.delete_paths(deleted_paths)
+        db_conn.executemany("DELETE FROM file_index_state WHERE path = ?", [(p,) for p in deleted_paths])
+        db_conn.executemany("DELETE FROM chunk_index_state WHERE path = ?", [(p,) for p in deleted_paths])
+        db_conn.executemany("DELETE FROM summary_queue WHERE path = ?", [(p,) for p in deleted_paths])
+        bump_generation(db_conn, collection.layout.base)
+        db_conn.commit()
+    finally:
+        db_conn.close()
+
+def run_summary_phase(stop_event: Optional[threading.Event]) -> bool:
+    """
+    Summarize the files queued by the embedding pass with the chat model loaded once,
+    instead of swapping it with the embedding model for every file.
+    Returns False if stopped (the rest stays queued for the next pass).
+    """
+    stop_event = stop_event or threading.Event()
+    db_conn = sqlite3.connect(DB_PATH, timeout=60)
+    chat_loaded = False
+
+    def load_model():
+        nonlocal chat_loaded
+        chat_loaded = True
+        return model_manager.get_chat_model()
+
+    def progress(done, total):
+        # Unsupervised (CLI) runs are stopped through the DB flag instead of the control channel
+        if not control and check_stop_flag():
+            logger.info("Stop flag detected. Halting summaries.")
+            stop_event.set()
+        update_status(f"Summarizing {done}/{total}", done / total * 100, True, done, total)
+
+    try:
+        pending = pending_summaries(db_conn)
+        if not pending:
+            return True
+        add_log(f"Summarizing {pending} changed document(s)...")
+        update_status("Summarizing...", 0, True, 0, pending)
+        resolved = summarize_pending(db_conn, load_model, summarize_text, stop_event, progress)
+        add_log(f"Summaries updated for {resolved} document(s)")
+    finally:
+        db_conn.close()
+        if chat_loaded:
+            # Free the chat model's memory; the next pass loads the embedding model anyway
+            model_manager.unload()
+    return not stop_event.is_set()
+
+def reindex_orphaned_copies(source_dir: Path, collection, embedding_function, orphans: List[str],
+                            pipeline: IndexingPipeline) -> bool:
+    """Index copies whose original changed or was deleted in its place (see duplicates.py)"""
+    add_log(f"Re-indexing {len(orphans)} copies whose original changed or was deleted")
+    follow_up = IndexingPipeline(source_dir, collection, embedding_function, time.time(),
+                                 stop_event=pipeline.stop_requested, resume_event=pipeline.resume_event,
+                                 paths=orphans)
+    completed = follow_up.run()
+    if completed and follow_up.unseen_paths:
+        remove_deleted_paths(collection, sorted(follow_up.unseen_paths))
+    pipeline.processed_count += follow_up.processed_count
+    pipeline.duplicates_count += follow_up.duplicates_count
+    return completed
+
+def run_index_pass(source_dir: Path, collection, embedding_function, paths: Optional[List[str]] = None,
+                   full_verify: bool = False):
+    """
+    One pipeline pass over the whole root, or only over `paths` (files or directories).
+    Indexed files under the scanned paths that no longer exist are removed afterwards,
+    then changed files are summarized. Returns (completed, pipeline).
+    """
+    pipeline = IndexingPipeline(source_dir, collection, embedding_function, time.time(),
+                                stop_event=control.stop_event if control else None,
+                                resume_event=control.resume_event if control else None,
+                                paths=paths, full_verify=full_verify)
+    completed = pipeline.run()
+
+    # Cleanup old files: indexed paths the scan didn't see any more
+    if completed and pipeline.unseen_paths:
+        remove_deleted_paths(collection, sorted(pipeline.unseen_paths))
+    if completed:
+        db_conn = sqlite3.connect(DB_PATH, timeout=60)
+        try:
+            orphans = reconcile_duplicates(db_conn, collection, str(source_dir))
+        finally:
+            db_conn.close()
+        # Listed again next scan unless the follow-up below gets through them
+        pipeline.dirty_dirs.update(os.path.dirname(path) for path in orphans)
+        # Only a completed pass may vouch for the directory mtimes it saw
+        pipeline.save_scan_state()
+        logger.info(f"Scan: {pipeline.dirs_listed} directories listed, {pipeline.dirs_skipped} unchanged ({pipeline.scan_mode})")
+        if orphans:
+            completed = reindex_orphaned_copies(source_dir, collection, embedding_function, orphans, pipeline)
+        if completed:
+            completed = run_summary_phase(pipeline.stop_requested)
+
+    db_conn = sqlite3.connect(DB_PATH)
+    db_conn.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', ('last_indexed_at', datetime.now().isoformat()))
+    db_conn.commit()
+    db_conn.close()
+    return completed, pipeline
+
+WATCHING_STATUS = "Watching for changes"
+
+def watch_loop(source_dir: Path, collection, embedding_function, full_verify: bool = False):
+    """
+    Watch mode: keep the root indexed by feeding only changed paths through the pipeline.
+    Changes are debounced into batches; an inotify queue overflow, a failed watcher or a
+    "rescan" command schedule a full pass over the root instead.
+    """
+    stop_event = control.stop_event if control else threading.Event()
+    root = str(source_dir)
+    batcher = ChangeBatcher()
+    verify_requested = threading.Event()
+    if full_verify:
+        verify_requested.set()
+
+    def rescan(full_verify: bool = False):
+        if full_verify:
+            verify_requested.set()
+        batcher.add(root)
+
+    # Watch before the catch-up pass, so nothing written while it runs is missed
+    watcher = create_watcher(source_dir, batcher.add, INDEXED_EXTENSIONS)
+    if control:
+        control.rescan_handler = rescan
+    # Catch up on whatever changed while nothing was watching
+    batcher.add(root)
+    add_log(f"Watching {source_dir} for changes ({type(watcher).__name__})")
+
+    try:
+        while not stop_event.is_set():
+            paths = batcher.next_batch(stop_event, timeout=STATUS_INTERVAL)
+            # Unsupervised (CLI) runs are stopped through the DB flag instead of the control channel
+            if not control and check_stop_flag():
+                logger.info("Stop flag detected. Stopping watcher.")
+                stop_event.set()
+            if not paths or stop_event.is_set():
+                continue
+
+            full = root in paths
+            add_log("Full scan..." if full else f"Changes detected in {len(paths)} path(s), indexing...")
+            update_status("Scanning files..." if full else "Indexing changes...", 0, True, 0, 0)
+            verify = full and verify_requested.is_set()
+            if verify:
+                verify_requested.clear()
+            try:
+                completed, pipeline = run_index_pass(source_dir, collection, embedding_function,
+                                                     paths=None if full else paths, full_verify=verify)
+            except RuntimeError as e:
+                # Keep watching; the affected files are retried on their next change or rescan
+                add_log(f"Indexing pass failed: {e}")
+                update_status(f"{WATCHING_STATUS} (last pass failed)", 0, False, 0, 0)
+                continue
+            if not completed:
+                break
+            update_status(WATCHING_STATUS, 100, False, pipeline.processed_count, pipeline.scanned_count, pipeline.pipeline_status())
+    finally:
+        watcher.stop()
+    logger.info("Watcher stopped.")
+    update_status("Stopped", 0, False, 0, 0)
+
+
+def apply_shard_layout(client, layout: ShardLayout):
+    """
+    After INDEX_SHARDING or VECTOR_STORE changed, chunks would sit in collections the new
+    layout never reads: drop the root's collections and state so the pass re-indexes
+    everything (mostly from the embedding cache).
+    """
+    key = LAYOUT_KEY.format(base=layout.base)
+    store_key = STORE_KEY.format(base=layout.base)
+    db_conn = sqlite3.connect(DB_PATH, timeout=60)
+    try:
+        row = db_conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        store_row = db_conn.execute("SELECT value FROM settings WHERE key = ?", (store_key,)).fetchone()
+        existing = list_shards(client, layout.base)
+        # Indexes built before sharding existed are one unsharded collection
+        previous = row[0] if row else ("none" if existing else layout.spec)
+        # ... and before the store was selectable, in Chroma
+        previous_store = store_row[0] if store_row else ("chroma" if row or existing else VECTOR_STORE)
+        if previous_store != VECTOR_STORE:
+            add_log(f"Vector store changed ({previous_store} -> {VECTOR_STORE}), re-indexing {layout.root}")
+        elif previous != layout.spec:
+            add_log(f"Index sharding changed ({previous} -> {layout.spec}), re-indexing {layout.root}")
+        if previous != layout.spec or previous_store != VECTOR_STORE:
+            for shard in existing:
+                client.delete_collection(shard.name)
+            keywords = get_keyword_index()
+            if keywords is not None:
+                keywords.delete_under(layout.root)
+            prefix = layout.root + os.sep
+            for table in ("file_index_state", "chunk_index_state", "dir_index_state", "scan_checkpoint", "summary_queue"):
+                db_conn.execute(f"DELETE FROM {table} WHERE path = ? OR (path >= ? AND path < ?)",
+                                (layout.root, prefix, prefix + "\U0010ffff"))
+            bump_generation(db_conn, layout.base)
+        db_conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, layout.spec))
+        db_conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (store_key, VECTOR_STORE))
+        db_conn.commit()
+    finally:
+        db_conn.close()
+
+
+EXIT_ALREADY_RUNNING = 3  # Must match index_supervisor.EXIT_ALREADY_RUNNING
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Oonanji Vault document indexer")
+    parser.add_argument("storage_mode", nargs="?", default="nas", choices=["nas", "internal"])
+    parser.add_argument("--control-fd", type=int, default=None, help="socketpair fd passed by the backend supervisor")
+    parser.add_argument("--watch", action="store_true", help="keep running and index changed paths as they happen")
+    parser.add_argument("--full-verify", action="store_true", help="list and stat every directory, ignoring the stored directory tree")
+    return parser.parse_args()
+
+def main() -> int:
+    global log_buffer, control
+    args = parse_args()
+    get_extract_pool(MODELS_DIR / EMBED_MODEL_NAME, () if args.control_fd is None else (args.control_fd,))
+    if args.control_fd is not None:
+        control = ControlChannel(args.control_fd)
+        control.listen()
+
     logger.info("Starting indexing process...")
-    global log_buffer
     log_buffer = []
+
+    # Handle storage mode from command line
+    storage_mode = args.storage_mode
+    if storage_mode == "internal":
+        source_dir = INTERNAL_NAS_DIR
+    else:
+        source_dir = MNT_DIR
+
+    root_lock = acquire_root_lock(source_dir)
+    if root_lock is None:
+        logger.error(f"Another indexer is already running for {source_dir}")
+        add_log(f"Another indexer is already running for {source_dir}. Exiting.")
+        shutdown_extract_pool()
+        return EXIT_ALREADY_RUNNING
     
     # Initialize status
     add_log("Starting indexing process...")
@@ -321,16 +1265,6 @@ def main():
         logger.error(f"Failed to reset stop flag: {e}")
 
     try:
-        # Handle storage mode from command line
-        storage_mode = "nas"
-        if len(sys.argv) > 1:
-            storage_mode = sys.argv[1]
-            
-        if storage_mode == "internal":
-            source_dir = INTERNAL_NAS_DIR
-        else:
-            source_dir = MNT_DIR
-        
         add_log(f"Starting indexing in '{storage_mode}' mode...")
         add_log(f"Scanning directory: {source_dir}")
         if not any(source_dir.iterdir()):
@@ -339,221 +1273,115 @@ def main():
         if not source_dir.exists():
             logger.error(f"Source directory not found: {source_dir}")
             update_status(f"Error: Directory not found", 0, False, 0, 0)
-            return
+            return 0
 
         # Initialize ChromaDB
-        logger.info("Initializing ChromaDB...")
-        client = chromadb.PersistentClient(path=str(CHROMA_DB_DIR))
+        logger.info(f"Initializing vector store ({VECTOR_STORE})...")
+        client = open_vector_store(CHROMA_DB_DIR)
         
         # Embedding Model
-        embed_model_path = MODELS_DIR / "nomic-embed-text-v1.5.f16.gguf"
+        embed_model_path = MODELS_DIR / EMBED_MODEL_NAME
         if not embed_model_path.exists():
             logger.error(f"Embedding model not found: {embed_model_path}")
             update_status("Error: Embedding model missing", 0, False, 0, 0)
-            return
+            return 0
             
         embedding_function = GGUFEmbeddingFunction(model_path=embed_model_path)
         
-        # Separate collections for NAS and Internal storage
-        collection_name = f"documents_{storage_mode}"
-        logger.info(f"Using ChromaDB collection: {collection_name}")
-        
-        collection = client.get_or_create_collection(
-            name=collection_name,
-            embedding_function=embedding_function
-        )
-        logger.info("ChromaDB collection loaded.")
-
         # DB for file state (Updated Schema)
         db_conn = sqlite3.connect(DB_PATH)
         db_cursor = db_conn.cursor()
         
-        # Check if table exists and has 'summary' column
+        # Check if table exists and has 'summary' / 'content_hash' / 'duplicate_of' columns
         db_cursor.execute("PRAGMA table_info(file_index_state)")
         columns = [info[1] for info in db_cursor.fetchall()]
         
-        if 'file_index_state' not in columns and not columns: # Table doesn't exist
+        if not columns: # Table doesn't exist
             db_cursor.execute('''
                 CREATE TABLE IF NOT EXISTS file_index_state (
                     path TEXT PRIMARY KEY,
                     modified_time REAL,
                     last_seen REAL,
-                    summary TEXT
+                    summary TEXT,
+                    content_hash TEXT,
+                    duplicate_of TEXT
                 )
             ''')
-        elif 'summary' not in columns: # Table exists but needs upgrade
-            try:
-                db_cursor.execute("ALTER TABLE file_index_state ADD COLUMN summary TEXT")
-            except Exception as e:
-                logger.warning(f"Could not add summary column (might exist): {e}")
-        
-        db_conn.commit()
-
-        # Scan
-        logger.info("Starting scan...")
-        update_status("Scanning files...", 0, True, 0, 0)
-        
-        scan_start_time = time.time()
-        batch_size = 10
-        current_batch_ids, current_batch_docs, current_batch_metadatas, current_batch_embeddings = [], [], [], []
-        scanned_count, processed_count = 0, 0
-        
-        # Count total files first for progress (optional, but good for UX)
-        # For now, we'll just increment scanned_count
-        
-        for root, _, files in os.walk(source_dir):
-            if check_stop_flag():
-                logger.info("Stop flag detected. Halting scan.")
-                break
-                
-            for file in files:
-                if check_stop_flag(): break
-                
-                scanned_count += 1
-                file_path = Path(root) / file
-                file_key = str(file_path)
-                
-                if scanned_count % 5 == 0:
-                    update_status(f"Scanning: {file}", 0, True, processed_count, scanned_count)
-
-                if not file.endswith(('.txt', '.md', '.json', '.py', '.js', '.ts', '.html', '.css', '.csv', '.docx', '.xlsx')):
+        else: # Table exists but may need upgrade
+            for column in ("summary", "content_hash", "duplicate_of"):
+                if column in columns:
                     continue
-                
-                # logger.info(f"[{scanned_count}] Checking: {file_key}")
-                    
                 try:
-                    stat = file_path.stat()
-                    mod_time = stat.st_mtime
-
-                    if stat.st_size > 1024 * 1024 * 1024: # 1GB limit
-                        continue
-
-                    db_cursor.execute("SELECT modified_time FROM file_index_state WHERE path = ?", (file_key,))
-                    result = db_cursor.fetchone()
-                    
-                    if result and result[0] == mod_time:
-                        db_cursor.execute("UPDATE file_index_state SET last_seen = ? WHERE path = ?", (scan_start_time, file_key))
-                        continue
-                        
-                    add_log(f"Processing: {file}")
-                    update_status(f"Processing: {file}", 0, True, processed_count, scanned_count)
-                    
-                    content = ""
-                    if file_path.suffix == '.docx':
-                        content = read_docx_file(file_path)
-                    elif file_path.suffix == '.xlsx':
-                        content = read_excel_file(file_path)
-                    else:
-                        if stat.st_size > 10 * 1024 * 1024:
-                            logger.info(f"    - Skipping text read >10MB for: {file}")
-                            continue
-                        try:
-                            content = file_path.read_text(encoding='utf-8', errors='ignore')
-                        except Exception as read_err:
-                            logger.warning(f"    - Read error: {read_err}")
-                            continue
-
-                    if not content or not content.strip():
-                        db_cursor.execute("INSERT OR REPLACE INTO file_index_state (path, modified_time, last_seen, summary) VALUES (?, ?, ?, ?)",
-                                          (file_key, mod_time, scan_start_time, ""))
-                        continue
+                    db_cursor.execute(f"ALTER TABLE file_index_state ADD COLUMN {column} TEXT")
+                except Exception as e:
+                    logger.warning(f"Could not add {column} column (might exist): {e}")
 
-                    # --- 4-Layer Architecture: Generate Summary Layer ---
-                    summary = ""
-                    try:
-                        # logger.info(f"    - Generating summary...")
-                        summary = generate_summary(content)
-                        # logger.info(f"    - Summary generated.")
-                    except Exception as sum_err:
-                        add_log(f"Warning: Summary failed for {file}: {sum_err}")
-                    
-                    # Store State & Summary immediately
-                    db_cursor.execute("INSERT OR REPLACE INTO file_index_state (path, modified_time, last_seen, summary) VALUES (?, ?, ?, ?)",
-                                      (file_key, mod_time, scan_start_time, summary))
-                    db_conn.commit()
+        # Per-chunk text hashes, so edits only re-embed the chunks that changed
+        db_cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chunk_index_state (
+                chunk_id TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                chunk_hash TEXT NOT NULL
+            )
+        ''')
+        db_cursor.execute("CREATE INDEX IF NOT EXISTS idx_chunk_index_state_path ON chunk_index_state (path)")
+        # Identical files share one copy's chunks
+        create_duplicate_indexes(db_cursor)
+        # Directory mtimes/listings of the last completed scan (unchanged subtrees are skipped)
+        db_cursor.execute(DIR_STATE_SCHEMA)
+        # Directories an interrupted pass got through (the next pass resumes after them)
+        db_cursor.execute(CHECKPOINT_SCHEMA)
+        # Pinned/recently searched directories are indexed first
+        db_cursor.execute(RAG_HITS_SCHEMA)
+        # Deferred summaries and the content-hash summary cache
+        create_summary_tables(db_cursor)
+        
+        db_conn.commit()
+        db_conn.close()
 
-                    chunks = recursive_character_text_splitter(content, chunk_size=1000, chunk_overlap=200)
-                    file_hash = hashlib.md5(file_key.encode()).hexdigest()
-                    mod_time_iso = datetime.fromtimestamp(mod_time).isoformat()
-
-                    collection.delete(where={"path": file_key})
-
-                    for j, chunk in enumerate(chunks):
-                        raw_chunk = chunk
-                        # nomic-embed likes search_document: prefix for documents
-                        prefixed_chunk = f"search_document: {raw_chunk}"
-                        chunk_id = f"{file_hash}_{j}"
-                        
-                        current_batch_ids.append(chunk_id)
-                        current_batch_docs.append(raw_chunk)
-                        current_batch_metadatas.append({"filename": file_path.name, "path": file_key, "modified_at": mod_time_iso, "chunk_index": j, "total_chunks": len(chunks)})
-                        
-                        # Calculate embedding with prefix
-                        embeds = embedding_function([prefixed_chunk])
-                        current_batch_embeddings.append(embeds[0])
-                        
-                        if len(current_batch_ids) >= batch_size:
-                            try:
-                                collection.add(
-                                    ids=current_batch_ids, 
-                                    documents=current_batch_docs, 
-                                    metadatas=current_batch_metadatas,
-                                    embeddings=current_batch_embeddings
-                                )
-                            except Exception as add_err:
-                                add_log(f"Error adding batch to Chroma: {add_err}")
-                            current_batch_ids, current_batch_docs, current_batch_metadatas, current_batch_embeddings = [], [], [], []
-
-                    # Update state (redundant but safe)
-                    db_cursor.execute("UPDATE file_index_state SET last_seen = ? WHERE path = ?",
-                                      (scan_start_time, file_key))
+        # Separate collections for NAS and Internal storage, optionally split into shards
+        layout = ShardLayout(f"documents_{storage_mode}", str(source_dir))
+        logger.info(f"Using ChromaDB collection: {layout.base} (sharding: {layout.spec})")
+        apply_shard_layout(client, layout)
+        collection = ShardedCollection(client, layout, embedding_function)
+        keywords = get_keyword_index()
+        if keywords is not None:
+            # Chunks indexed before the keyword index existed
+            backfilled = keywords.backfill(layout.base, list_shards(client, layout.base))
+            if backfilled:
+                add_log(f"Keyword index: added {backfilled} existing chunks")
+                db_conn = sqlite3.connect(DB_PATH, timeout=60)
+                try:
+                    bump_generation(db_conn, layout.base)
                     db_conn.commit()
-                    
-                    processed_count += 1
-                    add_log(f"Indexed: {file} ({len(chunks)} chunks)")
-                    update_status(f"Indexed: {file}", 0, True, processed_count, scanned_count)
+                finally:
+                    db_conn.close()
 
-                except Exception as e:
-                    add_log(f"Error processing {file}: {e}")
+        if args.watch:
+            watch_loop(source_dir, collection, embedding_function, full_verify=args.full_verify)
+            return 0
 
-        # Final Batch
-        if current_batch_ids and not check_stop_flag():
-            logger.info(f"Adding final batch of {len(current_batch_ids)} chunks...")
-            try:
-                collection.add(
-                    ids=current_batch_ids, 
-                    documents=current_batch_docs, 
-                    metadatas=current_batch_metadatas,
-                    embeddings=current_batch_embeddings
-                )
-                db_conn.commit()
-            except Exception as e:
-                logger.error(f"ERROR adding final batch: {e}")
-
-        # Cleanup old files
-        if not check_stop_flag():
-            logger.info("Cleaning up deleted files from index...")
-            db_cursor.execute("SELECT path FROM file_index_state WHERE last_seen < ?", (scan_start_time,))
-            deleted_files = db_cursor.fetchall()
-            for (path,) in deleted_files:
-                logger.info(f"Removing deleted file from index: {path}")
-                collection.delete(where={"path": path})
-                db_cursor.execute("DELETE FROM file_index_state WHERE path = ?", (path,))
-            db_conn.commit()
-
-        db_conn.close()
-        db_conn = sqlite3.connect(DB_PATH)
-        db_cursor = db_conn.cursor()
-        db_cursor.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', ('last_indexed_at', datetime.now().isoformat()))
-        db_conn.commit()
-        db_conn.close()
+        # Scan & index through the pipeline
+        logger.info("Starting scan...")
+        update_status("Scanning files...", 0, True, 0, 0)
+        completed, pipeline = run_index_pass(source_dir, collection, embedding_function, full_verify=args.full_verify)
+        processed_count, scanned_count = pipeline.processed_count, pipeline.scanned_count
         
-        logger.info("Indexing completed.")
-        update_status("Completed", 100, False, processed_count, scanned_count)
+        if completed:
+            logger.info("Indexing completed.")
+            update_status("Completed", 100, False, processed_count, scanned_count, pipeline.pipeline_status())
+        else:
+            logger.info("Indexing stopped.")
+            update_status("Stopped", 0, False, processed_count, scanned_count, pipeline.pipeline_status())
 
     except Exception as e:
         logger.error(f"Global Indexing Error: {e}")
         update_status(f"Failed: {str(e)}", 0, False, 0, 0)
+    finally:
+        shutdown_extract_pool()
+        root_lock.close()
+    return 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,240 @@
+import os
+import re
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger("indexer")
+
+KEYWORD_INDEX_PATH = Path(__file__).parent.absolute() / "keyword_index.db"
+# Chat RAG retrieval: "hybrid" (BM25 and vector search fused), "vector" or "keyword"
+RAG_RETRIEVAL = os.environ.get("RAG_RETRIEVAL", "hybrid").strip().lower()
+# Reciprocal-rank fusion constant (score = sum of 1 / (RRF_K + rank))
+RRF_K = 60
+# A message of at most this many code-like terms (or a quoted phrase) is a pure lookup
+KEYWORD_ONLY_MAX_TERMS = 3
+
+# Text is indexed as ASCII words plus overlapping character bigrams of CJK runs, so
+# Japanese (no spaces, 2-character names) is searchable with FTS5's plain tokenizer.
+_TEXT_RUN = re.compile(r"[A-Za-z0-9]+|[々〆〇ぁ-ゖァ-ヺー一-鿿ｦ-ﾟ]+")
+# Query terms: identifiers (AB-1234, report_2023.xlsx) stay one term; kanji and katakana
+# runs are terms; hiragana runs (particles, okurigana) only count when nothing else is left
+_QUERY_TERM = re.compile(r"[A-Za-z0-9]+(?:[-_./][A-Za-z0-9]+)*|[々〆〇一-鿿]+|[ァ-ヺーｦ-ﾟ]+|[ぁ-ゖ]+")
+_HIRAGANA = re.compile(r"^[ぁ-ゖ]+$")
+_CODE_TERM = re.compile(r"(?=[^ ]*[0-9])[A-Za-z0-9]+(?:[-_./][A-Za-z0-9]+)*|[A-Za-z0-9]+(?:[-_./][A-Za-z0-9]+)+")
+_QUOTES = {('"', '"'), ("'", "'"), ("「", "」"), ("『", "』"), ("“", "”")}
+
+
+def ngram_tokens(text: str) -> List[str]:
+    tokens = []
+    for run in _TEXT_RUN.findall(text):
+        if run.isascii():
+            tokens.append(run.lower())
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def query_terms(message: str) -> List[str]:
+    terms = _QUERY_TERM.findall(message)
+    content = [term for term in terms if not _HIRAGANA.match(term)]
+    return content or terms
+
+
+def match_expression(message: str) -> str:
+    """FTS5 query: any of the message's terms, each as a phrase of its tokens"""
+    phrases = []
+    for term in query_terms(message):
+        tokens = ngram_tokens(term)
+        # A lone kanji/kana is not in the bigram index
+        if len(tokens) == 1 and not tokens[0].isascii() and len(tokens[0]) == 1:
+            continue
+        phrase = '"' + " ".join(tokens).replace('"', '""') + '"'
+        if tokens and phrase not in phrases:
+            phrases.append(phrase)
+    return " OR ".join(phrases)
+
+
+def is_keyword_query(message: str) -> bool:
+    """A quoted phrase, or only a few code-like terms (product codes, file names): no need for embeddings"""
+    text = message.strip()
+    if len(text) > 2 and (text[0], text[-1]) in _QUOTES:
+        return True
+    terms = _QUERY_TERM.findall(text)
+    if not terms or len(terms) > KEYWORD_ONLY_MAX_TERMS or not all(_CODE_TERM.fullmatch(term) for term in terms):
+        return False
+    # Nothing else in the message but the terms and separators
+    return not _QUERY_TERM.sub("", text).strip(" \t\n,、/")
+
+
+class KeywordIndex:
+    """
+    BM25 full-text index of the chunk texts in the vector store (SQLite FTS5).
+    keyword_chunks maps an FTS row to its chunk id, file and collection; the indexer
+    replaces a file's rows whenever it rewrites the file's chunks.
+    """
+    def __init__(self, db_path: Path = KEYWORD_INDEX_PATH):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(db_path), timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute("PRAGMA synchronous=NORMAL;")
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS keyword_chunks (
+                rowid INTEGER PRIMARY KEY,
+                chunk_id TEXT NOT NULL UNIQUE,
+                path TEXT NOT NULL,
+                collection TEXT NOT NULL
+            )
+        ''')
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_keyword_chunks_path ON keyword_chunks (path)")
+        self.conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS keyword_fts USING fts5(tokens, tokenize = 'unicode61 remove_diacritics 0')")
+        # Base collection names whose existing chunks have been copied in (see backfill)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS keyword_backfill (name TEXT PRIMARY KEY)")
+        self.conn.commit()
+
+    def _delete(self, where: str, args: tuple):
+        self.conn.execute(f"DELETE FROM keyword_fts WHERE rowid IN (SELECT rowid FROM keyword_chunks WHERE {where})", args)
+        self.conn.execute(f"DELETE FROM keyword_chunks WHERE {where}", args)
+
+    def _add(self, rows: Iterable[Tuple[str, str, str, str]]) -> int:
+        added = 0
+        for chunk_id, path, collection, text in rows:
+            cursor = self.conn.execute("INSERT OR IGNORE INTO keyword_chunks (chunk_id, path, collection) VALUES (?, ?, ?)",
+                                       (chunk_id, path, collection))
+            if cursor.rowcount:
+                self.conn.execute("INSERT INTO keyword_fts (rowid, tokens) VALUES (?, ?)",
+                                  (cursor.lastrowid, " ".join(ngram_tokens(text or ""))))
+                added += 1
+        return added
+
+    def replace(self, paths: Iterable[str], rows: List[Tuple[str, str, str, str]]):
+        """Drop everything indexed for `paths`, then add (chunk_id, path, collection, text) rows"""
+        with self.lock:
+            for path in paths:
+                self._delete("path = ?", (path,))
+            self._add(rows)
+            self.conn.commit()
+
+    def delete_paths(self, paths: Iterable[str]):
+        self.replace(paths, [])
+
+    def delete_under(self, root: str):
+        prefix = root.rstrip(os.sep) + os.sep
+        with self.lock:
+            self._delete("path = ? OR (path >= ? AND path < ?)", (root, prefix, prefix + "\U0010ffff"))
+            self.conn.commit()
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM keyword_fts")
+            self.conn.execute("DELETE FROM keyword_chunks")
+            self.conn.execute("DELETE FROM keyword_backfill")
+            self.conn.commit()
+
+    def backfill(self, base: str, collections: List[Any], page: int = 1000) -> int:
+        """Copy in the chunks of an index built before this one existed (once per base collection name)"""
+        with self.lock:
+            if self.conn.execute("SELECT 1 FROM keyword_backfill WHERE name = ?", (base,)).fetchone():
+                return 0
+        added = 0
+        for collection in collections:
+            offset = 0
+            while True:
+                got = collection.get(limit=page, offset=offset, include=["documents", "metadatas"])
+                if not got["ids"]:
+                    break
+                with self.lock:
+                    added += self._add((chunk_id, (meta or {}).get("path", ""), collection.name, doc)
+                                       for chunk_id, doc, meta in zip(got["ids"], got["documents"], got["metadatas"]))
+                    self.conn.commit()
+                offset += len(got["ids"])
+        with self.lock:
+            self.conn.execute("INSERT OR IGNORE INTO keyword_backfill (name) VALUES (?)", (base,))
+            self.conn.commit()
+        return added
+
+    def search(self, expression: str, limit: int, collections: List[str]) -> List[Tuple[str, str, float]]:
+        """(chunk_id, collection, BM25 score, higher is better) of the best matches"""
+        if not expression or not collections:
+            return []
+        with self.lock:
+            rows = self.conn.execute(f"""
+                SELECT k.chunk_id, k.collection, bm25(keyword_fts) AS rank
+                FROM keyword_fts JOIN keyword_chunks AS k ON k.rowid = keyword_fts.rowid
+                WHERE keyword_fts MATCH ? AND k.collection IN ({','.join('?' * len(collections))})
+                ORDER BY rank LIMIT ?
+            """, [expression] + list(collections) + [limit]).fetchall()
+        return [(chunk_id, collection, -rank) for chunk_id, collection, rank in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {"chunks": self.conn.execute("SELECT COUNT(*) FROM keyword_chunks").fetchone()[0]}
+
+
+_keyword_index: Optional[KeywordIndex] = None
+_keyword_index_lock = threading.Lock()
+
+def get_keyword_index() -> Optional[KeywordIndex]:
+    global _keyword_index
+    with _keyword_index_lock:
+        if _keyword_index is None:
+            try:
+                _keyword_index = KeywordIndex()
+            except Exception as e:
+                logger.error(f"Keyword index unavailable: {e}")
+                return None
+        return _keyword_index
+
+
+def _empty_result() -> Dict[str, List[List[Any]]]:
+    return {"ids": [[]], "documents": [[]], "metadatas": [[]], "scores": [[]]}
+
+
+def keyword_search(collections: List[Any], message: str, n_results: int) -> Dict[str, List[List[Any]]]:
+    """BM25 search over the given collections, shaped like query_shards' results (with scores instead of distances)"""
+    index = get_keyword_index()
+    expression = match_expression(message)
+    if index is None or not expression:
+        return _empty_result()
+    try:
+        hits = index.search(expression, n_results, [c.name for c in collections])
+    except sqlite3.OperationalError as e:
+        logger.warning(f"Keyword search failed for {expression!r}: {e}")
+        return _empty_result()
+    by_name = {c.name: c for c in collections}
+    found: Dict[str, tuple] = {}
+    for name in {collection for _, collection, _ in hits}:
+        ids = [chunk_id for chunk_id, collection, _ in hits if collection == name]
+        got = by_name[name].get(ids=ids, include=["documents", "metadatas"])
+        found.update((chunk_id, (doc, meta)) for chunk_id, doc, meta in zip(got["ids"], got["documents"], got["metadatas"]))
+    result = _empty_result()
+    # Rows of chunks deleted since (or not written yet) are skipped
+    for chunk_id, _, score in hits:
+        if chunk_id in found:
+            result["ids"][0].append(chunk_id)
+            result["documents"][0].append(found[chunk_id][0])
+            result["metadatas"][0].append(found[chunk_id][1])
+            result["scores"][0].append(score)
+    return result
+
+
+def fuse_results(results: List[Dict[str, List[List[Any]]]], n_results: int, k: int = RRF_K) -> Dict[str, List[List[Any]]]:
+    """Reciprocal-rank fusion of several ranked result lists (query_shards / keyword_search shaped)"""
+    scores: Dict[str, float] = {}
+    chunks: Dict[str, tuple] = {}
+    for result in results:
+        for rank, chunk_id in enumerate(result["ids"][0]):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank + 1)
+            chunks.setdefault(chunk_id, (result["documents"][0][rank], result["metadatas"][0][rank]))
+    fused = _empty_result()
+    for chunk_id in sorted(scores, key=lambda c: -scores[c])[:n_results]:
+        fused["ids"][0].append(chunk_id)
+        fused["documents"][0].append(chunks[chunk_id][0])
+        fused["metadatas"][0].append(chunks[chunk_id][1])
+        fused["scores"][0].append(round(scores[chunk_id], 6))
+    return fused
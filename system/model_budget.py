@@ -0,0 +1,200 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger("oonanji-backend")
+
+# How the backend's ModelManager keeps models loaded:
+#   budget     chat models stay loaded (least recently used evicted first) and the
+#              embedding model stays resident beside them while all fit in the budgets
+#              below (the default)
+#   exclusive  every load evicts all other unpinned models (every RAG turn reloads the
+#              chat model)
+MODEL_RESIDENCY = os.environ.get("MODEL_RESIDENCY", "budget").strip().lower()
+# Fixed RAM budget for all resident models in MB; unset = what is available now minus
+# MODEL_MEMORY_HEADROOM_MB for everything else
+MODEL_MEMORY_BUDGET_MB = int(os.environ.get("MODEL_MEMORY_BUDGET_MB", "0"))
+MODEL_MEMORY_HEADROOM_MB = int(os.environ.get("MODEL_MEMORY_HEADROOM_MB", "1024"))
+# VRAM budget for GPU-offloaded chat models in MB; unset = one at a time
+MODEL_VRAM_BUDGET_MB = int(os.environ.get("MODEL_VRAM_BUDGET_MB", "0"))
+# At most this many chat models loaded (0 = only the budgets limit it)
+MODEL_CACHE_MAX_MODELS = int(os.environ.get("MODEL_CACHE_MAX_MODELS", "0"))
+# Model file names never evicted (discord_ models always are)
+MODEL_PINNED = [name.strip() for name in os.environ.get("MODEL_PINNED", "").split(",") if name.strip()]
+# Context, KV cache and compute buffers on top of the weights (n_ctx 2048, rough)
+MODEL_BUFFER_MB = 256
+# CPU threads reserved for the embedding model when both are resident; the chat model
+# gets the rest, so a query embedding during a generation doesn't fight it for cores
+MODEL_EMBED_THREADS = int(os.environ.get("MODEL_EMBED_THREADS", "0"))
+# Upper bounds (seconds) of the load time histogram buckets
+LOAD_TIME_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60)
+
+_MB = 1024 * 1024
+
+
+def model_footprint(model_path: str, device: str = "cpu") -> Tuple[int, int]:
+    """Approximate (RAM, VRAM) bytes of a loaded GGUF model: weights plus buffers"""
+    try:
+        weights = int(os.path.getsize(model_path) * 1.1)
+    except OSError:
+        weights = 0
+    if device == "gpu":
+        return MODEL_BUFFER_MB * _MB, weights
+    return weights + MODEL_BUFFER_MB * _MB, 0
+
+
+def ram_budget() -> int:
+    """Bytes all resident models may use together; 0 (nothing beside a new load) when exclusive"""
+    if MODEL_RESIDENCY != "budget":
+        return 0
+    if MODEL_MEMORY_BUDGET_MB:
+        return MODEL_MEMORY_BUDGET_MB * _MB
+    if psutil is None:
+        return 0
+    # Not plus the resident models: their weights are mmap'd, and the page cache holding
+    # them already counts as available
+    return max(0, psutil.virtual_memory().available - MODEL_MEMORY_HEADROOM_MB * _MB)
+
+
+def gpu_offload_supported() -> bool:
+    try:
+        import llama_cpp
+        return bool(llama_cpp.llama_supports_gpu_offload())
+    except Exception:
+        return False
+
+
+def thread_split() -> Tuple[Optional[int], Optional[int]]:
+    """(chat threads, embedding threads); (None, None) keeps llama.cpp's defaults"""
+    if MODEL_RESIDENCY != "budget":
+        return None, None
+    cores = (psutil.cpu_count(logical=False) if psutil else None) or max(1, (os.cpu_count() or 2) // 2)
+    if cores < 4 and not MODEL_EMBED_THREADS:
+        return None, None  # Too few cores to give one away; query embeddings are short anyway
+    embed = min(MODEL_EMBED_THREADS or cores // 4, cores - 1)
+    return cores - embed, embed
+
+
+class ModelCache:
+    """
+    Loaded models by path, least recently used first, with the (RAM, VRAM) footprint each
+    was accounted with. plan() picks the unpinned models to evict so a new one fits.
+    """
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.lock = threading.Lock()
+        self.models: "OrderedDict[str, Any]" = OrderedDict()
+        self.footprints: Dict[str, Tuple[int, int]] = {}
+        self.pinned = set(MODEL_PINNED)
+        self.hits = self.misses = 0
+        self.evictions: Dict[str, int] = {}
+        self.load_buckets = [0] * (len(LOAD_TIME_BUCKETS) + 1)
+        self.load_seconds = 0.0
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.models
+
+    def __len__(self) -> int:
+        return len(self.models)
+
+    def paths(self) -> List[str]:
+        return list(self.models)
+
+    def get(self, path: str):
+        with self.lock:
+            model = self.models.get(path)
+            if model is None:
+                self.misses += 1
+                return None
+            self.models.move_to_end(path)
+            self.hits += 1
+            return model
+
+    def is_pinned(self, path: str) -> bool:
+        name = os.path.basename(path)
+        return "discord_" in name or name in self.pinned
+
+    def pin(self, name: str, pinned: bool = True):
+        with self.lock:
+            (self.pinned.add if pinned else self.pinned.discard)(os.path.basename(name))
+
+    def ram_bytes(self) -> int:
+        return sum(ram for ram, _ in self.footprints.values())
+
+    def plan(self, footprint: Tuple[int, int], others: Optional["ModelCache"] = None,
+             max_models: int = 0) -> Tuple[List[str], bool]:
+        """
+        Models to evict (least recently used unpinned first) so one more of `footprint`
+        fits beside the rest and the models of `others`; and whether it fits then
+        """
+        ram, vram = footprint
+        other_ram = others.ram_bytes() if others is not None else 0
+        budget = ram_budget()
+        if budget and not MODEL_MEMORY_BUDGET_MB:
+            # Available memory holds the loaded models' mmap'd weights (page cache) but not
+            # their context buffers, which the footprints below count too
+            budget += (len(self.models) + (len(others) if others is not None else 0)) * MODEL_BUFFER_MB * _MB
+        resident = [(path, self.footprints[path]) for path in self.models]
+        evict: List[str] = []
+        while True:
+            kept = [fp for path, fp in resident if path not in evict]
+            too_many = bool(max_models) and len(kept) + 1 > max_models
+            ram_over = sum(fp[0] for fp in kept) + other_ram + ram > budget
+            if MODEL_VRAM_BUDGET_MB:
+                vram_over = bool(vram) and sum(fp[1] for fp in kept) + vram > MODEL_VRAM_BUDGET_MB * _MB
+            else:
+                vram_over = bool(vram) and any(fp[1] for fp in kept)
+            if not (too_many or ram_over or vram_over):
+                return evict, True
+            # Evicting only helps on the device that is over
+            candidates = [path for path, (r, v) in resident if path not in evict and not self.is_pinned(path)
+                          and (too_many or (ram_over and r) or (vram_over and v))]
+            if not candidates:
+                return evict, False
+            evict.append(candidates[0])
+
+    def add(self, path: str, model, footprint: Tuple[int, int], seconds: float):
+        with self.lock:
+            self.models[path] = model
+            self.models.move_to_end(path)
+            self.footprints[path] = footprint
+            self.load_seconds += seconds
+            self.load_buckets[next((i for i, bound in enumerate(LOAD_TIME_BUCKETS) if seconds <= bound),
+                                   len(LOAD_TIME_BUCKETS))] += 1
+
+    def evict(self, path: str, reason: str):
+        with self.lock:
+            model = self.models.pop(path, None)
+            self.footprints.pop(path, None)
+            self.evictions[reason] = self.evictions.get(reason, 0) + 1
+        if model is not None and hasattr(model, "close"):
+            try:
+                model.close()
+            except Exception as e:
+                logger.warning(f"Error closing model {path}: {e}")
+        logger.info(f"Unloaded {self.kind} model {os.path.basename(path)} ({reason})")
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "loaded": [{"model": os.path.basename(path), "ram_mb": round(self.footprints[path][0] / _MB),
+                            "vram_mb": round(self.footprints[path][1] / _MB), "pinned": self.is_pinned(path)}
+                           for path in reversed(self.models)],
+                "pinned": sorted(self.pinned),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": dict(self.evictions),
+                "loads": sum(self.load_buckets),
+                "load_seconds_total": round(self.load_seconds, 2),
+                "load_time_histogram": {**{f"<={bound}s": n for bound, n in zip(LOAD_TIME_BUCKETS, self.load_buckets)},
+                                        f">{LOAD_TIME_BUCKETS[-1]}s": self.load_buckets[-1]},
+            }
@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import heapq
+import queue
+import sqlite3
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+logger = logging.getLogger("indexer")
+
+# Files found by the scan and waiting for extraction. The scan runs up to this far ahead
+# of the pipeline, so the extract stage picks the most useful file out of a large
+# backlog instead of taking files in directory-walk order.
+PRIORITY_BACKLOG = int(os.environ.get("INDEX_PRIORITY_BACKLOG", "20000"))
+# A directory's RAG hit weight halves after this many days without hits
+HIT_HALF_LIFE_DAYS = float(os.environ.get("INDEX_HIT_HALF_LIFE_DAYS", "7"))
+# Share of a directory's hit weight lent to files one subdirectory level further down
+HIT_ANCESTOR_FACTOR = 0.5
+
+# settings key: JSON list of directories (relative to the storage root) indexed first
+PINNED_DIRS_KEY = "index_pinned_dirs"
+
+# Directories whose documents showed up in recent chat RAG results (decayed hit count)
+RAG_HITS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS rag_hits (
+        dir TEXT PRIMARY KEY,
+        weight REAL NOT NULL,
+        last_hit REAL NOT NULL
+    )
+'''
+
+
+def _decayed(weight: float, last_hit: float, now: float) -> float:
+    return weight * 0.5 ** (max(now - last_hit, 0.0) / (HIT_HALF_LIFE_DAYS * 86400))
+
+
+def record_rag_hits(db_conn: sqlite3.Connection, paths: Iterable[str]):
+    """Count one hit per result chunk against the directory of its file"""
+    counts: Dict[str, int] = {}
+    for path in paths:
+        directory = os.path.dirname(path)
+        counts[directory] = counts.get(directory, 0) + 1
+    if not counts:
+        return
+    now = time.time()
+    dirs = list(counts)
+    rows = db_conn.execute(f"SELECT dir, weight, last_hit FROM rag_hits WHERE dir IN ({','.join('?' * len(dirs))})",
+                           dirs).fetchall()
+    weights = {directory: _decayed(weight, last_hit, now) for directory, weight, last_hit in rows}
+    db_conn.executemany("INSERT OR REPLACE INTO rag_hits (dir, weight, last_hit) VALUES (?, ?, ?)",
+                        [(directory, weights.get(directory, 0.0) + n, now) for directory, n in counts.items()])
+    db_conn.commit()
+
+
+def load_hot_dirs(db_conn: sqlite3.Connection, root: str, min_weight: float = 0.05) -> Dict[str, float]:
+    now = time.time()
+    prefix = root.rstrip(os.sep) + os.sep
+    rows = db_conn.execute("SELECT dir, weight, last_hit FROM rag_hits WHERE dir = ? OR (dir >= ? AND dir < ?)",
+                           (root, prefix, prefix + "\U0010ffff")).fetchall()
+    hot = {directory: _decayed(weight, last_hit, now) for directory, weight, last_hit in rows}
+    return {directory: weight for directory, weight in hot.items() if weight >= min_weight}
+
+
+def get_pinned_dirs(db_conn: sqlite3.Connection) -> List[str]:
+    row = db_conn.execute("SELECT value FROM settings WHERE key = ?", (PINNED_DIRS_KEY,)).fetchone()
+    if not row:
+        return []
+    try:
+        return [str(path) for path in json.loads(row[0])]
+    except (ValueError, TypeError):
+        return []
+
+
+def set_pinned_dirs(db_conn: sqlite3.Connection, paths: List[str]):
+    db_conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (PINNED_DIRS_KEY, json.dumps(paths)))
+    db_conn.commit()
+
+
+class TaskPriority:
+    """
+    Sort key of an indexing task, smallest first: files under a pinned directory, then
+    files near directories that recent chats retrieved from, then newest mtime first.
+    """
+    def __init__(self, root: str, pinned: List[str], hot_dirs: Dict[str, float]):
+        self.root = root.rstrip(os.sep)
+        self.pinned = tuple(os.path.join(self.root, rel.strip("/")).rstrip(os.sep) for rel in pinned if rel.strip("/"))
+        self.hot_dirs = hot_dirs
+
+    @classmethod
+    def load(cls, db_conn: sqlite3.Connection, root: str) -> "TaskPriority":
+        return cls(root, get_pinned_dirs(db_conn), load_hot_dirs(db_conn, root))
+
+    def is_pinned(self, path: str) -> bool:
+        return any(path == pin or path.startswith(pin + os.sep) for pin in self.pinned)
+
+    def hotness(self, path: str) -> float:
+        if not self.hot_dirs:
+            return 0.0
+        best, factor = 0.0, 1.0
+        directory = os.path.dirname(path)
+        while True:
+            best = max(best, self.hot_dirs.get(directory, 0.0) * factor)
+            if len(directory) <= len(self.root):
+                return best
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                return best
+            directory, factor = parent, factor * HIT_ANCESTOR_FACTOR
+
+    def __call__(self, task: Dict[str, Any]) -> Tuple[int, float, float]:
+        path = task["path"]
+        # Hotness rounded, so files of about equally hot directories still go newest first
+        return (0 if self.is_pinned(path) else 1, -round(self.hotness(path), 1), -task["mod_time"])
+
+
+class PriorityTaskQueue(queue.Queue):
+    """
+    Bounded queue that hands out the task with the smallest key first (FIFO among equal
+    keys). The None end-of-stream marker always comes out last.
+    """
+    def __init__(self, key: Callable[[Dict[str, Any]], tuple], maxsize: int = PRIORITY_BACKLOG):
+        self.key = key
+        super().__init__(maxsize)
+
+    def _init(self, maxsize):
+        self.queue: List[tuple] = []
+        self.seq = 0
+
+    def _qsize(self):
+        return len(self.queue)
+
+    def _put(self, item):
+        self.seq += 1
+        rank = (1,) if item is None else (0,) + tuple(self.key(item))
+        heapq.heappush(self.queue, (rank, self.seq, item))
+
+    def _get(self):
+        return heapq.heappop(self.queue)[2]
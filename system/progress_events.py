@@ -0,0 +1,128 @@
+import json
+import asyncio
+import logging
+import threading
+from typing import Optional, Dict, Any, List
+
+logger = logging.getLogger("oonanji-backend")
+
+# Per-subscriber backlog. A client that falls this far behind is resynced with a fresh
+# snapshot instead of being sent every missed delta.
+SUBSCRIBER_QUEUE_SIZE = 512
+
+# Seconds between keep-alive comments, so proxies don't close an idle stream
+KEEPALIVE_INTERVAL = 15.0
+
+
+class Subscriber:
+    def __init__(self, user: Dict[str, Any]):
+        self.username = user.get("username")
+        self.is_admin = user.get("role") == "admin"
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.needs_snapshot = False
+
+    def accepts(self, audience: Optional[str]) -> bool:
+        if audience is None:
+            return True
+        if audience == "admin":
+            return self.is_admin
+        return audience == self.username
+
+
+class ProgressHub:
+    """
+    Fan-out of job progress (indexing, uploads, model downloads) to server-sent-event
+    streams. publish() is safe to call from any thread; delivery happens on the event loop.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers: List[Subscriber] = []
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+
+    def subscribe(self, user: Dict[str, Any]) -> Subscriber:
+        sub = Subscriber(user)
+        with self.lock:
+            self.subscribers.append(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        with self.lock:
+            if sub in self.subscribers:
+                self.subscribers.remove(sub)
+
+    def publish(self, event_type: str, payload: Dict[str, Any], audience: Optional[str] = None):
+        """audience: None = every user, "admin" = admins only, otherwise a username"""
+        if self.loop is None or not self.subscribers:
+            return
+        event = {"type": event_type, **payload}
+        try:
+            self.loop.call_soon_threadsafe(self._deliver, event, audience)
+        except RuntimeError:
+            # Event loop already closed (shutdown)
+            pass
+
+    def _deliver(self, event: Dict[str, Any], audience: Optional[str]):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for sub in subscribers:
+            if not sub.accepts(audience) or sub.needs_snapshot:
+                continue
+            try:
+                sub.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                logger.warning(f"Progress stream for '{sub.username}' fell behind, resyncing")
+                sub.needs_snapshot = True
+
+    async def stream(self, sub: Subscriber, snapshot_fn):
+        """
+        SSE generator: a full snapshot first (and again after an overflow), then deltas.
+        Everything already queued is drained at once and consecutive log lines are merged,
+        so a fast indexer produces one message per burst instead of one per line.
+        """
+        try:
+            yield _format({"type": "snapshot", **await snapshot_fn(sub)})
+            while True:
+                if sub.needs_snapshot:
+                    while not sub.queue.empty():
+                        sub.queue.get_nowait()
+                    sub.needs_snapshot = False
+                    yield _format({"type": "snapshot", **await snapshot_fn(sub)})
+                    continue
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), timeout=KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                events = [event]
+                while not sub.queue.empty():
+                    events.append(sub.queue.get_nowait())
+                for event in _coalesce(events):
+                    yield _format(event)
+        finally:
+            self.unsubscribe(sub)
+
+
+def _coalesce(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Events are shared between subscribers: merge into copies, never into the originals
+    merged: List[Dict[str, Any]] = []
+    for event in events:
+        prev = merged[-1] if merged else None
+        same_job = prev is not None and prev["type"] == event["type"] and \
+            prev.get("storage_mode") == event.get("storage_mode") and prev.get("id") == event.get("id")
+        if same_job and event["type"] == "indexing_log":
+            prev["lines"] = prev["lines"] + event["lines"]
+        elif same_job and event["type"] == "indexing":
+            prev["status"] = {**prev["status"], **event["status"]}
+        elif same_job and event["type"] in ("upload", "download"):
+            # Only the latest progress of the same job matters
+            merged[-1] = dict(event)
+        else:
+            merged.append(dict(event))
+    return merged
+
+
+def _format(event: Dict[str, Any]) -> str:
+    return f"data: {json.dumps(event)}\n\n"
@@ -0,0 +1,82 @@
+import os
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# Ranked chunks of recent searches (backend only), keyed by
+#   (kind, base collection name, index generation, shard names, query, n_results)
+# where query is the hash of the query embedding (vector search) or the FTS expression
+# (keyword search). The indexer bumps the generation with every committed change
+# (shards.bump_generation), so a hit is never older than the index.
+RETRIEVAL_CACHE_SIZE = int(os.environ.get("RETRIEVAL_CACHE_SIZE", "256"))
+
+
+def embedding_digest(vector: List[float]) -> str:
+    return hashlib.sha1(array('f', vector).tobytes()).hexdigest()
+
+
+def _copy(result: Dict[str, List[List[Any]]]) -> Dict[str, List[List[Any]]]:
+    # Callers annotate metadatas (duplicate_paths): hand out copies, never the cached dicts
+    return {key: [[dict(m) if isinstance(m, dict) else m for m in rows[0]]] if key == "metadatas" else [list(rows[0])]
+            for key, rows in result.items() if rows}
+
+
+class RetrievalCache:
+    def __init__(self, max_entries: int = RETRIEVAL_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[Tuple, Dict[str, List[List[Any]]]]" = OrderedDict()
+        # Newest generation seen per base: entries of older ones are dropped at once
+        self.generations: Dict[str, int] = {}
+        self.hits = self.misses = self.invalidated = 0
+
+    def _observe(self, base: str, generation: int):
+        if self.generations.get(base, generation) < generation:
+            stale = [key for key in self.entries if key[1] == base and key[2] < generation]
+            for key in stale:
+                del self.entries[key]
+            self.invalidated += len(stale)
+        self.generations[base] = max(generation, self.generations.get(base, generation))
+
+    def get(self, key: Tuple) -> Optional[Dict[str, List[List[Any]]]]:
+        with self.lock:
+            self._observe(key[1], key[2])
+            result = self.entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return _copy(result)
+
+    def put(self, key: Tuple, result: Dict[str, List[List[Any]]]):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self._observe(key[1], key[2])
+            if key[2] < self.generations[key[1]]:
+                return  # The index changed while this search ran
+            self.entries[key] = _copy(result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidated": self.invalidated,
+            }
+
+
+_retrieval_cache = RetrievalCache()
+
+def get_retrieval_cache() -> RetrievalCache:
+    return _retrieval_cache
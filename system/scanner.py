@@ -0,0 +1,391 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger("indexer")
+
+# A directory's mtime only changes when entries are added, removed or renamed in it, not
+# when a file inside is edited in place. Skipping unchanged directories therefore misses
+# in-place edits until the next full verification pass, which lists and stats everything;
+# keep it short enough that an edited document is at most about a day stale (watch mode
+# picks edits up at once).
+FULL_VERIFY_HOURS = float(os.environ.get("INDEX_FULL_VERIFY_HOURS", "24"))
+
+# SMB/FAT report mtimes at 1-2s resolution. A directory changed within this window of the
+# scan may change again without its mtime moving, so its mtime is not trusted next time.
+MTIME_GRANULARITY = 2.0
+
+# Directories listed/stat'ed concurrently. Network shares are latency bound, so this is
+# well above the core count; 1 scans sequentially in the calling thread.
+SCAN_WORKERS = int(os.environ.get("INDEX_SCAN_WORKERS", "8"))
+# Directories listed ahead of the consumer (bounds memory when the pipeline is the bottleneck)
+SCAN_LOOKAHEAD = int(os.environ.get("INDEX_SCAN_LOOKAHEAD", "256"))
+
+# Indexed files (created by the backend; the indexer adds summary, content_hash and
+# duplicate_of). modified_time is NOT NULL: FORGOTTEN_MTIME marks a file to index again.
+FILE_STATE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS file_index_state (
+        path TEXT PRIMARY KEY,
+        modified_time REAL NOT NULL,
+        last_seen REAL NOT NULL
+    )
+'''
+FORGOTTEN_MTIME = 0.0
+
+DIR_STATE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS dir_index_state (
+        path TEXT PRIMARY KEY,
+        mtime REAL,
+        entry_count INTEGER NOT NULL,
+        subdirs TEXT NOT NULL,
+        last_listed REAL NOT NULL
+    )
+'''
+
+# Directories of an interrupted full-root pass whose files are all durably indexed.
+# The next pass skips them like unchanged directories instead of starting over.
+CHECKPOINT_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS scan_checkpoint (
+        path TEXT PRIMARY KEY,
+        mtime REAL,
+        entry_count INTEGER NOT NULL,
+        subdirs TEXT NOT NULL,
+        done_at REAL NOT NULL
+    )
+'''
+# Seconds between checkpoint writes while a pass runs
+CHECKPOINT_INTERVAL = float(os.environ.get("INDEX_CHECKPOINT_SECONDS", "30"))
+
+
+class DirRecord:
+    __slots__ = ("mtime", "entry_count", "subdirs", "resumed")
+
+    def __init__(self, mtime: Optional[float], entry_count: int, subdirs: List[str], resumed: bool = False):
+        self.mtime = mtime  # None = list it again next scan
+        self.entry_count = entry_count
+        self.subdirs = subdirs
+        self.resumed = resumed  # From the checkpoint of an interrupted pass: skipped even when verifying
+
+
+class DirScan:
+    """One directory of a scan: either listed (files filled in) or skipped as unchanged"""
+    __slots__ = ("path", "mtime", "listed", "files", "subdirs", "entry_count")
+
+    def __init__(self, path: str, mtime: float, listed: bool, files: List[os.DirEntry], subdirs: List[str], entry_count: int):
+        self.path = path
+        self.mtime = mtime
+        self.listed = listed
+        self.files = files
+        self.subdirs = subdirs
+        self.entry_count = entry_count
+
+
+class PathEntry:
+    """os.DirEntry stand-in for a single file given by path (watch-mode targets)"""
+    __slots__ = ("path", "name")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = os.path.basename(path)
+
+    def stat(self):
+        return os.stat(self.path)
+
+
+def _prefix_range(root: str):
+    prefix = root.rstrip(os.sep) + os.sep
+    return prefix, prefix + "\U0010ffff"
+
+
+def load_dir_tree(db_conn: sqlite3.Connection, root: str) -> Dict[str, DirRecord]:
+    lo, hi = _prefix_range(root)
+    rows = db_conn.execute(
+        "SELECT path, mtime, entry_count, subdirs FROM dir_index_state WHERE path = ? OR (path >= ? AND path < ?)",
+        (root, lo, hi)).fetchall()
+    return {path: DirRecord(mtime, count, json.loads(subdirs)) for path, mtime, count, subdirs in rows}
+
+
+def save_dir_tree(db_conn: sqlite3.Connection, root: str, scans: List[DirScan], dirty: set, scan_start_time: float):
+    """
+    Replace the stored tree under root with what a completed scan saw. Directories in
+    `dirty` (a file in them failed and must be retried) and directories modified too close
+    to the scan are stored without an mtime, so the next scan lists them again.
+    """
+    now = time.time()
+    rows = []
+    for scan in scans:
+        mtime = scan.mtime
+        if scan.path in dirty or mtime >= scan_start_time - MTIME_GRANULARITY:
+            mtime = None
+        rows.append((scan.path, mtime, scan.entry_count, json.dumps(scan.subdirs), now))
+    lo, hi = _prefix_range(root)
+    db_conn.execute("DELETE FROM dir_index_state WHERE path = ? OR (path >= ? AND path < ?)", (root, lo, hi))
+    db_conn.executemany(
+        "INSERT INTO dir_index_state (path, mtime, entry_count, subdirs, last_listed) VALUES (?, ?, ?, ?, ?)", rows)
+    db_conn.commit()
+
+
+def load_checkpoint(db_conn: sqlite3.Connection, root: str) -> Dict[str, DirRecord]:
+    lo, hi = _prefix_range(root)
+    rows = db_conn.execute(
+        "SELECT path, mtime, entry_count, subdirs FROM scan_checkpoint WHERE path = ? OR (path >= ? AND path < ?)",
+        (root, lo, hi)).fetchall()
+    return {path: DirRecord(mtime, count, json.loads(subdirs), resumed=True) for path, mtime, count, subdirs in rows}
+
+
+def clear_checkpoint(db_conn: sqlite3.Connection, root: str):
+    """Drop the checkpoint under root (the caller commits, together with the saved tree)"""
+    lo, hi = _prefix_range(root)
+    db_conn.execute("DELETE FROM scan_checkpoint WHERE path = ? OR (path >= ? AND path < ?)", (root, lo, hi))
+
+
+def forget_files(db_conn: sqlite3.Connection, paths: Iterable[str]):
+    """Make the next scan extract these files again, whatever their mtime (the caller commits)"""
+    db_conn.executemany("UPDATE file_index_state SET modified_time = ?, content_hash = NULL, duplicate_of = NULL WHERE path = ?",
+                        [(FORGOTTEN_MTIME, path) for path in paths])
+
+
+def invalidate_dirs(db_conn: sqlite3.Connection, dir_paths: Iterable[str]):
+    """Make the next scan list these directories again (the caller commits)"""
+    rows = [(path,) for path in set(dir_paths)]
+    db_conn.executemany("UPDATE dir_index_state SET mtime = NULL WHERE path = ?", rows)
+    db_conn.executemany("UPDATE scan_checkpoint SET mtime = NULL WHERE path = ?", rows)
+
+
+class ScanCheckpoint:
+    """
+    Tracks which listed directories of a running pass are done: listed to the end, and
+    every file queued from them either written and committed or given up on. Files are
+    extracted out of order and written in batches, so a directory is done only once its
+    last outstanding file has been committed by the write stage.
+    """
+    def __init__(self, scan_start_time: float):
+        self.scan_start_time = scan_start_time
+        self.lock = threading.Lock()
+        # path -> [DirScan, outstanding files, listing finished]
+        self.open: Dict[str, list] = {}
+        self.done: List[DirScan] = []
+
+    def opened(self, scan: DirScan):
+        with self.lock:
+            self.open[scan.path] = [scan, 0, False]
+
+    def queued(self, dir_path: str):
+        with self.lock:
+            self.open[dir_path][1] += 1
+
+    def _finish(self, dir_path: str, state: list):
+        if state[2] and state[1] == 0:
+            del self.open[dir_path]
+            self.done.append(state[0])
+
+    def closed(self, dir_path: str):
+        """Every file of the directory has been queued (not called when the listing was cut short)"""
+        with self.lock:
+            state = self.open[dir_path]
+            state[2] = True
+            self._finish(dir_path, state)
+
+    def committed(self, dir_paths: Iterable[str]):
+        """One entry per file that left the pipeline for good (committed, or failed and left dirty)"""
+        with self.lock:
+            for dir_path in dir_paths:
+                state = self.open.get(dir_path)
+                if state is not None:
+                    state[1] -= 1
+                    self._finish(dir_path, state)
+
+    def save(self, db_conn: sqlite3.Connection, dirty: set) -> int:
+        """Persist the directories done since the last save. Returns how many."""
+        with self.lock:
+            done, self.done = self.done, []
+        if not done:
+            return 0
+        now = time.time()
+        rows = []
+        for scan in done:
+            # Same rule as save_dir_tree: a dirty or recently modified directory is listed again
+            mtime = scan.mtime
+            if scan.path in dirty or mtime >= self.scan_start_time - MTIME_GRANULARITY:
+                mtime = None
+            rows.append((scan.path, mtime, scan.entry_count, json.dumps(scan.subdirs), now))
+        db_conn.executemany(
+            "INSERT OR REPLACE INTO scan_checkpoint (path, mtime, entry_count, subdirs, done_at) VALUES (?, ?, ?, ?, ?)", rows)
+        db_conn.commit()
+        return len(rows)
+
+
+def full_verify_due(db_conn: sqlite3.Connection, root: str) -> bool:
+    row = db_conn.execute("SELECT value FROM settings WHERE key = ?", (f"full_verify_at:{root}",)).fetchone()
+    if not row:
+        return True
+    try:
+        return time.time() - float(row[0]) >= FULL_VERIFY_HOURS * 3600
+    except ValueError:
+        return True
+
+
+def mark_full_verify(db_conn: sqlite3.Connection, root: str, at: float):
+    db_conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (f"full_verify_at:{root}", str(at)))
+    db_conn.commit()
+
+
+def list_directory(path: str):
+    """(files, sorted subdirectory names) of one directory, os.walk semantics for symlinks"""
+    files, subdirs = [], []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                # Like os.walk(followlinks=False): symlinked directories are not descended
+                if not entry.is_symlink():
+                    subdirs.append(entry.name)
+            else:
+                files.append(entry)
+    subdirs.sort()
+    files.sort(key=lambda entry: entry.name)
+    return files, subdirs
+
+
+def scan_directory(path: str, known: Dict[str, DirRecord], verify: bool,
+                   extensions: Optional[Tuple[str, ...]] = None) -> Optional[DirScan]:
+    """
+    Stat one directory and, unless its stored record shows it unchanged, list it.
+    Files matching `extensions` are stat'ed here too; DirEntry caches the result, so the
+    consumer's entry.stat() is free and the stat round trips happen in the scan workers.
+    Returns None if the directory is gone or unreadable.
+    """
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+    record = known.get(path)
+    if (record is not None and record.mtime is not None and record.mtime == mtime
+            and (not verify or record.resumed)):
+        return DirScan(path, mtime, False, [], record.subdirs, record.entry_count)
+    try:
+        files, subdirs = list_directory(path)
+    except OSError as e:
+        logger.warning(f"Cannot list {path}: {e}")
+        return None
+    if extensions:
+        for entry in files:
+            if entry.name.endswith(extensions):
+                try:
+                    entry.stat()
+                except OSError:
+                    pass  # The consumer hits (and reports) the same error
+    return DirScan(path, mtime, True, files, subdirs, len(files) + len(subdirs))
+
+
+def scan_directories(top: str, known: Dict[str, DirRecord], verify: bool,
+                     stop_event: Optional[threading.Event] = None, workers: Optional[int] = None,
+                     extensions: Optional[Tuple[str, ...]] = None) -> Iterator[DirScan]:
+    """
+    Depth-first walk of top, yielding directories in the same order as a sequential walk
+    (sorted names) however many workers list them. With verify=False, a directory whose
+    mtime matches the stored record is not listed: its known subdirectories are visited
+    (one stat each) and its files are reported as unchanged. Missing directories are
+    skipped, so everything indexed below them ends up unseen and gets removed.
+    """
+    workers = SCAN_WORKERS if workers is None else workers
+    if workers <= 1:
+        stack = [top]
+        while stack:
+            if stop_event is not None and stop_event.is_set():
+                return
+            scan = scan_directory(stack.pop(), known, verify, extensions)
+            if scan is not None:
+                yield scan
+                stack.extend(os.path.join(scan.path, name) for name in reversed(scan.subdirs))
+        return
+    yield from ParallelScan(top, known, verify, workers, extensions).run(stop_event)
+
+
+class _Node:
+    __slots__ = ("path", "future", "children")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.future = None
+        self.children: List["_Node"] = []
+
+
+class ParallelScan:
+    """
+    Fan-out over subdirectories on a thread pool. As soon as a worker has listed a
+    directory it queues its subdirectories (up to SCAN_LOOKAHEAD outstanding), while the
+    consumer walks the resulting tree depth-first and waits only for the directory it
+    needs next. Subdirectories beyond the lookahead are queued when the consumer gets there.
+    """
+    def __init__(self, top: str, known: Dict[str, DirRecord], verify: bool, workers: int,
+                 extensions: Optional[Tuple[str, ...]] = None, lookahead: int = SCAN_LOOKAHEAD):
+        self.top = top
+        self.known = known
+        self.verify = verify
+        self.extensions = extensions
+        self.lookahead = lookahead
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="index-scan")
+        self.lock = threading.Lock()
+        self.outstanding = 0
+
+    def _submit(self, node: _Node, force: bool = False) -> bool:
+        with self.lock:
+            if not force and self.outstanding >= self.lookahead:
+                return False
+            self.outstanding += 1
+        try:
+            node.future = self.pool.submit(self._visit, node)
+        except RuntimeError:  # Pool shut down (consumer stopped)
+            with self.lock:
+                self.outstanding -= 1
+            return False
+        return True
+
+    def _visit(self, node: _Node) -> Optional[DirScan]:
+        scan = scan_directory(node.path, self.known, self.verify, self.extensions)
+        if scan is not None:
+            node.children = [_Node(os.path.join(scan.path, name)) for name in scan.subdirs]
+            for child in node.children:
+                if not self._submit(child):
+                    break
+        return scan
+
+    def run(self, stop_event: Optional[threading.Event] = None) -> Iterator[DirScan]:
+        root = _Node(self.top)
+        stack = [root]
+        try:
+            self._submit(root, force=True)
+            while stack:
+                if stop_event is not None and stop_event.is_set():
+                    return
+                node = stack.pop()
+                if node.future is None and not self._submit(node, force=True):
+                    return
+                scan = node.future.result()
+                with self.lock:
+                    self.outstanding -= 1
+                if scan is None:
+                    continue
+                yield scan
+                stack.extend(reversed(node.children))
+        finally:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def scan_paths(paths: List[str], stop_event: Optional[threading.Event] = None,
+               extensions: Optional[Tuple[str, ...]] = None) -> Iterator[DirScan]:
+    """Scan only the given files/directories (no tree shortcuts). Missing paths yield nothing."""
+    for target in paths:
+        if os.path.isdir(target):
+            yield from scan_directories(target, {}, True, stop_event, extensions=extensions)
+        elif os.path.isfile(target):
+            yield DirScan(os.path.dirname(target), 0.0, True, [PathEntry(target)], [], 1)
@@ -0,0 +1,174 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger("indexer")
+
+# How a storage root's chunks are split over Chroma collections:
+#   none    one collection, documents_{mode}
+#   top     one collection per top-level directory of the root
+#   hash:N  N collections, by hash of the file path
+# Every shard has its own HNSW index, so each stays small, shards are queried in
+# parallel, and one shard can be dropped and rebuilt without touching the others.
+# Changing the layout re-indexes the root (see indexer.apply_shard_layout).
+SHARDING = os.environ.get("INDEX_SHARDING", "none")
+SHARD_QUERY_WORKERS = int(os.environ.get("INDEX_SHARD_QUERY_WORKERS", "8"))
+SHARD_SEPARATOR = "__"
+# settings key holding the layout the collections of a base name were built with
+LAYOUT_KEY = "index_sharding:{base}"
+# settings key counting committed changes to the chunks of a base name. The backend's
+# retrieval cache keys on it, so results cached before a change are never served after it.
+GENERATION_KEY = "index_generation:{base}"
+
+
+class ShardLayout:
+    """Maps a file path to the collection it is indexed in"""
+    __slots__ = ("base", "root", "kind", "count")
+
+    def __init__(self, base: str, root: str, spec: str = SHARDING):
+        self.base = base
+        self.root = root.rstrip(os.sep)
+        spec = (spec or "none").strip().lower()
+        if spec in ("none", "top"):
+            self.kind, self.count = spec, 0
+        elif spec.startswith("hash:") and spec[5:].isdigit() and int(spec[5:]) >= 1:
+            self.kind, self.count = "hash", int(spec[5:])
+        else:
+            raise ValueError(f"Invalid INDEX_SHARDING {spec!r} (expected none, top or hash:N)")
+        if self.kind == "hash" and self.count == 1:
+            self.kind, self.count = "none", 0
+
+    @property
+    def spec(self) -> str:
+        return f"hash:{self.count}" if self.kind == "hash" else self.kind
+
+    def name_for(self, path: str) -> str:
+        if self.kind == "none":
+            return self.base
+        if self.kind == "hash":
+            shard = int(hashlib.md5(path.encode()).hexdigest()[:8], 16) % self.count
+            return f"{self.base}{SHARD_SEPARATOR}h{shard:03d}"
+        # Collection names allow only [a-zA-Z0-9._-], so directory names are hashed
+        rel = os.path.relpath(path, self.root)
+        top = rel.split(os.sep, 1)[0] if os.sep in rel else ""
+        suffix = f"t{hashlib.md5(top.encode()).hexdigest()[:12]}" if top else "root"
+        return f"{self.base}{SHARD_SEPARATOR}{suffix}"
+
+
+def is_shard_of(name: str, base: str) -> bool:
+    return name == base or name.startswith(base + SHARD_SEPARATOR)
+
+
+def list_shards(client, base: str) -> List[Any]:
+    """Every collection holding chunks of `base` (the unsharded collection and/or its shards)"""
+    shards = []
+    for collection in client.list_collections():
+        # Collection objects (chromadb 0.4/0.5) or names (0.6+)
+        name = getattr(collection, "name", collection)
+        if is_shard_of(name, base):
+            shards.append(collection if hasattr(collection, "query") else client.get_collection(name))
+    return sorted(shards, key=lambda c: c.name)
+
+
+class ShardedCollection:
+    """
+    Write side of a sharded index: a file's chunks are written to shard(path), deleted
+    files are removed shard by shard.
+    """
+    def __init__(self, client, layout: ShardLayout, embedding_function=None):
+        self.client = client
+        self.layout = layout
+        self.embedding_function = embedding_function
+        self.collections: Dict[str, Any] = {}
+        self.lock = threading.Lock()
+
+    def shard(self, path: str):
+        name = self.layout.name_for(path)
+        with self.lock:
+            collection = self.collections.get(name)
+            if collection is None:
+                collection = self.client.get_or_create_collection(name=name, embedding_function=self.embedding_function)
+                self.collections[name] = collection
+        return collection
+
+    def delete_paths(self, paths: Iterable[str]):
+        by_shard: Dict[int, Tuple[Any, List[str]]] = {}
+        for path in paths:
+            collection = self.shard(path)
+            by_shard.setdefault(id(collection), (collection, []))[1].append(path)
+        for collection, shard_paths in by_shard.values():
+            collection.delete(where={"path": {"$in": shard_paths}})
+
+
+def bump_generation(db_conn, base: str):
+    """Part of the transaction committing a change, after the change reached the collections"""
+    db_conn.execute("""
+        INSERT INTO settings (key, value) VALUES (?, '1')
+        ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+    """, (GENERATION_KEY.format(base=base),))
+
+
+def read_generation(db_conn, base: str) -> int:
+    row = db_conn.execute("SELECT value FROM settings WHERE key = ?", (GENERATION_KEY.format(base=base),)).fetchone()
+    return int(row[0]) if row else 0
+
+
+_query_pool: Optional[ThreadPoolExecutor] = None
+_query_pool_lock = threading.Lock()
+
+
+def _get_query_pool() -> ThreadPoolExecutor:
+    global _query_pool
+    with _query_pool_lock:
+        if _query_pool is None:
+            _query_pool = ThreadPoolExecutor(max_workers=SHARD_QUERY_WORKERS, thread_name_prefix="shard-query")
+        return _query_pool
+
+
+def query_shards(collections: List[Any], query_embedding: List[float], n_results: int,
+                 **query_kwargs) -> Tuple[Dict[str, List[List[Any]]], List[Dict[str, Any]]]:
+    """
+    Scatter-gather: query every shard concurrently and merge to the overall top n_results
+    by distance. Returns (results shaped like collection.query's, per-shard timings).
+    A failing shard is reported in its timing entry and leaves the others' results usable.
+    """
+    def query_one(collection):
+        t0 = time.perf_counter()
+        try:
+            result = collection.query(query_embeddings=[query_embedding], n_results=n_results,
+                                      include=["documents", "metadatas", "distances"], **query_kwargs)
+            error = None
+        except Exception as e:
+            result, error = None, str(e)
+        return collection.name, result, (time.perf_counter() - t0) * 1000, error
+
+    if len(collections) == 1:
+        answers = [query_one(collections[0])]
+    else:
+        answers = list(_get_query_pool().map(query_one, collections))
+
+    hits, timings = [], []
+    for name, result, ms, error in answers:
+        count = 0
+        if result and result.get("ids"):
+            ids = result["ids"][0]
+            count = len(ids)
+            hits.extend(zip(result["distances"][0], ids, result["documents"][0], result["metadatas"][0]))
+        timings.append({"shard": name, "ms": round(ms, 1), "results": count, **({"error": error} if error else {})})
+    hits.sort(key=lambda hit: hit[0])
+    hits = hits[:n_results]
+    merged = {
+        "ids": [[hit[1] for hit in hits]],
+        "documents": [[hit[2] for hit in hits]],
+        "metadatas": [[hit[3] for hit in hits]],
+        "distances": [[hit[0] for hit in hits]],
+    }
+    return merged, timings
+
+
+def format_timings(timings: List[Dict[str, Any]]) -> str:
+    return ", ".join(f"{t['shard']}={t['ms']}ms/{t['results']}" + (" (failed)" if "error" in t else "") for t in timings)
@@ -0,0 +1,249 @@
+import os
+import re
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    from llama_cpp import Llama
+except ImportError:
+    Llama = None
+
+logger = logging.getLogger("indexer")
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+# "tokens": chunks are sized in tokens of the embedding model, so Japanese and English
+# chunks fill its context alike. Falls back to characters when the tokenizer can't load.
+CHUNK_MODE = os.environ.get("INDEX_CHUNK_MODE", "tokens")
+CHUNK_TOKENS = int(os.environ.get("INDEX_CHUNK_TOKENS", "512"))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("INDEX_CHUNK_OVERLAP_TOKENS", "64"))
+# First guess of characters per token, refined from every chunk measured
+INITIAL_CHARS_PER_TOKEN = 2.0
+# A chunk below this share of the token budget is grown (unless the text ends)
+TOKEN_FILL_TARGET = 0.9
+TOKEN_FIT_ATTEMPTS = 4
+
+# Split point candidates, best level first; within a level the rightmost one wins.
+# Whitespace separators are dropped at the split, sentence punctuation stays with the
+# sentence it ends. Japanese text has no spaces, so without 。！？ long Japanese passages
+# could only be cut mid-sentence.
+SEPARATOR_LEVELS: Tuple[Tuple[str, ...], ...] = (
+    ("\n\n",),
+    ("\n",),
+    ("。", "！", "？", ". ", "! ", "? "),
+    (" ", "\u3000", "\t"),
+)
+# (separator, characters kept at the end of the chunk, length): "。" is kept, " " is not
+_LEVELS = tuple(tuple((sep, len(sep.rstrip()), len(sep)) for sep in level) for level in SEPARATOR_LEVELS)
+_MAX_SEPARATOR_LEN = max(length for level in _LEVELS for _, _, length in level)
+_BOUNDARY_RE = re.compile("|".join(re.escape(sep) for level in SEPARATOR_LEVELS for sep in level))
+
+
+def _split_point(buf: str, lo: int, end: int) -> Tuple[int, int]:
+    """(chunk end, end of separator) of the best split at or before `end`, searching back to `lo`"""
+    for level in _LEVELS:
+        best = best_kept = best_len = -1
+        for sep, kept, length in level:
+            i = buf.rfind(sep, lo, end - kept + length)
+            if i > best:
+                best, best_kept, best_len = i, kept, length
+        if best != -1:
+            return best + best_kept, best + best_len
+    # No separator in the window: hard split
+    return end, end
+
+
+def _overlap_start(buf: str, chunk_start: int, chunk_end: int, next_start: int, overlap: int) -> int:
+    """Where the next chunk starts: `overlap` characters back, moved forward to a word/sentence start"""
+    lo = max(chunk_end - overlap, chunk_start + 1)
+    if overlap <= 0 or lo >= chunk_end:
+        return next_start
+    match = _BOUNDARY_RE.search(buf, lo, chunk_end)
+    if match is None or match.end() >= chunk_end:
+        # No boundary in the overlap window (e.g. one long token): overlap mid-word
+        return lo
+    return match.end()
+
+
+def _refill(pieces: Iterator[str], buf: str, start: int, need: int) -> Tuple[str, bool]:
+    """Drop buf[:start] and append pieces (with one join, however small they are) until `need` characters are buffered"""
+    parts, have, eof = [buf[start:]], len(buf) - start, False
+    while have < need:
+        piece = next(pieces, None)
+        if piece is None:
+            eof = True
+            break
+        parts.append(piece)
+        have += len(piece)
+    return "".join(parts), eof
+
+
+def iter_text_chunks(pieces: Iterable[str], chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP) -> Iterator[str]:
+    """
+    Split a stream of text pieces into chunks of at most chunk_size characters, cut at the
+    best separator near the end of each chunk (paragraph, line, sentence, word), with
+    consecutive chunks sharing about chunk_overlap characters.
+
+    Works on offsets into one buffer that holds the current chunk plus one piece, and every
+    split point is searched with str.find/rfind over a bounded window, so splitting is
+    linear in the text length and memory does not grow with it. The output does not depend
+    on how the text is cut into pieces.
+    """
+    if chunk_overlap >= chunk_size:
+        raise ValueError("chunk_overlap must be smaller than chunk_size")
+    # A separator is looked for in the last `lookback` characters of a full chunk
+    lookback = max(chunk_overlap, chunk_size // 5)
+    pieces = iter(pieces)
+    # start: next chunk; covered: end of the text already emitted (start < covered inside an overlap)
+    buf, start, covered, eof, emitted = "", 0, 0, False, False
+    while True:
+        end = start + chunk_size
+        # A split point search may look a separator's length past `end`
+        if not eof and end + _MAX_SEPARATOR_LEN > len(buf):
+            buf, eof = _refill(pieces, buf, start, chunk_size + _MAX_SEPARATOR_LEN)
+            end -= start
+            covered -= start
+            start = 0
+        if end >= len(buf):
+            # Last chunk, unless all it would add is trailing whitespace
+            if start < len(buf) and (not emitted or buf[covered:].strip()):
+                yield buf[start:]
+            return
+
+        chunk_end, next_start = _split_point(buf, max(start + 1, end - lookback), end)
+        yield buf[start:chunk_end]
+        emitted = True
+        covered = next_start
+        start = _overlap_start(buf, start, chunk_end, next_start, chunk_overlap)
+
+
+def split_text(text: str, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP) -> List[str]:
+    return list(iter_text_chunks((text,), chunk_size, chunk_overlap))
+
+
+def iter_token_chunks(pieces: Iterable[str], count_tokens: Callable[[str], int], max_tokens: int = CHUNK_TOKENS,
+                      overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> Iterator[str]:
+    """
+    Like iter_text_chunks, but chunks hold at most max_tokens tokens as counted by
+    count_tokens. The character length of a chunk is predicted from the characters per
+    token seen so far, then shrunk or grown (a few tokenizer calls at most) until the
+    chunk fits and fills at least TOKEN_FILL_TARGET of the budget.
+    """
+    if overlap_tokens >= max_tokens:
+        raise ValueError("overlap_tokens must be smaller than max_tokens")
+    pieces = iter(pieces)
+    buf, start, covered, eof, emitted = "", 0, 0, False, False
+    ratio = INITIAL_CHARS_PER_TOKEN
+    while True:
+        chunk_chars = max(int(max_tokens * ratio), 1)
+        best = None  # (chunk end, next start, tokens) of the longest candidate that fits
+        attempt = 0
+        while True:
+            attempt += 1
+            if not eof and start + chunk_chars + _MAX_SEPARATOR_LEN > len(buf):
+                buf, eof = _refill(pieces, buf, start, chunk_chars + _MAX_SEPARATOR_LEN)
+                covered -= start
+                if best is not None:
+                    best = (best[0] - start, best[1] - start, best[2])
+                start = 0
+            end = start + chunk_chars
+            if end >= len(buf):
+                chunk_end = next_start = len(buf)
+            else:
+                lookback = max(chunk_chars // 5, 1)
+                chunk_end, next_start = _split_point(buf, max(start + 1, end - lookback), end)
+            tokens = count_tokens(buf[start:chunk_end])
+            if tokens <= max_tokens:
+                if best is None or chunk_end > best[0]:
+                    best = (chunk_end, next_start, tokens)
+                if chunk_end == len(buf) or tokens >= max_tokens * TOKEN_FILL_TARGET or attempt >= TOKEN_FIT_ATTEMPTS:
+                    break
+                chunk_chars = max(int(chunk_chars * max_tokens / max(tokens, 1) * 0.97), chunk_chars + 1)
+            else:
+                if best is not None:
+                    break
+                shrink = max_tokens / tokens * 0.95
+                # Past the attempts, halve: always ends at a single character
+                chunk_chars = max(int(chunk_chars * (shrink if attempt < TOKEN_FIT_ATTEMPTS else 0.5)), 1)
+                if chunk_chars == 1 and end - start == 1:
+                    best = (chunk_end, next_start, tokens)
+                    break
+
+        chunk_end, next_start, tokens = best
+        if chunk_end >= len(buf) and eof:
+            # Last chunk, unless all it would add is trailing whitespace
+            if start < len(buf) and (not emitted or buf[covered:].strip()):
+                yield buf[start:]
+            return
+        yield buf[start:chunk_end]
+        emitted = True
+        if tokens:
+            ratio = 0.7 * ratio + 0.3 * (chunk_end - start) / tokens
+        covered = next_start
+        start = _overlap_start(buf, start, chunk_end, next_start, int(overlap_tokens * ratio))
+
+
+_tokenizer_path: Optional[Path] = None
+_token_counters: Dict[str, Optional[Callable[[str], int]]] = {}
+_tokenizer_lock = threading.Lock()
+
+
+def set_tokenizer_model(model_path: Path):
+    """GGUF model whose tokenizer sizes the chunks (the embedding model)"""
+    global _tokenizer_path
+    _tokenizer_path = Path(model_path)
+
+
+def get_token_counter() -> Optional[Callable[[str], int]]:
+    """Token counting with the embedding model's tokenizer (vocab-only load, cached per process)"""
+    if Llama is None or _tokenizer_path is None:
+        return None
+    key = str(_tokenizer_path)
+    with _tokenizer_lock:
+        if key not in _token_counters:
+            if not _tokenizer_path.exists():
+                return None  # Not downloaded yet; try again next time
+            try:
+                llm = Llama(model_path=key, vocab_only=True, verbose=False)
+            except Exception as e:
+                logger.warning(f"Tokenizer unavailable ({e}), chunking by characters")
+                _token_counters[key] = None
+            else:
+                _token_counters[key] = lambda text: len(llm.tokenize(text.encode("utf-8"), add_bos=False, special=False))
+        return _token_counters[key]
+
+
+class ChunkSpec:
+    """Chunk limits: in characters, and in tokens for the "tokens" mode (tokens=None: characters only)"""
+    __slots__ = ("chars", "overlap", "tokens", "overlap_tokens")
+
+    def __init__(self, chars: int, overlap: int, tokens: Optional[int] = None, overlap_tokens: int = 0):
+        self.chars = chars
+        self.overlap = overlap
+        self.tokens = tokens
+        self.overlap_tokens = overlap_tokens
+
+    def measure(self) -> Tuple[Callable[[str], int], int]:
+        """(length function, budget) in the unit chunks are sized in"""
+        count_tokens = get_token_counter() if CHUNK_MODE == "tokens" and self.tokens else None
+        return (count_tokens, self.tokens) if count_tokens else (len, self.chars)
+
+    def reduced(self, by: int) -> "ChunkSpec":
+        """Same spec with `by` units (of measure()) less room, e.g. for a repeated header"""
+        chars = max(self.chars - by, self.overlap * 2 + 1)
+        tokens = max(self.tokens - by, self.overlap_tokens * 2 + 1) if self.tokens else None
+        return ChunkSpec(chars, self.overlap, tokens, self.overlap_tokens)
+
+
+DEFAULT_CHUNKS = ChunkSpec(CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS)
+
+
+def iter_chunks(pieces: Iterable[str], spec: ChunkSpec = DEFAULT_CHUNKS) -> Iterator[str]:
+    """Token-sized chunks in "tokens" mode when the tokenizer is available, character-sized otherwise"""
+    count_tokens = get_token_counter() if CHUNK_MODE == "tokens" and spec.tokens else None
+    if count_tokens is None:
+        return iter_text_chunks(pieces, spec.chars, spec.overlap)
+    return iter_token_chunks(pieces, count_tokens, spec.tokens, spec.overlap_tokens)
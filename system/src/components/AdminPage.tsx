@@ -2,6 +2,7 @@
 
 import React, { useState, useEffect } from 'react';
 import { useAuth } from '@/lib/auth-context';
+import { useProgressEvents, applyIndexingEvent } from '@/lib/use-progress-events';
 import { useRouter } from 'next/navigation';
 import {
     ArrowLeft,
@@ -113,15 +114,14 @@ export default function AdminPage() {
         if (isAuthenticated && isAdmin) {
             fetchUsers();
             fetchCommonData();
-
-            const interval = setInterval(() => {
-                fetchCommonData();
-            }, 5000); // Check status every 5s
-
-            return () => clearInterval(interval);
         }
     }, [isAuthenticated, isAdmin]);
 
+    // Indexing progress and log lines are pushed by the server instead of polled
+    useProgressEvents(event => {
+        setNasStatus(prev => applyIndexingEvent(prev, event));
+    }, isAuthenticated && isAdmin);
+
     const getToken = () => localStorage.getItem('access_token');
 
     const fetchUsers = async () => {
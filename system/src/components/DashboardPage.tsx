@@ -5,6 +5,7 @@ import { createPortal } from 'react-dom';
 import { useAuth } from '@/lib/auth-context';
 import { useSettings } from '@/lib/settings-context';
 import { useTranslation } from '@/lib/use-translation';
+import { useProgressEvents } from '@/lib/use-progress-events';
 import { useRouter } from 'next/navigation';
 import ReactMarkdown from 'react-markdown';
 import { Prism as SyntaxHighlighter } from 'react-syntax-highlighter';
@@ -665,50 +666,28 @@ export default function DashboardPage() {
         }
     };
 
-    // Polling for file status
-    useEffect(() => {
-        const pendingFiles = attachedFiles.filter(f => f.id && f.status !== 'ready' && f.status !== 'error');
-        if (pendingFiles.length === 0) return;
-
-        const timer = setInterval(async () => {
-            const token = localStorage.getItem('access_token');
-            const API_URL = process.env.NEXT_PUBLIC_API_URL || '';
-
-            let updated = false;
-            const newFiles = [...attachedFiles];
-
-            for (const file of pendingFiles) {
-                if (!file.id) continue;
-                try {
-                    const res = await fetch(`${API_URL}/api/chat/file/${file.id}/status`, {
-                        headers: { 'Authorization': `Bearer ${token}` }
-                    });
-                    if (res.ok) {
-                        const statusData = await res.json();
-                        // Find index in current state (state might have changed due to user deleting file)
-                        const idx = newFiles.findIndex(f => f.id === file.id);
-                        if (idx !== -1) {
-                            if (newFiles[idx].status !== statusData.status || newFiles[idx].progress !== statusData.progress) {
-                                newFiles[idx] = {
-                                    ...newFiles[idx],
-                                    status: statusData.status,
-                                    progress: statusData.progress || 0,
-                                    error: statusData.error
-                                };
-                                updated = true;
-                            }
-                        }
-                    }
-                } catch (e) { console.error("Status check failed", e); }
-            }
-
-            if (updated) {
-                setAttachedFiles(newFiles);
-            }
-        }, 1000);
-
-        return () => clearInterval(timer);
-    }, [attachedFiles]);
+    // Upload indexing progress is pushed by the server. Events can arrive before the
+    // upload response has given the file its id, so the latest state per id is kept.
+    const uploadProgressRef = useRef<{ [fileId: string]: any }>({});
+
+    const applyUploadState = (file: AttachedFile, upload: any): AttachedFile => ({
+        ...file,
+        status: upload.status,
+        progress: upload.progress || 0,
+        error: upload.error
+    });
+
+    useProgressEvents(event => {
+        const uploads = event.type === 'snapshot' ? Object.values(event.uploads || {}) : event.type === 'upload' ? [event] : [];
+        if (uploads.length === 0) return;
+        for (const upload of uploads as any[]) {
+            uploadProgressRef.current[upload.id] = upload;
+        }
+        setAttachedFiles(prev => prev.map(f => {
+            const upload = f.id ? uploadProgressRef.current[f.id] : undefined;
+            return upload ? applyUploadState(f, upload) : f;
+        }));
+    }, isAuthenticated);
 
     const triggerFileUpload = () => {
         fileInputRef.current?.click();
@@ -752,7 +731,9 @@ export default function DashboardPage() {
                         const data = JSON.parse(responseText);
                         setAttachedFiles(prev => prev.map(f => {
                             if (f.name === file.name && f.status === 'uploading' && !f.id) {
-                                return { ...f, id: data.file_id, status: 'queued', progress: 0 };
+                                const queued = { ...f, id: data.file_id, status: 'queued', progress: 0 };
+                                const upload = uploadProgressRef.current[data.file_id];
+                                return upload ? applyUploadState(queued, upload) : queued;
                             }
                             return f;
                         }));
@@ -2,6 +2,7 @@ import React, { useState, useEffect, useRef } from 'react';
 import { useSettings } from '@/lib/settings-context';
 import { useTranslation } from '@/lib/use-translation';
 import { useAuth } from '@/lib/auth-context';
+import { useProgressEvents, applyIndexingEvent } from '@/lib/use-progress-events';
 import {
     Users, HardDrive, Database, Server,
     RefreshCw, StopCircle, Check, Loader2, Shield,
@@ -98,33 +99,24 @@ export default function SettingsModal({ isOpen, onClose }: SettingsModalProps) {
             if (res.ok) {
                 const data = await res.json();
                 setDownloadTasks(prev => ({ ...prev, [model.name]: { taskId: data.task_id, status: 'started', progress: 0 } }));
-                pollDownloadStatus(model.name, data.task_id);
             }
         } catch (e) {
             console.error("Download start failed", e);
         }
     };
 
-    const pollDownloadStatus = (modelName: string, taskId: string) => {
-        const interval = setInterval(async () => {
-            try {
-                const res = await fetch(`${API_URL}/api/models/download/${taskId}`, {
-                    headers: { 'Authorization': `Bearer ${localStorage.getItem('access_token')}` }
-                });
-                if (res.ok) {
-                    const status = await res.json();
-                    setDownloadTasks(prev => ({ ...prev, [modelName]: { ...prev[modelName], ...status } }));
-
-                    if (status.status === 'completed' || status.status === 'error') {
-                        clearInterval(interval);
-                        fetchModelFiles(); // Refresh list
-                    }
-                }
-            } catch (e) {
-                clearInterval(interval);
+    // Download progress (and, for admins, indexing status) is pushed by the server
+    useProgressEvents(event => {
+        setNasStatus((prev: any) => applyIndexingEvent(prev, event));
+
+        const tasks = event.type === 'snapshot' ? Object.values(event.downloads || {}) : event.type === 'download' ? [event] : [];
+        for (const task of tasks as any[]) {
+            setDownloadTasks(prev => ({ ...prev, [task.filename]: { ...prev[task.filename], taskId: task.id, ...task } }));
+            if (task.status === 'completed' || task.status === 'error') {
+                fetchModelFiles(); // Refresh list
             }
-        }, 1000);
-    };
+        }
+    }, isOpen);
 
     useEffect(() => {
         if (activeTab === 'models') {
@@ -237,8 +229,6 @@ export default function SettingsModal({ isOpen, onClose }: SettingsModalProps) {
             if (activeTab === 'users') fetchUsers();
             if (activeTab === 'nas' || activeTab === 'indexing') {
                 fetchNASStatus();
-                const interval = setInterval(fetchNASStatus, 2000);
-                return () => clearInterval(interval);
             }
             if (activeTab === 'license' || activeTab === 'updates') {
                 fetchLicenseInfo();
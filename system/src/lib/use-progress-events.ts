@@ -0,0 +1,84 @@
+'use client';
+
+import { useEffect, useRef } from 'react';
+
+const API_URL = process.env.NEXT_PUBLIC_API_URL || '';
+
+// Keep the admin log view bounded, the server keeps the full tail anyway
+const MAX_LOG_LINES = 2000;
+
+export interface ProgressEvent {
+    type: 'snapshot' | 'indexing' | 'indexing_log' | 'upload' | 'download';
+    [key: string]: any;
+}
+
+// Subscribe to /api/events (server-sent events). EventSource can't send the Bearer
+// header, so the stream is read with fetch, the same way the chat stream is.
+export function useProgressEvents(onEvent: (event: ProgressEvent) => void, enabled: boolean = true) {
+    const handlerRef = useRef(onEvent);
+    handlerRef.current = onEvent;
+
+    useEffect(() => {
+        if (!enabled) return;
+        const controller = new AbortController();
+        let retryDelay = 1000;
+
+        const connect = async () => {
+            while (!controller.signal.aborted) {
+                try {
+                    const res = await fetch(`${API_URL}/api/events`, {
+                        headers: { 'Authorization': `Bearer ${localStorage.getItem('access_token')}` },
+                        signal: controller.signal
+                    });
+                    if (!res.ok || !res.body) throw new Error(`HTTP ${res.status}`);
+                    retryDelay = 1000;
+
+                    const reader = res.body.getReader();
+                    const decoder = new TextDecoder();
+                    let buffer = '';
+                    while (true) {
+                        const { done, value } = await reader.read();
+                        if (done) break;
+
+                        buffer += decoder.decode(value, { stream: true });
+                        const messages = buffer.split('\n\n');
+                        buffer = messages.pop() || '';
+
+                        for (const message of messages) {
+                            if (!message.startsWith('data: ')) continue; // keep-alive comment
+                            try {
+                                handlerRef.current(JSON.parse(message.slice(6)));
+                            } catch (e) {
+                                console.error('Bad progress event', e);
+                            }
+                        }
+                    }
+                } catch (e) {
+                    if (controller.signal.aborted) return;
+                    console.error('Progress stream disconnected', e);
+                }
+                // Reconnect (the server resends a full snapshot on connect)
+                await new Promise(resolve => setTimeout(resolve, retryDelay));
+                retryDelay = Math.min(retryDelay * 2, 30000);
+            }
+        };
+        connect();
+
+        return () => controller.abort();
+    }, [enabled]);
+}
+
+// Fold an indexing event into the NAS status object the admin views render
+export function applyIndexingEvent<T extends { indexing_log?: string[] }>(prev: T | null, event: ProgressEvent): T | null {
+    if (event.type === 'snapshot') {
+        return event.indexing ? event.indexing : prev;
+    }
+    if (!prev) return prev;
+    if (event.type === 'indexing') {
+        return { ...prev, ...event.status };
+    }
+    if (event.type === 'indexing_log') {
+        return { ...prev, indexing_log: [...(prev.indexing_log || []), ...event.lines].slice(-MAX_LOG_LINES) };
+    }
+    return prev;
+}
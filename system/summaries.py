@@ -0,0 +1,129 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger("indexer")
+
+# The summary prompt only sees the start of the document
+SUMMARY_PREVIEW_CHARS = 800
+# Cached summaries no indexed file refers to any more are dropped after this long
+SUMMARY_CACHE_DAYS = float(os.environ.get("INDEX_SUMMARY_CACHE_DAYS", "30"))
+
+# summary_queue: files whose content changed and still need a summary (filled by the
+# write stage, drained after the embedding pass so the chat model is loaded once).
+# summary_cache: content hash -> summary, so unchanged, renamed or duplicate files are
+# never summarized twice.
+SUMMARY_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS summary_queue (
+        path TEXT PRIMARY KEY,
+        content_hash TEXT NOT NULL,
+        preview TEXT NOT NULL,
+        queued_at REAL NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS summary_cache (
+        content_hash TEXT PRIMARY KEY,
+        summary TEXT NOT NULL,
+        last_used REAL NOT NULL
+    )
+    ''',
+)
+
+QUEUE_SUMMARY_SQL = "INSERT OR REPLACE INTO summary_queue (path, content_hash, preview, queued_at) VALUES (?, ?, ?, ?)"
+
+
+def create_summary_tables(db_cursor):
+    for statement in SUMMARY_SCHEMA:
+        db_cursor.execute(statement)
+
+
+def pending_summaries(db_conn: sqlite3.Connection) -> int:
+    return db_conn.execute("SELECT COUNT(*) FROM summary_queue").fetchone()[0]
+
+
+def _store(db_conn: sqlite3.Connection, content_hash: str, summary: str, paths: List[str]):
+    db_conn.executemany("UPDATE file_index_state SET summary = ? WHERE path = ? AND content_hash = ?",
+                        [(summary, path, content_hash) for path in paths])
+    db_conn.executemany("DELETE FROM summary_queue WHERE path = ? AND content_hash = ?",
+                        [(path, content_hash) for path in paths])
+
+
+def apply_cached_summaries(db_conn: sqlite3.Connection) -> int:
+    """Resolve queued files whose content was summarized before. Returns the number resolved."""
+    rows = db_conn.execute('''
+        SELECT q.path, q.content_hash, c.summary FROM summary_queue q
+        JOIN summary_cache c ON c.content_hash = q.content_hash
+    ''').fetchall()
+    if not rows:
+        return 0
+    for path, content_hash, summary in rows:
+        _store(db_conn, content_hash, summary, [path])
+    db_conn.executemany("UPDATE summary_cache SET last_used = ? WHERE content_hash = ?",
+                        [(time.time(), content_hash) for content_hash in {row[1] for row in rows}])
+    db_conn.commit()
+    return len(rows)
+
+
+def prune_summary_cache(db_conn: sqlite3.Connection):
+    cutoff = time.time() - SUMMARY_CACHE_DAYS * 86400
+    db_conn.execute('''
+        DELETE FROM summary_cache WHERE last_used < ? AND content_hash NOT IN
+            (SELECT content_hash FROM file_index_state WHERE content_hash IS NOT NULL)
+    ''', (cutoff,))
+    db_conn.commit()
+
+
+def summarize_pending(db_conn: sqlite3.Connection, load_model: Callable[[], Any],
+                      summarize: Callable[[Any, str], str], stop_event: Optional[threading.Event] = None,
+                      on_progress: Optional[Callable[[int, int], None]] = None) -> int:
+    """
+    Second indexing phase: summarize every queued file with one resident chat model.
+    Cache hits are applied without loading the model; files with identical content are
+    summarized once. Files left in the queue (stop, model missing) are picked up by the
+    next pass. Returns the number of files that got a summary.
+    """
+    resolved = apply_cached_summaries(db_conn)
+    rows = db_conn.execute("SELECT path, content_hash, preview FROM summary_queue ORDER BY queued_at").fetchall()
+    if not rows:
+        return resolved
+
+    by_hash: Dict[str, List[str]] = {}
+    previews: Dict[str, str] = {}
+    for path, content_hash, preview in rows:
+        by_hash.setdefault(content_hash, []).append(path)
+        previews.setdefault(content_hash, preview)
+
+    llm = load_model()
+    if llm is None:
+        logger.warning(f"No chat model available, {len(rows)} summaries stay queued")
+        return resolved
+
+    done = 0
+    for content_hash, paths in by_hash.items():
+        if stop_event is not None and stop_event.is_set():
+            break
+        try:
+            summary = summarize(llm, previews[content_hash])
+        except Exception as e:
+            # Not cached, so the file is summarized again once its content changes
+            logger.error(f"Summarization error ({paths[0]}): {e}")
+            db_conn.executemany("DELETE FROM summary_queue WHERE path = ? AND content_hash = ?",
+                                [(path, content_hash) for path in paths])
+            continue
+        db_conn.execute("INSERT OR REPLACE INTO summary_cache (content_hash, summary, last_used) VALUES (?, ?, ?)",
+                        (content_hash, summary, time.time()))
+        _store(db_conn, content_hash, summary, paths)
+        # A summary takes seconds, a commit each is cheap and keeps the DB free for status writes
+        db_conn.commit()
+        resolved += len(paths)
+        done += 1
+        if on_progress:
+            on_progress(done, len(by_hash))
+    db_conn.commit()
+    prune_summary_cache(db_conn)
+    return resolved
@@ -0,0 +1,73 @@
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+import duplicates
+from duplicates import reconcile_duplicates
+from scanner import FILE_STATE_SCHEMA, DIR_STATE_SCHEMA, CHECKPOINT_SCHEMA, FORGOTTEN_MTIME
+
+MTIME = 1700000000.0
+
+
+class FakeCollection:
+    def __init__(self):
+        self.layout = SimpleNamespace(base="documents")
+        self.deleted = []
+
+    def delete_paths(self, paths):
+        self.deleted.extend(paths)
+
+
+@pytest.fixture
+def db_conn(monkeypatch):
+    monkeypatch.setattr(duplicates, "get_keyword_index", lambda: None)
+    # file_index_state as backend.init_db creates it (NOT NULL modified_time), upgraded by the indexer
+    db_conn = sqlite3.connect(":memory:")
+    db_conn.execute(FILE_STATE_SCHEMA)
+    for column in ("summary", "content_hash", "duplicate_of"):
+        db_conn.execute(f"ALTER TABLE file_index_state ADD COLUMN {column} TEXT")
+    db_conn.execute("CREATE TABLE chunk_index_state (chunk_id TEXT PRIMARY KEY, path TEXT NOT NULL, "
+                    "chunk_index INTEGER NOT NULL, chunk_hash TEXT NOT NULL)")
+    db_conn.execute("CREATE TABLE settings (key TEXT PRIMARY KEY, value TEXT)")
+    db_conn.execute(DIR_STATE_SCHEMA)
+    db_conn.execute(CHECKPOINT_SCHEMA)
+    return db_conn
+
+
+def add_file(db_conn, path, content_hash, duplicate_of=None, chunks=0):
+    db_conn.execute("INSERT INTO file_index_state (path, modified_time, last_seen, content_hash, duplicate_of) "
+                    "VALUES (?, ?, ?, ?, ?)", (path, MTIME, MTIME, content_hash, duplicate_of))
+    db_conn.executemany("INSERT INTO chunk_index_state (chunk_id, path, chunk_index, chunk_hash) VALUES (?, ?, ?, ?)",
+                        [(f"{path}#{i}", path, i, content_hash) for i in range(chunks)])
+
+
+def state(db_conn, path):
+    return db_conn.execute("SELECT modified_time, content_hash, duplicate_of FROM file_index_state WHERE path = ?",
+                           (path,)).fetchone()
+
+
+def test_copy_of_deleted_original_is_forgotten(db_conn):
+    add_file(db_conn, "/root/a/report.txt", "h1", chunks=2)
+    add_file(db_conn, "/root/b/report.txt", "h1", duplicate_of="/root/a/report.txt")
+    db_conn.execute("INSERT INTO dir_index_state (path, mtime, entry_count, subdirs, last_listed) VALUES (?, ?, 1, '[]', ?)",
+                    ("/root/b", MTIME, MTIME))
+    db_conn.execute("DELETE FROM file_index_state WHERE path = '/root/a/report.txt'")
+
+    orphans = reconcile_duplicates(db_conn, FakeCollection(), "/root")
+
+    assert orphans == ["/root/b/report.txt"]
+    assert state(db_conn, "/root/b/report.txt") == (FORGOTTEN_MTIME, None, None)
+    assert db_conn.execute("SELECT mtime FROM dir_index_state WHERE path = '/root/b'").fetchone() == (None,)
+
+
+def test_identical_originals_are_merged(db_conn):
+    add_file(db_conn, "/root/a.txt", "h1", chunks=2)
+    add_file(db_conn, "/root/b.txt", "h1", chunks=2)
+    collection = FakeCollection()
+
+    assert reconcile_duplicates(db_conn, collection, "/root") == []
+
+    assert collection.deleted == ["/root/b.txt"]
+    assert state(db_conn, "/root/b.txt") == (MTIME, "h1", "/root/a.txt")
+    assert db_conn.execute("SELECT COUNT(*) FROM chunk_index_state WHERE path = '/root/b.txt'").fetchone() == (0,)
@@ -0,0 +1,46 @@
+import importlib
+
+import pytest
+
+import splitter
+
+
+class WordTokenizer:
+    """Stands in for a vocab-only llama_cpp.Llama: one token per word"""
+    def __init__(self, model_path, vocab_only=False, verbose=False):
+        self.model_path = model_path
+
+    def tokenize(self, text: bytes, add_bos=True, special=False):
+        return text.split()
+
+
+@pytest.fixture
+def indexer(tmp_path, monkeypatch):
+    # indexer logs to logs/indexing.log relative to the working directory
+    (tmp_path / "logs").mkdir()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(splitter, "Llama", WordTokenizer)
+    monkeypatch.setattr(splitter, "CHUNK_MODE", "tokens")
+    # Only the pool initializer may hand the tokenizer to the workers
+    monkeypatch.setattr(splitter, "_tokenizer_path", None)
+    module = importlib.import_module("indexer")
+    monkeypatch.setattr(module, "EXTRACT_WORKERS", 2)
+    module.shutdown_extract_pool()
+    yield module
+    module.shutdown_extract_pool()
+
+
+def test_worker_chunks_are_token_sized(indexer, tmp_path):
+    model = tmp_path / "embed.gguf"
+    model.write_bytes(b"")
+    document = tmp_path / "doc.txt"
+    document.write_text(" ".join(f"word{i}" for i in range(3000)))
+
+    pool = indexer.get_extract_pool(model)
+    result = pool.submit(indexer.extract_document, str(document), document.stat().st_size).result()
+
+    chunks = result["chunks"]
+    assert len(chunks) > 1
+    assert all(len(chunk.split()) <= splitter.CHUNK_TOKENS for chunk in chunks)
+    # Character-sized chunks would stop at CHUNK_SIZE characters
+    assert max(len(chunk) for chunk in chunks) > splitter.CHUNK_SIZE
@@ -0,0 +1,37 @@
+import sqlite3
+
+import pytest
+
+from scanner import FILE_STATE_SCHEMA, FORGOTTEN_MTIME, forget_files
+
+
+def backend_state_db() -> sqlite3.Connection:
+    """file_index_state as backend.init_db creates it, upgraded by the indexer"""
+    db_conn = sqlite3.connect(":memory:")
+    db_conn.execute(FILE_STATE_SCHEMA)
+    for column in ("summary", "content_hash", "duplicate_of"):
+        db_conn.execute(f"ALTER TABLE file_index_state ADD COLUMN {column} TEXT")
+    return db_conn
+
+
+def test_modified_time_is_not_null():
+    db_conn = backend_state_db()
+    db_conn.execute("INSERT INTO file_index_state (path, modified_time, last_seen) VALUES ('/a.txt', 1.0, 1.0)")
+    with pytest.raises(sqlite3.IntegrityError):
+        db_conn.execute("UPDATE file_index_state SET modified_time = NULL")
+
+
+def test_forget_files_after_failed_write():
+    db_conn = backend_state_db()
+    db_conn.executemany(
+        "INSERT INTO file_index_state (path, modified_time, last_seen, content_hash, duplicate_of) VALUES (?, ?, ?, ?, ?)",
+        [("/a.txt", 1700000000.0, 1.0, "h1", None), ("/b.txt", 1700000000.0, 1.0, "h1", "/a.txt"),
+         ("/c.txt", 1700000000.0, 1.0, "h2", None)])
+
+    forget_files(db_conn, ["/a.txt", "/b.txt"])
+
+    rows = dict((path, rest) for path, *rest in db_conn.execute(
+        "SELECT path, modified_time, content_hash, duplicate_of FROM file_index_state"))
+    assert rows["/a.txt"] == [FORGOTTEN_MTIME, None, None]
+    assert rows["/b.txt"] == [FORGOTTEN_MTIME, None, None]
+    assert rows["/c.txt"] == [1700000000.0, "h2", None]
@@ -0,0 +1,506 @@
+import os
+import re
+import json
+import shutil
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import chromadb
+except ImportError:
+    chromadb = None
+
+logger = logging.getLogger("indexer")
+
+# Vector store behind every collection call site (backend and indexer):
+#   chroma  chromadb.PersistentClient
+#   native  NativeVectorStore below: float16 vectors in memory-mapped files plus a SQLite
+#           metadata table per collection. Opens without loading vectors into RAM (the
+#           page cache holds whatever searches touch) and has no background services.
+# Switching re-indexes the storage roots (see indexer.apply_shard_layout).
+VECTOR_STORE = os.environ.get("VECTOR_STORE", "chroma").strip().lower()
+# Native search: "auto" switches a collection to an IVF index once it holds
+# NATIVE_IVF_MIN_ROWS vectors (exact scan below that), "exact" always scans everything
+NATIVE_SEARCH = os.environ.get("VECTOR_NATIVE_SEARCH", "auto").strip().lower()
+NATIVE_IVF_MIN_ROWS = int(os.environ.get("VECTOR_NATIVE_IVF_MIN_ROWS", "50000"))
+# IVF lists scanned per query; a collection has about sqrt(rows)/2 lists (at most 1024)
+NATIVE_IVF_PROBES = int(os.environ.get("VECTOR_NATIVE_IVF_PROBES", "16"))
+NATIVE_IVF_ITERATIONS = 8
+_SCAN_BLOCK = 8192  # Vectors converted to float32 per step of a scan
+_MIN_CAPACITY = 4096
+# settings key holding the store the collections of a base name were built with
+STORE_KEY = "vector_store:{base}"
+
+_COLLECTION_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{1,61}[A-Za-z0-9]$")
+_METADATA_KEY = re.compile(r"^[A-Za-z0-9_]+$")
+_COMPARISONS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+_NATIVE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+    CREATE TABLE IF NOT EXISTS rows (
+        slot INTEGER PRIMARY KEY,
+        id TEXT NOT NULL UNIQUE,
+        document TEXT,
+        metadata TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_rows_path ON rows (json_extract(metadata, '$.path'));
+    CREATE TABLE IF NOT EXISTS free_slots (slot INTEGER PRIMARY KEY);
+'''
+
+
+def _where_sql(where: Dict[str, Any]) -> Tuple[str, list]:
+    """Chroma-style metadata filter ($eq/$ne/$gt/$gte/$lt/$lte/$in/$nin, $and/$or) as SQL"""
+    clauses, args = [], []
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            parts = [_where_sql(part) for part in condition]
+            clauses.append("(" + f" {key[1:].upper()} ".join(sql for sql, _ in parts) + ")")
+            args += [arg for _, part_args in parts for arg in part_args]
+            continue
+        if not _METADATA_KEY.match(key):
+            raise ValueError(f"Unsupported metadata key in where filter: {key!r}")
+        field = f"json_extract(metadata, '$.{key}')"
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op, value in condition.items():
+            if op in ("$in", "$nin"):
+                values = list(value)
+                if not values:
+                    clauses.append("0" if op == "$in" else "1")
+                    continue
+                clauses.append(f"{field} {'IN' if op == '$in' else 'NOT IN'} ({','.join('?' * len(values))})")
+                args += values
+            elif op in _COMPARISONS:
+                clauses.append(f"{field} {_COMPARISONS[op]} ?")
+                args.append(value)
+            else:
+                raise ValueError(f"Unsupported where operator: {op}")
+    return (" AND ".join(clauses) or "1"), args
+
+
+def _nearest(x, centroids, centroid_norms):
+    """Index of the nearest centroid (L2) for every row of x"""
+    out = np.empty(len(x), dtype=np.int32)
+    for start in range(0, len(x), 4096):
+        block = x[start:start + 4096]
+        out[start:start + len(block)] = np.argmin(centroid_norms - 2 * (block @ centroids.T), axis=1)
+    return out
+
+
+def _top_k(distances, slots, best_d, best_s, k: int):
+    distances = np.concatenate((best_d, distances))
+    slots = np.concatenate((best_s, slots))
+    if len(distances) > k:
+        keep = np.argpartition(distances, k - 1)[:k]
+        distances, slots = distances[keep], slots[keep]
+    return distances, slots
+
+
+class NativeCollection:
+    """
+    One collection of the native store. Slot i of vectors.f16 / norms.f32 / live.u8 /
+    lists.i32 holds the vector, squared norm, liveness and IVF list of the row with
+    slot i in meta.db. Files grow by doubling; freed slots are reused. Writes take the
+    SQLite write lock (BEGIN IMMEDIATE), so the backend and the indexer can both write;
+    readers in other processes see new rows through the shared mappings and pick up
+    growth or a retrained IVF index from the info table before every search.
+    Distances are squared L2, like Chroma's default space.
+    """
+    def __init__(self, path: Path, name: str, embedding_function=None):
+        self.path = path
+        self.name = name
+        self.embedding_function = embedding_function
+        self.lock = threading.RLock()
+        path.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(path / "meta.db"), timeout=60, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(_NATIVE_SCHEMA)
+        # Identity of this meta.db: another process may delete and recreate the collection
+        self.ino = os.stat(path / "meta.db").st_ino
+        self.dim = 0
+        self.capacity = 0
+        self.high = 0  # Slots in use or freed (the scanned range)
+        self.ivf_version = 0
+        self.vectors = self.norms = self.live = self.lists = None
+        self.centroids = self.centroid_norms = None
+        self._refresh()
+
+    # -- files --
+    def _info(self) -> Dict[str, str]:
+        return dict(self.db.execute("SELECT key, value FROM info").fetchall())
+
+    def _map(self, filename: str, dtype, width: int = 0):
+        file = self.path / filename
+        size = self.capacity * max(width, 1) * np.dtype(dtype).itemsize
+        if not file.exists() or file.stat().st_size < size:
+            with open(file, "r+b" if file.exists() else "w+b") as f:
+                f.truncate(size)
+        shape = (self.capacity, width) if width else (self.capacity,)
+        return np.memmap(file, dtype=dtype, mode="r+", shape=shape)
+
+    def _refresh(self, info: Optional[Dict[str, str]] = None):
+        """Follow changes made by other processes (or another collection object)"""
+        info = info if info is not None else self._info()
+        dim, capacity = int(info.get("dim", 0)), int(info.get("capacity", 0))
+        self.high = int(info.get("high", 0))
+        if (dim, capacity) != (self.dim, self.capacity):
+            self.dim, self.capacity = dim, capacity
+            if dim and capacity:
+                self.vectors = self._map("vectors.f16", np.float16, dim)
+                self.norms = self._map("norms.f32", np.float32)
+                self.live = self._map("live.u8", np.uint8)
+                self.lists = self._map("lists.i32", np.int32)
+        ivf_version = int(info.get("ivf", 0))
+        if ivf_version != self.ivf_version:
+            self.ivf_version = ivf_version
+            if ivf_version:
+                self.centroids = np.load(self.path / "centroids.npy")
+                self.centroid_norms = (self.centroids * self.centroids).sum(axis=1)
+            else:
+                self.centroids = self.centroid_norms = None
+
+    def _set_info(self, **values):
+        self.db.executemany("INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)",
+                            [(key, str(value)) for key, value in values.items()])
+
+    @contextmanager
+    def _write(self):
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self._refresh()
+                yield
+                # Vectors reach the disk before the rows that point at them
+                if self.vectors is not None:
+                    for mapped in (self.vectors, self.norms, self.lists, self.live):
+                        mapped.flush()
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def _allocate(self, count: int) -> List[int]:
+        free = [row[0] for row in self.db.execute("SELECT slot FROM free_slots ORDER BY slot LIMIT ?", (count,))]
+        self.db.executemany("DELETE FROM free_slots WHERE slot = ?", [(slot,) for slot in free])
+        new = list(range(self.high, self.high + count - len(free)))
+        self.high += len(new)
+        if self.high > self.capacity:
+            self._set_info(capacity=max(self.high, 2 * self.capacity, _MIN_CAPACITY))
+        self._set_info(high=self.high)
+        self._refresh()
+        return free + new
+
+    def _slots(self, ids: Sequence[str]) -> Dict[str, int]:
+        found = {}
+        ids = list(ids)
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            found.update(self.db.execute(f"SELECT id, slot FROM rows WHERE id IN ({','.join('?' * len(batch))})", batch))
+        return found
+
+    # -- writes --
+    def upsert(self, ids: Sequence[str], embeddings=None, metadatas=None, documents=None):
+        ids = list(ids)
+        if not ids:
+            return
+        if embeddings is None:
+            if self.embedding_function is None or documents is None:
+                raise ValueError("upsert needs embeddings, or documents and an embedding function")
+            embeddings = self.embedding_function(list(documents))
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(ids):
+            raise ValueError(f"Expected {len(ids)} embeddings, got shape {vectors.shape}")
+        documents = list(documents) if documents is not None else [None] * len(ids)
+        metadatas = list(metadatas) if metadatas is not None else [None] * len(ids)
+
+        with self._write():
+            if not self.dim:
+                self._set_info(dim=vectors.shape[1])
+                self._refresh()
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match collection dimensionality {self.dim}")
+            # The last occurrence of an id wins
+            positions = {chunk_id: j for j, chunk_id in enumerate(ids)}
+            slots = self._slots(positions)
+            missing = [chunk_id for chunk_id in positions if chunk_id not in slots]
+            slots.update(zip(missing, self._allocate(len(missing))))
+            order = list(positions.values())
+            target = np.array([slots[ids[j]] for j in order], dtype=np.int64)
+            rows = vectors[order]
+            self.vectors[target] = rows.astype(np.float16)
+            # Norms of the stored (float16) vectors, so distances stay consistent
+            stored = self.vectors[target].astype(np.float32)
+            self.norms[target] = (stored * stored).sum(axis=1)
+            if self.centroids is not None:
+                self.lists[target] = _nearest(stored, self.centroids, self.centroid_norms)
+            self.live[target] = 1
+            self.db.executemany("INSERT OR REPLACE INTO rows (slot, id, document, metadata) VALUES (?, ?, ?, ?)",
+                                [(slots[ids[j]], ids[j], documents[j], json.dumps(metadatas[j] or {}, ensure_ascii=False))
+                                 for j in order])
+            self._maybe_train()
+
+    # Chroma's add raises on existing ids; every caller here writes fresh or replacing ids
+    add = upsert
+
+    def update(self, ids: Sequence[str], embeddings=None, metadatas=None, documents=None):
+        ids = list(ids)
+        if embeddings is not None:
+            # Replaces the vectors; rows keep their stored metadata/document unless given
+            current = self.get(ids=ids, include=["metadatas", "documents"])
+            known = {chunk_id: j for j, chunk_id in enumerate(current["ids"])}
+            keep = [i for i, chunk_id in enumerate(ids) if chunk_id in known]
+            self.upsert([ids[i] for i in keep], [embeddings[i] for i in keep],
+                        [metadatas[i] if metadatas is not None else current["metadatas"][known[ids[i]]] for i in keep],
+                        [documents[i] if documents is not None else current["documents"][known[ids[i]]] for i in keep])
+            return
+        with self._write():
+            if metadatas is not None:
+                self.db.executemany("UPDATE rows SET metadata = ? WHERE id = ?",
+                                    [(json.dumps(m or {}, ensure_ascii=False), chunk_id) for chunk_id, m in zip(ids, metadatas)])
+            if documents is not None:
+                self.db.executemany("UPDATE rows SET document = ? WHERE id = ?", list(zip(documents, ids)))
+
+    def delete(self, ids: Optional[Sequence[str]] = None, where: Optional[Dict[str, Any]] = None):
+        if ids is None and not where:
+            raise ValueError("delete needs ids or a where filter")
+        with self._write():
+            slots = [row[0] for row in self._select("slot", ids, where)]
+            if not slots:
+                return
+            self.live[np.array(slots, dtype=np.int64)] = 0
+            self.db.executemany("DELETE FROM rows WHERE slot = ?", [(slot,) for slot in slots])
+            self.db.executemany("INSERT OR IGNORE INTO free_slots (slot) VALUES (?)", [(slot,) for slot in slots])
+
+    # -- IVF --
+    def _maybe_train(self):
+        # Caller holds the write transaction
+        if NATIVE_SEARCH != "auto":
+            return
+        rows = self.db.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+        trained_rows = int(self._info().get("ivf_rows", 0))
+        if rows >= NATIVE_IVF_MIN_ROWS and rows >= 2 * trained_rows:
+            self._train(rows)
+
+    def _train(self, rows: int):
+        """k-means centroids from a sample, then every slot is assigned to its nearest list"""
+        nlist = int(min(1024, max(16, np.sqrt(rows) / 2)))
+        rng = np.random.default_rng(0)
+        live_slots = np.flatnonzero(self.live[:self.high])
+        sample = np.sort(rng.choice(live_slots, size=min(len(live_slots), nlist * 32), replace=False))
+        x = self.vectors[sample].astype(np.float32)
+        centroids = x[rng.choice(len(x), nlist, replace=False)].copy()
+        for _ in range(NATIVE_IVF_ITERATIONS):
+            assign = _nearest(x, centroids, (centroids * centroids).sum(axis=1))
+            order = np.argsort(assign, kind="stable")
+            lists, starts = np.unique(assign[order], return_index=True)
+            sums = np.add.reduceat(x[order], starts, axis=0)
+            counts = np.diff(np.append(starts, len(order)))
+            centroids[lists] = sums / counts[:, None]
+        centroid_norms = (centroids * centroids).sum(axis=1)
+        for start in range(0, self.high, _SCAN_BLOCK):
+            end = min(start + _SCAN_BLOCK, self.high)
+            self.lists[start:end] = _nearest(self.vectors[start:end].astype(np.float32), centroids, centroid_norms)
+        tmp = self.path / "centroids.tmp.npy"
+        np.save(tmp, centroids)
+        os.replace(tmp, self.path / "centroids.npy")
+        self._set_info(ivf=self.ivf_version + 1, ivf_rows=rows)
+        self._refresh()
+        logger.info(f"Vector store {self.name}: IVF index with {nlist} lists over {rows} vectors")
+
+    # -- reads --
+    def _select(self, columns: str, ids=None, where=None, limit: Optional[int] = None, offset: Optional[int] = None):
+        where_sql, args = _where_sql(where) if where else ("1", [])
+        if ids is None:
+            sql = f"SELECT {columns} FROM rows WHERE {where_sql} ORDER BY slot"
+            if limit is not None or offset:
+                sql += f" LIMIT {int(limit) if limit is not None else -1} OFFSET {int(offset or 0)}"
+            return self.db.execute(sql, args).fetchall()
+        ids = list(ids)
+        rows = []
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            rows += self.db.execute(f"SELECT {columns} FROM rows WHERE id IN ({','.join('?' * len(batch))}) AND {where_sql}",
+                                    batch + args).fetchall()
+        start = int(offset or 0)
+        return rows[start:start + limit if limit is not None else None]
+
+    def _result(self, rows, include, nested: bool = False) -> Dict[str, Any]:
+        wrap = (lambda values: [values]) if nested else (lambda values: values)
+        result = {"ids": wrap([row[1] for row in rows]), "embeddings": None, "documents": None, "metadatas": None}
+        if "documents" in include:
+            result["documents"] = wrap([row[2] for row in rows])
+        if "metadatas" in include:
+            result["metadatas"] = wrap([json.loads(row[3]) for row in rows])
+        if "embeddings" in include:
+            slots = np.array([row[0] for row in rows], dtype=np.int64)
+            result["embeddings"] = wrap(self.vectors[slots].astype(np.float32).tolist() if len(slots) else [])
+        return result
+
+    def get(self, ids: Optional[Sequence[str]] = None, where: Optional[Dict[str, Any]] = None,
+            limit: Optional[int] = None, offset: Optional[int] = None, include=("metadatas", "documents")) -> Dict[str, Any]:
+        with self.lock:
+            self._refresh()
+            return self._result(self._select("slot, id, document, metadata", ids, where, limit, offset), include)
+
+    def count(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+
+    def _search(self, query, k: int, allowed=None):
+        """(slots, squared L2 distances) of the k nearest live vectors, nearest first"""
+        best_d, best_s = np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+        if self.vectors is None or not self.high or k <= 0:
+            return best_s, best_d
+        if query.shape != (self.dim,):
+            raise ValueError(f"Query dimension {query.shape[-1]} does not match collection dimensionality {self.dim}")
+        query_norm = float(query @ query)
+        candidates = allowed
+        if candidates is None and self.centroids is not None and NATIVE_SEARCH == "auto":
+            probes = min(NATIVE_IVF_PROBES, len(self.centroids))
+            centroid_d = self.centroid_norms - 2 * (self.centroids @ query)
+            lists = np.argpartition(centroid_d, probes - 1)[:probes]
+            candidates = np.flatnonzero(np.isin(self.lists[:self.high], lists) & (self.live[:self.high] == 1))
+
+        if candidates is None:
+            for start in range(0, self.high, _SCAN_BLOCK):
+                end = min(start + _SCAN_BLOCK, self.high)
+                d = self.norms[start:end] - 2 * (self.vectors[start:end].astype(np.float32) @ query) + query_norm
+                d[self.live[start:end] == 0] = np.inf
+                best_d, best_s = _top_k(d, np.arange(start, end, dtype=np.int64), best_d, best_s, k)
+        else:
+            for start in range(0, len(candidates), _SCAN_BLOCK):
+                slots = np.asarray(candidates[start:start + _SCAN_BLOCK], dtype=np.int64)
+                d = self.norms[slots] - 2 * (self.vectors[slots].astype(np.float32) @ query) + query_norm
+                d[self.live[slots] == 0] = np.inf
+                best_d, best_s = _top_k(d, slots, best_d, best_s, k)
+        order = np.argsort(best_d, kind="stable")
+        best_d, best_s = best_d[order], best_s[order]
+        found = np.isfinite(best_d)
+        return best_s[found], np.maximum(best_d[found], 0.0)
+
+    def query(self, query_embeddings=None, n_results: int = 10, where: Optional[Dict[str, Any]] = None,
+              include=("metadatas", "documents", "distances"), query_texts=None) -> Dict[str, Any]:
+        if query_embeddings is None:
+            if self.embedding_function is None or query_texts is None:
+                raise ValueError("query needs query_embeddings, or query_texts and an embedding function")
+            query_embeddings = self.embedding_function(list(query_texts))
+        result = {"ids": [], "embeddings": None, "documents": None, "metadatas": None, "distances": None}
+        for key in ("documents", "metadatas", "distances", "embeddings"):
+            if key in include:
+                result[key] = []
+        with self.lock:
+            self._refresh()
+            allowed = None
+            if where:
+                allowed = np.array([row[0] for row in self._select("slot", where=where)], dtype=np.int64)
+            for query in query_embeddings:
+                slots, distances = self._search(np.asarray(query, dtype=np.float32), n_results, allowed)
+                rows = {}
+                slot_list = [int(slot) for slot in slots]
+                for i in range(0, len(slot_list), 500):
+                    batch = slot_list[i:i + 500]
+                    rows.update((row[0], row) for row in self.db.execute(
+                        f"SELECT slot, id, document, metadata FROM rows WHERE slot IN ({','.join('?' * len(batch))})", batch))
+                # A slot freed by a concurrent delete since the scan has no row any more
+                hits = [(rows[slot], float(d)) for slot, d in zip(slot_list, distances) if slot in rows]
+                one = self._result([row for row, _ in hits], include)
+                result["ids"].append(one["ids"])
+                for key in ("documents", "metadatas", "embeddings"):
+                    if result[key] is not None:
+                        result[key].append(one[key])
+                if result["distances"] is not None:
+                    result["distances"].append([d for _, d in hits])
+        return result
+
+    def close(self):
+        with self.lock:
+            for mapped in (self.vectors, self.norms, self.live, self.lists):
+                if mapped is not None:
+                    mapped.flush()
+            self.vectors = self.norms = self.live = self.lists = None
+            self.db.close()
+
+
+class NativeVectorStore:
+    """chromadb.PersistentClient stand-in over NativeCollection (the part of the client API this app uses)"""
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.collections: Dict[str, NativeCollection] = {}
+        self.lock = threading.Lock()
+
+    def _exists(self, name: str) -> bool:
+        return (self.path / name / "meta.db").exists()
+
+    def _ino(self, name: str) -> Optional[int]:
+        try:
+            return os.stat(self.path / name / "meta.db").st_ino
+        except FileNotFoundError:
+            return None
+
+    def _open(self, name: str, embedding_function=None) -> NativeCollection:
+        with self.lock:
+            collection = self.collections.get(name)
+            # Deleted (and maybe recreated) by another process since it was opened
+            if collection is not None and self._ino(name) != collection.ino:
+                collection.close()
+                collection = None
+            if collection is None:
+                if not _COLLECTION_NAME.match(name):
+                    raise ValueError(f"Invalid collection name: {name!r}")
+                collection = self.collections[name] = NativeCollection(self.path / name, name, embedding_function)
+            elif embedding_function is not None:
+                collection.embedding_function = embedding_function
+            return collection
+
+    def get_or_create_collection(self, name: str, embedding_function=None, metadata=None) -> NativeCollection:
+        return self._open(name, embedding_function)
+
+    def get_collection(self, name: str, embedding_function=None) -> NativeCollection:
+        if not self._exists(name):
+            raise ValueError(f"Collection {name} does not exist.")
+        return self._open(name, embedding_function)
+
+    def list_collections(self) -> List[NativeCollection]:
+        return [self._open(entry.name) for entry in sorted(self.path.iterdir(), key=lambda p: p.name)
+                if entry.is_dir() and (entry / "meta.db").exists()]
+
+    def delete_collection(self, name: str):
+        if not self._exists(name):
+            raise ValueError(f"Collection {name} does not exist.")
+        with self.lock:
+            collection = self.collections.pop(name, None)
+            if collection is not None:
+                collection.close()
+            shutil.rmtree(self.path / name)
+
+
+_native_stores: Dict[str, NativeVectorStore] = {}
+_native_stores_lock = threading.Lock()
+
+
+def open_vector_store(path: Path, store: str = VECTOR_STORE):
+    """Client of the configured store for the data directory `path`"""
+    if store == "native":
+        if np is None:
+            raise RuntimeError("VECTOR_STORE=native needs numpy")
+        # One instance per process, so the mappings are opened once
+        with _native_stores_lock:
+            client = _native_stores.get(str(path))
+            if client is None:
+                client = _native_stores[str(path)] = NativeVectorStore(Path(path) / "native")
+            return client
+    if store == "chroma":
+        if chromadb is None:
+            raise RuntimeError("chromadb is not installed")
+        return chromadb.PersistentClient(path=str(path))
+    raise ValueError(f"Invalid VECTOR_STORE {store!r} (expected chroma or native)")
@@ -0,0 +1,232 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set
+
+logger = logging.getLogger("indexer")
+
+# Chroma writes are coalesced and handed to a writer thread once a batch holds this many
+# rows or bytes (the row target adapts, see WRITE_TARGET_SECONDS) ...
+WRITE_BATCH_ROWS = int(os.environ.get("INDEX_WRITE_BATCH_ROWS", "2000"))
+WRITE_BATCH_BYTES = int(os.environ.get("INDEX_WRITE_BATCH_BYTES", str(16 * 1024 * 1024)))
+# ... or once its oldest write has waited this long
+WRITE_FLUSH_SECONDS = float(os.environ.get("INDEX_WRITE_FLUSH_SECONDS", "2"))
+# Bytes buffered or being written before the producer blocks (backpressure on the embedder)
+WRITE_MAX_PENDING_BYTES = int(os.environ.get("INDEX_WRITE_MAX_PENDING_BYTES", str(4 * WRITE_BATCH_BYTES)))
+# Batches are sized to take about this long to write, so a barrier (sync) never waits long
+WRITE_TARGET_SECONDS = 1.0
+WRITE_MIN_ROWS = 64
+_ROW_OVERHEAD = 256  # Rough per-row cost of ids/metadata in bytes
+
+
+class _Batch:
+    """Pending writes to one collection, applied as deletes, then updates, then upserts"""
+    __slots__ = ("collection", "delete_paths", "delete_ids", "update_ids", "update_metadatas",
+                 "ids", "documents", "metadatas", "embeddings", "paths")
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.delete_paths: List[str] = []
+        self.delete_ids: List[str] = []
+        self.update_ids: List[str] = []
+        self.update_metadatas: List[Dict[str, Any]] = []
+        self.ids: List[str] = []
+        self.documents: List[str] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        self.embeddings: List[List[float]] = []
+        self.paths: Set[str] = set()
+
+
+class ChromaWriteBatcher:
+    """
+    Background writer for the indexing pipeline's Chroma writes. Per-file deletes, metadata
+    updates and chunk upserts are merged into a few large calls per collection and written
+    on a separate thread, so embedding continues while SQLite/HNSW persist. A file's
+    writes never straddle a batch boundary out of order: a delete for a file that already
+    has writes in the open batch seals that batch first.
+    """
+    def __init__(self, batch_rows: int = WRITE_BATCH_ROWS, batch_bytes: int = WRITE_BATCH_BYTES,
+                 flush_seconds: float = WRITE_FLUSH_SECONDS, max_pending_bytes: int = WRITE_MAX_PENDING_BYTES):
+        self.batch_rows = batch_rows
+        self.batch_bytes = batch_bytes
+        self.flush_seconds = flush_seconds
+        self.max_pending_bytes = max_pending_bytes
+        self.target_rows = batch_rows
+
+        self.cond = threading.Condition()
+        self.open: Dict[int, _Batch] = {}
+        self.open_paths: Set[str] = set()
+        self.open_rows = 0
+        self.open_bytes = 0
+        self.open_since: Optional[float] = None
+        self.sealed: Deque[tuple] = deque()  # (batches, bytes)
+        self.pending_bytes = 0  # open + sealed + being written
+        self.writing = False
+        self.closed = False
+        self.failed_paths: Set[str] = set()
+
+        self.batches_written = 0
+        self.rows_written = 0
+        self.write_seconds = 0.0
+        self.last_write_ms = 0.0
+        self.max_write_ms = 0.0
+        self.blocked_seconds = 0.0
+
+        self.thread = threading.Thread(target=self._run, name="index-chroma-writer", daemon=True)
+        self.thread.start()
+
+    # -- producer side (write stage) --
+    def _batch(self, collection) -> _Batch:
+        batch = self.open.get(id(collection))
+        if batch is None:
+            batch = self.open[id(collection)] = _Batch(collection)
+        return batch
+
+    def _add(self, collection, path: str, rows: int, nbytes: int, is_delete: bool, apply):
+        with self.cond:
+            if self.pending_bytes >= self.max_pending_bytes and not self.closed:
+                # Hand the open batch over now instead of waiting for it to fill up or age
+                self._seal()
+                self.cond.notify_all()
+                t0 = time.perf_counter()
+                while self.pending_bytes >= self.max_pending_bytes and not self.closed:
+                    self.cond.wait(timeout=0.5)
+                self.blocked_seconds += time.perf_counter() - t0
+            if is_delete and path in self.open_paths:
+                self._seal()
+            batch = self._batch(collection)
+            apply(batch)
+            batch.paths.add(path)
+            self.open_paths.add(path)
+            self.open_rows += rows
+            self.open_bytes += nbytes
+            self.pending_bytes += nbytes
+            if self.open_since is None:
+                self.open_since = time.monotonic()
+            if self.open_rows >= self.target_rows or self.open_bytes >= self.batch_bytes:
+                self._seal()
+            self.cond.notify_all()
+
+    def delete_path(self, collection, path: str):
+        self._add(collection, path, 1, _ROW_OVERHEAD, True, lambda b: b.delete_paths.append(path))
+
+    def delete_ids(self, collection, path: str, ids: List[str]):
+        self._add(collection, path, len(ids), _ROW_OVERHEAD * len(ids), True, lambda b: b.delete_ids.extend(ids))
+
+    def update(self, collection, path: str, ids: List[str], metadatas: List[Dict[str, Any]]):
+        def apply(batch):
+            batch.update_ids.extend(ids)
+            batch.update_metadatas.extend(metadatas)
+        self._add(collection, path, len(ids), _ROW_OVERHEAD * len(ids), False, apply)
+
+    def upsert(self, collection, path: str, ids: List[str], documents: List[str],
+               metadatas: List[Dict[str, Any]], embeddings: List[List[float]]):
+        nbytes = sum(len(doc) for doc in documents) + sum(4 * len(e) for e in embeddings) + _ROW_OVERHEAD * len(ids)
+
+        def apply(batch):
+            batch.ids.extend(ids)
+            batch.documents.extend(documents)
+            batch.metadatas.extend(metadatas)
+            batch.embeddings.extend(embeddings)
+        self._add(collection, path, len(ids), nbytes, False, apply)
+
+    def sync(self) -> Set[str]:
+        """Wait until everything queued so far is written. Returns the paths whose writes failed since the last sync."""
+        with self.cond:
+            self._seal()
+            self.cond.notify_all()
+            while self.sealed or self.writing:
+                self.cond.wait(timeout=0.5)
+            failed, self.failed_paths = self.failed_paths, set()
+        return failed
+
+    def close(self) -> Set[str]:
+        failed = self.sync()
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.thread.join(timeout=5)
+        return failed
+
+    def _seal(self):
+        # Caller holds self.cond
+        if self.open:
+            self.sealed.append((list(self.open.values()), self.open_bytes))
+        self.open, self.open_paths = {}, set()
+        self.open_rows = self.open_bytes = 0
+        self.open_since = None
+
+    # -- writer thread --
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.sealed:
+                    if self.open_since is not None and time.monotonic() - self.open_since >= self.flush_seconds:
+                        self._seal()
+                        break
+                    if self.closed:
+                        return
+                    self.cond.wait(timeout=min(self.flush_seconds, 0.5))
+                batches, nbytes = self.sealed.popleft()
+                self.writing = True
+            rows = 0
+            t0 = time.perf_counter()
+            for batch in batches:
+                rows += self._write(batch)
+            elapsed = time.perf_counter() - t0
+            with self.cond:
+                self.writing = False
+                self.pending_bytes -= nbytes
+                self._record(rows, elapsed)
+                self.cond.notify_all()
+
+    def _write(self, batch: _Batch) -> int:
+        collection = batch.collection
+        try:
+            for i in range(0, len(batch.delete_paths), 500):
+                collection.delete(where={"path": {"$in": batch.delete_paths[i:i + 500]}})
+            if batch.delete_ids:
+                collection.delete(ids=batch.delete_ids)
+            if batch.update_ids:
+                collection.update(ids=batch.update_ids, metadatas=batch.update_metadatas)
+            # One file may bring more rows than a batch; keep single calls to batch size
+            step = max(self.batch_rows, 1)
+            for i in range(0, len(batch.ids), step):
+                # upsert: chunks of a file whose state never got committed (stop/crash) may already exist
+                collection.upsert(ids=batch.ids[i:i + step], documents=batch.documents[i:i + step],
+                                  metadatas=batch.metadatas[i:i + step], embeddings=batch.embeddings[i:i + step])
+        except Exception as e:
+            logger.error(f"Error writing batch to Chroma ({len(batch.paths)} files): {e}")
+            with self.cond:
+                self.failed_paths.update(batch.paths)
+            return 0
+        return len(batch.delete_paths) + len(batch.delete_ids) + len(batch.update_ids) + len(batch.ids)
+
+    def _record(self, rows: int, elapsed: float):
+        # Caller holds self.cond
+        self.batches_written += 1
+        self.rows_written += rows
+        self.write_seconds += elapsed
+        self.last_write_ms = elapsed * 1000
+        self.max_write_ms = max(self.max_write_ms, self.last_write_ms)
+        # Adapt the batch size to the measured write speed
+        if rows >= self.target_rows // 2:
+            if elapsed > WRITE_TARGET_SECONDS:
+                self.target_rows = max(WRITE_MIN_ROWS, self.target_rows // 2)
+            elif elapsed < WRITE_TARGET_SECONDS / 4:
+                self.target_rows = min(self.batch_rows, self.target_rows * 2)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.cond:
+            return {
+                "batches": self.batches_written,
+                "rows": self.rows_written,
+                "avg_write_ms": round(self.write_seconds * 1000 / self.batches_written, 1) if self.batches_written else 0.0,
+                "last_write_ms": round(self.last_write_ms, 1),
+                "max_write_ms": round(self.max_write_ms, 1),
+                "target_rows": self.target_rows,
+                "pending_bytes": self.pending_bytes,
+                "blocked_seconds": round(self.blocked_seconds, 2),
+            }